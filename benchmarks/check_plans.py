@@ -0,0 +1,200 @@
+"""EXPLAIN regression check for the hot queries.
+
+Builds a throwaway `plan_check` schema with schema_migrations.migrate(), seeds
+it with the benchmark corpus, runs VACUUM ANALYZE, then EXPLAINs the queries the
+collectors and the enrichment daemon run on every pass. It fails (exit 1) if
+any of them plans a sequential scan of one of the big tables, i.e. if a
+schema change dropped or broke an index they rely on.
+
+The queries are the real ones: each hot function runs against a client that
+records its statements instead of executing them.
+
+    python benchmarks/check_plans.py --database-url postgresql://...
+"""
+
+import argparse
+import os
+import sys
+
+from run_benchmarks import bench_db_url
+from corpus import CorpusSpec, generate_corpus
+
+PLAN_SCHEMA = "plan_check"
+# tables that grow with every run, so a sequential scan per call is a
+# regression (pending_more_comments is a work queue, emptied as stubs expand)
+GUARDED_TABLES = {
+    "posts",
+    "comments",
+    "cleaned_comments",
+    "sentiment_analysis",
+    "post_crawl_state",
+    "subreddit_daily_sentiment",
+}
+# tables a query reads in full by design, as name -> tables. The enrichment
+# sweep looks for any comment still missing a cleaned_comments or
+# sentiment_analysis row, so it has to visit every comment; it runs at daemon
+# startup and every ENRICH_DAEMON_SWEEP_SECONDS rather than per notification,
+# and the tables it anti-joins are still read through their comment_id keys.
+FULL_READS = {"pending_sweep": {"comments"}}
+# many small subreddits, so a per-subreddit query reads a sliver of each table
+CHECK_SPEC = CorpusSpec(subreddits=200, posts_per_subreddit=200, comments_per_post=2)
+
+SEED_SQL = """
+INSERT INTO post_crawl_state (post_id, comments_fetched_at, num_comments_seen)
+SELECT post_id, CURRENT_TIMESTAMP, num_comments
+FROM posts
+WHERE mod(abs(hashtext(post_id)), 4) <> 0;
+INSERT INTO pending_more_comments (post_id, parent_id, more_id, child_count, depth)
+SELECT post_id, 't3_' || post_id, 'm' || post_id, 10, 0
+FROM posts
+WHERE mod(abs(hashtext(post_id)), 10) = 0;
+INSERT INTO cleaned_comments (comment_id, cleaned_body, word_count)
+SELECT comment_id, lower(body), 1
+FROM comments
+WHERE mod(abs(hashtext(comment_id)), 10) <> 0;
+INSERT INTO sentiment_analysis (comment_id, vader_compound)
+SELECT comment_id, 0.0
+FROM comments
+WHERE mod(abs(hashtext(comment_id)), 10) <> 0;
+"""
+
+
+class RecordingClient:
+    """Stands in for DBClient: records the statements a function would run
+    and returns no rows."""
+
+    def __init__(self):
+        self.statements = []
+
+    def fetch_one(self, query, params=None):
+        self.statements.append((query, params or {}))
+        return None
+
+    def fetch_all(self, query, params=None):
+        self.statements.append((query, params or {}))
+        return []
+
+    def stream(self, query, params=None, chunk_size=None):
+        self.statements.append((query, params or {}))
+        return iter(())
+
+
+def hot_queries(sample):
+    """name -> function running one hot query against a client."""
+    from comment_enricher import get_comments
+    from comments_table_populate import get_pending_stubs, get_posts_to_crawl
+    from seen_ids import stored_comment_ids, stored_mark, stored_post_ids
+    from sentiment_trends import sentiment_trend
+
+    subreddit_id = sample["subreddit_id"]
+    return {
+        "posts_to_crawl": lambda db: get_posts_to_crawl(db, subreddit_id),
+        "pending_stubs": lambda db: get_pending_stubs(db, subreddit_id),
+        "seen_post_ids": lambda db: list(stored_post_ids(db, subreddit_id)),
+        "seen_comment_ids": lambda db: list(stored_comment_ids(db, subreddit_id)),
+        "seen_post_mark": lambda db: stored_mark(db, "posts", subreddit_id),
+        "seen_comment_mark": lambda db: stored_mark(db, "comments", subreddit_id),
+        "notified_comments": lambda db: get_comments(
+            db, comment_ids=sample["comment_ids"]
+        ),
+        "pending_sweep": lambda db: get_comments(db),
+        "daily_trend": lambda db: sentiment_trend(
+            db, [sample["subreddit"]], "day", sample["trend_start"]
+        ),
+    }
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def seq_scans(db_client, query, params):
+    """The guarded tables a query's plan scans sequentially."""
+    with db_client.session() as s:
+        row = s.fetch_one(f"EXPLAIN (FORMAT JSON) {query}", params)
+    plan = row["QUERY PLAN"][0]["Plan"]
+    return sorted(
+        {
+            node["Relation Name"]
+            for node in plan_nodes(plan)
+            if node["Node Type"] == "Seq Scan"
+            and node["Relation Name"] in GUARDED_TABLES
+        }
+    )
+
+
+def build_schema(database_url, corpus):
+    from sqlalchemy import create_engine
+    from clients import DBClient
+    from schema_migrations import migrate
+
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {PLAN_SCHEMA} CASCADE")
+        conn.exec_driver_sql(f"CREATE SCHEMA {PLAN_SCHEMA}")
+    engine.dispose()
+
+    db_client = DBClient(bench_db_url(database_url, PLAN_SCHEMA))
+    migrate(db_client)
+    with db_client.session() as s:
+        s.bulk_load("subreddits", corpus.subreddits, conflict_key="subreddit")
+        s.bulk_load("authors", corpus.authors, conflict_key="author_fullname")
+        s.bulk_load("posts", corpus.posts, conflict_key="post_id")
+        s.bulk_load("comments", corpus.comments, conflict_key="comment_id")
+        s.conn.exec_driver_sql(SEED_SQL)
+    # statistics for the planner and, as autovacuum would set it, the visibility
+    # map that makes index-only scans worth it
+    with db_client.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.exec_driver_sql("VACUUM ANALYZE")
+    return db_client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv("BENCH_DATABASE_URL"),
+        help="Postgres to check against (default: $BENCH_DATABASE_URL); "
+        f"recreates the '{PLAN_SCHEMA}' schema, never touches other schemas",
+    )
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("--database-url (or $BENCH_DATABASE_URL) is required")
+
+    print("Seeding the plan_check schema...", file=sys.stderr)
+    corpus = generate_corpus(CHECK_SPEC)
+    db_client = build_schema(args.database_url, corpus)
+    subreddit = corpus.subreddits[len(corpus.subreddits) // 2]
+    sample = {
+        "subreddit_id": subreddit["subreddit_id"],
+        "subreddit": subreddit["subreddit"],
+        "comment_ids": [c["comment_id"] for c in corpus.comments[-50:]],
+        "trend_start": corpus.comments[-1]["created_utc"].date(),
+    }
+
+    failures = 0
+    for name, run in hot_queries(sample).items():
+        recorder = RecordingClient()
+        run(recorder)
+        for query, params in recorder.statements:
+            scanned = [
+                table
+                for table in seq_scans(db_client, query, params)
+                if table not in FULL_READS.get(name, ())
+            ]
+            if scanned:
+                failures += 1
+                print(f"FAIL {name}: sequential scan of {', '.join(scanned)}")
+            else:
+                print(f"ok   {name}")
+
+    if failures:
+        print(f"{failures} hot queries regressed to sequential scans.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Diff two run_benchmarks.py result files.
+
+    python benchmarks/compare.py before.json after.json --threshold 0.1
+
+Exits non-zero when any benchmark's rows/sec dropped by more than threshold.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return report["meta"], {result["name"]: result for result in report["results"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="fractional rows/sec drop counted as a regression (default 0.1)",
+    )
+    args = parser.parse_args()
+
+    before_meta, before = load_results(args.before)
+    after_meta, after = load_results(args.after)
+
+    if before_meta.get("corpus") != after_meta.get("corpus"):
+        print("Warning: the two runs used different corpora.", file=sys.stderr)
+
+    print(f"{before_meta.get('commit')} -> {after_meta.get('commit')}")
+    print(
+        f"{'benchmark':<24}{'before rows/s':>16}{'after rows/s':>16}"
+        f"{'change':>10}{'peak RSS MB':>18}"
+    )
+
+    regressions = []
+    for name in [*before, *(name for name in after if name not in before)]:
+        old, new = before.get(name), after.get(name)
+        if old is None or new is None:
+            print(f"{name:<24}{'(only in one run)':>32}")
+            continue
+
+        old_rate, new_rate = old["rows_per_sec"] or 0, new["rows_per_sec"] or 0
+        change = (new_rate - old_rate) / old_rate if old_rate else 0.0
+        if change < -args.threshold:
+            regressions.append(name)
+        rss = f"{old['peak_rss_mb']} -> {new['peak_rss_mb']}"
+        flag = "  <-- regression" if name in regressions else ""
+        print(
+            f"{name:<24}{old_rate:>16,.0f}{new_rate:>16,.0f}"
+            f"{change:>+10.1%}{rss:>18}{flag}"
+        )
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Seeded synthetic Reddit corpus for the benchmarks.
+
+Rows come out shaped like the tables in src/sql/schema.sql. The same seed and
+sizes always give the same corpus, so results from different commits compare.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import math
+import random
+
+WORDS = (
+    "data sql query table index join pandas python spark pipeline warehouse "
+    "dashboard model regression feature training dataset schema etl dbt airflow "
+    "postgres excel pivot chart metric analyst engineer career interview job "
+    "learn course book tutorial question answer help thanks great good bad "
+    "terrible awesome love hate slow fast memory cluster cloud aws azure gcp "
+    "the a an is are was it this that to of in for on with and or but not "
+    "i you we they my your our just really very also so because if when how why"
+).split()
+
+BOILERPLATE = (
+    "[deleted]",
+    "[removed]",
+    "Thanks!",
+    "Thank you!",
+    "This.",
+    "+1",
+    "I am a bot, and this action was performed automatically. Please contact "
+    "the moderators of this subreddit if you have any questions or concerns.",
+    "Your post has been removed because it violates rule 3: no low-effort "
+    "questions. Please read the sidebar before posting.",
+)
+
+EMOJI = ("😂", "🙏", "🔥", "👍", "🤔", "😭", "💯", "🚀")
+
+DOMAINS = ("github.com", "stackoverflow.com", "docs.python.org", "imgur.com")
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        number, rem = divmod(number, 36)
+        out = digits[rem] + out
+        if not number:
+            return out
+
+
+@dataclass
+class CorpusSpec:
+    seed: int = 42
+    subreddits: int = 5
+    posts_per_subreddit: int = 40
+    # comments per post are lognormal around this median, capped at max
+    comments_per_post: int = 60
+    max_comments_per_post: int = 2000
+    authors: int = 2000
+    # share of posts whose thread is one long reply chain
+    deep_chain_share: float = 0.02
+    # share of comments that are boilerplate repeats
+    boilerplate_share: float = 0.08
+
+
+@dataclass
+class Corpus:
+    subreddits: list = field(default_factory=list)
+    authors: list = field(default_factory=list)
+    posts: list = field(default_factory=list)
+    comments: list = field(default_factory=list)
+
+
+class _Generator:
+    def __init__(self, spec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.next_id = 36**5  # six-character base36 ids, like Reddit's
+
+    def new_id(self):
+        self.next_id += self.rng.randint(1, 40)
+        return base36(self.next_id)
+
+    def body(self):
+        rng = self.rng
+        if rng.random() < self.spec.boilerplate_share:
+            return rng.choice(BOILERPLATE)
+
+        # word counts: median ~18, long tail of multi-paragraph answers
+        n_words = max(1, min(1500, int(rng.lognormvariate(math.log(18), 1.0))))
+        words = rng.choices(WORDS, k=n_words)
+        if rng.random() < 0.1:
+            words.insert(
+                rng.randrange(len(words) + 1),
+                f"https://{rng.choice(DOMAINS)}/{base36(rng.getrandbits(32))}",
+            )
+        if rng.random() < 0.05:
+            words.append(rng.choice(EMOJI))
+        if rng.random() < 0.1:
+            words[0] = words[0].capitalize() + "!"
+        text = " ".join(words)
+        if n_words > 80:
+            # paragraphs, as long answers have
+            text = text.replace(" the ", "\n\nThe ", 2)
+        return text
+
+    def thread_size(self):
+        size = self.rng.lognormvariate(math.log(self.spec.comments_per_post), 1.2)
+        return max(0, min(self.spec.max_comments_per_post, int(size)))
+
+
+def generate_corpus(spec=None):
+    """Build a Corpus of row dicts: subreddits, authors, posts and comment trees
+    with realistic body lengths, URLs, emoji, boilerplate repeats and deep
+    parent_id chains."""
+    spec = spec or CorpusSpec()
+    gen = _Generator(spec)
+    rng = gen.rng
+    corpus = Corpus()
+
+    for i in range(spec.authors):
+        corpus.authors.append(
+            {"author_fullname": f"t2_{gen.new_id()}", "author_name": f"user_{i}"}
+        )
+    author_ids = [author["author_fullname"] for author in corpus.authors]
+
+    for s in range(spec.subreddits):
+        subreddit_id = s + 1
+        corpus.subreddits.append(
+            {
+                "subreddit_id": subreddit_id,
+                "subreddit": f"bench_{s}",
+                "member_count": rng.randint(1_000, 2_000_000),
+            }
+        )
+
+        for _ in range(spec.posts_per_subreddit):
+            post_id = gen.new_id()
+            post_created = EPOCH + timedelta(seconds=rng.randint(0, 365 * 86400))
+            n_comments = gen.thread_size()
+            corpus.posts.append(
+                {
+                    "post_id": post_id,
+                    "subreddit_id": subreddit_id,
+                    "author_fullname": rng.choice(author_ids),
+                    "title": " ".join(rng.choices(WORDS, k=rng.randint(4, 14))),
+                    "selftext": gen.body() if rng.random() < 0.6 else "",
+                    "created_utc": post_created,
+                    "url": f"https://www.reddit.com/r/bench_{s}/comments/{post_id}/",
+                    "flair": rng.choice((None, "Discussion", "Question", "Career")),
+                    "score": int(rng.paretovariate(1.2)),
+                    "num_comments": n_comments,
+                    "upvote_ratio": round(rng.uniform(0.5, 1.0), 2),
+                    "stickied": rng.random() < 0.01,
+                }
+            )
+            deep_chain = rng.random() < spec.deep_chain_share
+            corpus.comments.extend(
+                _thread(gen, post_id, post_created, n_comments, author_ids, deep_chain)
+            )
+
+    return corpus
+
+
+def _thread(gen, post_id, post_created, n_comments, author_ids, deep_chain):
+    rng = gen.rng
+    comments = []
+    depths = {}
+    op = rng.choice(author_ids)
+    created = post_created
+
+    for _ in range(n_comments):
+        comment_id = gen.new_id()
+        if deep_chain and comments:
+            parent = comments[-1]["comment_id"]
+        elif comments and rng.random() < 0.6:
+            # replies favour recent comments, which builds long chains
+            recent = comments[-min(len(comments), 20) :]
+            parent = rng.choice(recent)["comment_id"]
+        else:
+            parent = None
+
+        depth = depths[parent] + 1 if parent else 0
+        depths[comment_id] = depth
+        author = op if rng.random() < 0.05 else rng.choice(author_ids)
+        created += timedelta(seconds=int(rng.expovariate(1 / 600)))
+
+        comments.append(
+            {
+                "comment_id": comment_id,
+                "post_id": post_id,
+                "author_fullname": None if rng.random() < 0.03 else author,
+                "parent_id": f"t1_{parent}" if parent else f"t3_{post_id}",
+                "body": gen.body(),
+                "created_utc": created,
+                "score": int(rng.paretovariate(1.1)) - rng.randint(0, 2),
+                "depth": depth,
+                "is_submitter": author == op,
+                "stickied": False,
+            }
+        )
+
+    return comments
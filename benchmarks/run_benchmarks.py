@@ -0,0 +1,417 @@
+"""Throughput benchmarks for the pipeline stages.
+
+Micro benchmarks run in memory:
+- clean_text and VADER scoring;
+- fused enrichment, with and without the result cache;
+- collector batch building.
+
+Macro benchmarks need a Postgres (e.g. the docker-compose one) and run the
+real write paths against a throwaway `bench` schema:
+- post and comment bulk loads;
+- end-to-end enrichment;
+- the Usefulness Index.
+
+Every benchmark runs in a fresh process, so its peak RSS is its own. Results
+are written as JSON for compare.py to diff between commits.
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --database-url postgresql://... \
+        --output after.json
+    python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timezone
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+for path in (SRC_DIR, os.path.join(SRC_DIR, "data_collection_scripts")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from corpus import CorpusSpec, generate_corpus  # noqa: E402
+
+BENCH_SCHEMA = "bench"
+SCHEMA_SQL = os.path.join(SRC_DIR, "sql", "schema.sql")
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def bench_db_url(db_url, schema=BENCH_SCHEMA):
+    """db_url with every connection pinned to schema."""
+    separator = "&" if "?" in db_url else "?"
+    return f"{db_url}{separator}options={quote(f'-csearch_path={schema}')}"
+
+
+# --- micro benchmarks: each takes (corpus, options) and returns a timed callable
+
+
+def micro_clean_text(corpus, options):
+    from comment_enricher import clean_text, load_stop_words
+
+    stop_words = load_stop_words()
+    bodies = [comment["body"] for comment in corpus.comments]
+
+    def run():
+        for body in bodies:
+            clean_text(body, stop_words)
+        return len(bodies)
+
+    return run
+
+
+def micro_vader(corpus, options):
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+    analyzer = SentimentIntensityAnalyzer()
+    bodies = [comment["body"] for comment in corpus.comments]
+
+    def run():
+        for body in bodies:
+            analyzer.polarity_scores(body)
+        return len(bodies)
+
+    return run
+
+
+def _enrichment_requests(corpus):
+    return [
+        (comment["comment_id"], comment["body"], True, True)
+        for comment in corpus.comments
+    ]
+
+
+def micro_enrich(corpus, options):
+    from comment_enricher import CommentEnricher, load_stop_words
+
+    enricher = CommentEnricher(load_stop_words())
+    comments = _enrichment_requests(corpus)
+    chunk_size = options["chunk_size"]
+
+    def run():
+        for start in range(0, len(comments), chunk_size):
+            enricher.enrich(comments[start : start + chunk_size])
+        return len(comments)
+
+    return run
+
+
+def micro_enrich_cached(corpus, options):
+    from comment_enricher import (
+        CommentEnricher,
+        load_stop_words,
+        plan_chunk,
+        resolve_chunk,
+    )
+    from result_cache import ResultCache
+
+    enricher = CommentEnricher(load_stop_words())
+    comments = _enrichment_requests(corpus)
+    chunk_size = options["chunk_size"]
+
+    def run():
+        cache = ResultCache()
+        computed = 0
+        for start in range(0, len(comments), chunk_size):
+            plan, requests = plan_chunk(comments[start : start + chunk_size], cache)
+            resolve_chunk(plan, *enricher.enrich(requests), cache)
+            computed += len(requests)
+        return len(comments), {"hit_rate": 1 - computed / max(len(comments), 1)}
+
+    return run
+
+
+def micro_comment_batch(corpus, options):
+    import praw
+    from praw.models import Comment
+    from comments_table_populate import CommentBatch
+
+    reddit = praw.Reddit(client_id="bench", client_secret="bench", user_agent="bench")
+    comments = [
+        Comment(
+            reddit,
+            _data={
+                **row,
+                "id": row["comment_id"],
+                # the API's author is a name, "[deleted]" when there is none
+                "author": (
+                    f"user_{row['author_fullname']}"
+                    if row["author_fullname"]
+                    else "[deleted]"
+                ),
+                "created_utc": row["created_utc"].timestamp(),
+            },
+        )
+        for row in corpus.comments
+    ]
+
+    def run():
+        batch_size = options["chunk_size"]
+        for start in range(0, len(comments), batch_size):
+            batch = CommentBatch()
+            for comment in comments[start : start + batch_size]:
+                batch.append(comment, comment.post_id)
+            batch.to_arrow()
+        return len(comments)
+
+    return run
+
+
+# --- macro benchmarks: run in order against the bench schema
+
+
+def macro_load_posts(corpus, options):
+    from sqlalchemy import create_engine
+    from clients import DBClient
+
+    # fresh bench schema from the current schema.sql
+    engine = create_engine(options["database_url"])
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.exec_driver_sql(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    engine.dispose()
+
+    db_client = DBClient(bench_db_url(options["database_url"]))
+    with db_client.session() as s:
+        with open(SCHEMA_SQL, encoding="utf-8") as f:
+            s.conn.exec_driver_sql(f.read())
+
+    def run():
+        with db_client.session() as s:
+            s.bulk_load("subreddits", corpus.subreddits, conflict_key="subreddit")
+            s.bulk_load("authors", corpus.authors, conflict_key="author_fullname")
+            s.bulk_load(
+                "posts",
+                corpus.posts,
+                conflict_key="post_id",
+                on_conflict="update",
+                update_columns=("score", "num_comments", "upvote_ratio", "stickied"),
+            )
+        return len(corpus.subreddits) + len(corpus.authors) + len(corpus.posts)
+
+    return run
+
+
+def macro_write_comments(corpus, options):
+    import pyarrow as pa
+    from clients import DBClient
+    from comments_table_populate import COMMENT_SCHEMA, write_comment_batch
+
+    db_client = DBClient(bench_db_url(options["database_url"]))
+    batch_size = options["chunk_size"]
+    # batches arrive as Arrow tables, as CommentBatch.to_arrow() builds them
+    batches = [
+        pa.Table.from_pylist(
+            corpus.comments[start : start + batch_size], COMMENT_SCHEMA
+        )
+        for start in range(0, len(corpus.comments), batch_size)
+    ]
+    now = datetime.now(timezone.utc)
+
+    def run():
+        inserted = 0
+        for batch in batches:
+            post_ids = set(batch.column("post_id").to_pylist())
+            crawl_states = [
+                {
+                    "post_id": post_id,
+                    "comments_fetched_at": now,
+                    "num_comments_seen": None,
+                    "newest_comment_utc": None,
+                }
+                for post_id in post_ids
+            ]
+            inserted += write_comment_batch(db_client, batch, {}, crawl_states)
+        return inserted
+
+    return run
+
+
+def macro_enrich_comments(corpus, options):
+    from clients import DBClient
+    from comment_enricher import enrich_comments, load_stop_words
+
+    db_client = DBClient(bench_db_url(options["database_url"]))
+    stop_words = load_stop_words()
+
+    def run():
+        cleaned, _ = enrich_comments(
+            db_client,
+            stop_words=stop_words,
+            chunk_size=options["chunk_size"],
+            workers=options["workers"],
+        )
+        return cleaned
+
+    return run
+
+
+def macro_usefulness_index(corpus, options):
+    from clients import DBClient
+    from usefulness_index import compute_usefulness_index
+
+    db_client = DBClient(bench_db_url(options["database_url"]))
+
+    def run():
+        live = compute_usefulness_index(db_client, from_rollups=False)
+        compute_usefulness_index(db_client, from_rollups=True)
+        return len(live)
+
+    return run
+
+
+MICRO = {
+    "clean_text": micro_clean_text,
+    "vader_polarity_scores": micro_vader,
+    "enrich": micro_enrich,
+    "enrich_cached": micro_enrich_cached,
+    "comment_batch": micro_comment_batch,
+}
+# order matters: each one works on what the previous one loaded
+MACRO = {
+    "load_posts": macro_load_posts,
+    "write_comment_batch": macro_write_comments,
+    "enrich_comments": macro_enrich_comments,
+    "usefulness_index": macro_usefulness_index,
+}
+
+
+def run_benchmark(kind, name, spec, options):
+    """Build the corpus, set the benchmark up, then time it. Runs in its own
+    process."""
+    corpus = generate_corpus(spec)
+    setup = (MICRO if kind == "micro" else MACRO)[name]
+    run = setup(corpus, options)
+
+    started = time.perf_counter()
+    result = run()
+    seconds = time.perf_counter() - started
+
+    rows, extra = result if isinstance(result, tuple) else (result, {})
+    return {
+        "name": name,
+        "kind": kind,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(rows / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        **extra,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--subreddits", type=int, default=CorpusSpec.subreddits)
+    parser.add_argument(
+        "--posts-per-subreddit", type=int, default=CorpusSpec.posts_per_subreddit
+    )
+    parser.add_argument(
+        "--comments-per-post", type=int, default=CorpusSpec.comments_per_post
+    )
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=1, help="enrichment workers")
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv("BENCH_DATABASE_URL"),
+        help="Postgres for the macro benchmarks (default: $BENCH_DATABASE_URL); "
+        f"they recreate the '{BENCH_SCHEMA}' schema, never touch other schemas",
+    )
+    parser.add_argument("--only", nargs="+", help="run only these benchmarks (by name)")
+    parser.add_argument("--output", help="write results here instead of stdout")
+    args = parser.parse_args()
+
+    spec = CorpusSpec(
+        seed=args.seed,
+        subreddits=args.subreddits,
+        posts_per_subreddit=args.posts_per_subreddit,
+        comments_per_post=args.comments_per_post,
+    )
+    options = {
+        "chunk_size": args.chunk_size,
+        "workers": args.workers,
+        "database_url": args.database_url,
+    }
+
+    plan = [("micro", name) for name in MICRO]
+    if args.database_url:
+        plan += [("macro", name) for name in MACRO]
+    else:
+        print("No --database-url: skipping the macro benchmarks.", file=sys.stderr)
+    if args.only:
+        plan = [(kind, name) for kind, name in plan if name in args.only]
+
+    results = []
+    for kind, name in plan:
+        print(f"Running {kind} benchmark '{name}'...", file=sys.stderr)
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            result = pool.submit(run_benchmark, kind, name, spec, options).result()
+        print(
+            f"  {result['rows']} rows in {result['seconds']}s "
+            f"({result['rows_per_sec']} rows/s, peak RSS {result['peak_rss_mb']} MB)",
+            file=sys.stderr,
+        )
+        results.append(result)
+
+    corpus = generate_corpus(spec)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "corpus": {
+                **asdict(spec),
+                "rows": {
+                    "subreddits": len(corpus.subreddits),
+                    "authors": len(corpus.authors),
+                    "posts": len(corpus.posts),
+                    "comments": len(corpus.comments),
+                },
+            },
+            "options": {k: v for k, v in options.items() if k != "database_url"},
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
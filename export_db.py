@@ -1,9 +1,15 @@
+import argparse
+from contextlib import closing
+from itertools import groupby
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import psycopg2
-import pandas as pd
+from psycopg2 import sql
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 
-
 load_dotenv()
 
 db_params = {
@@ -14,74 +20,387 @@ db_params = {
     "port": os.getenv("DB_PORT"),
 }
 
-tables_to_export = [
-    "subreddits",
-    "authors",
-    "posts",
-    "comments",
-    "sentiment_analysis",
-    "cleaned_comments",
-]
+UTC_TIMESTAMP = pa.timestamp("us", tz="UTC")
+
+# explicit Arrow schemas mirroring sql/schema.sql, so ids stay strings, integer
+# columns with NULLs stay integers and timestamps keep their type and zone
+TABLE_SCHEMAS = {
+    "subreddits": pa.schema(
+        [
+            ("subreddit_id", pa.int32()),
+            ("subreddit", pa.string()),
+            ("member_count", pa.int32()),
+            ("member_count_date", pa.timestamp("us")),
+            ("collection_date", pa.timestamp("us")),
+        ]
+    ),
+    "authors": pa.schema(
+        [
+            ("author_fullname", pa.string()),
+            ("author_name", pa.string()),
+        ]
+    ),
+    "posts": pa.schema(
+        [
+            ("post_id", pa.string()),
+            ("subreddit_id", pa.int32()),
+            ("author_fullname", pa.string()),
+            ("title", pa.string()),
+            ("selftext", pa.string()),
+            ("created_utc", UTC_TIMESTAMP),
+            ("url", pa.string()),
+            ("flair", pa.string()),
+            ("score", pa.int32()),
+            ("num_comments", pa.int32()),
+            ("upvote_ratio", pa.float32()),
+            ("stickied", pa.bool_()),
+        ]
+    ),
+    "comments": pa.schema(
+        [
+            ("comment_id", pa.string()),
+            ("post_id", pa.string()),
+            ("author_fullname", pa.string()),
+            ("parent_id", pa.string()),
+            ("body", pa.string()),
+            ("created_utc", UTC_TIMESTAMP),
+            ("score", pa.int32()),
+            ("depth", pa.int32()),
+            ("is_submitter", pa.bool_()),
+            ("stickied", pa.bool_()),
+            ("ingested_at", UTC_TIMESTAMP),
+        ]
+    ),
+    "sentiment_analysis": pa.schema(
+        [
+            ("analysis_id", pa.int32()),
+            ("comment_id", pa.string()),
+            ("vader_compound", pa.float64()),
+            ("vader_positive", pa.float64()),
+            ("vader_negative", pa.float64()),
+            ("vader_neutral", pa.float64()),
+            ("analysis_date", UTC_TIMESTAMP),
+        ]
+    ),
+    "cleaned_comments": pa.schema(
+        [
+            ("comment_id", pa.string()),
+            ("cleaned_body", pa.string()),
+            ("word_count", pa.int32()),
+            ("cleaning_date", UTC_TIMESTAMP),
+        ]
+    ),
+}
+
+tables_to_export = list(TABLE_SCHEMAS)
 
 CSV_DIR = "csv_exports"
 PARQUET_DIR = "parquet_exports"
 
+# rows per server-side cursor fetch and per Parquet row group
+BATCH_SIZE = 50_000
+
+# --incremental: these tables only export rows whose watermark column (set when
+# the row was written) moved past the one recorded in the manifest, as new files
+# under <table>/subreddit=<name>/month=<YYYY-MM of the comment>/; the small
+# tables are re-exported in full every run
+INCREMENTAL_TABLES = {
+    "comments": "ingested_at",
+    "sentiment_analysis": "analysis_date",
+    "cleaned_comments": "cleaning_date",
+}
+MANIFEST_PATH = os.path.join(PARQUET_DIR, "_manifest.json")
+# rows newer than this are left for the next run: a row's timestamp is its
+# transaction's start, so a slow transaction can commit behind the watermark
+SETTLE_SECONDS = 900
+
+
+def create_directories(formats):
+    dirs = [CSV_DIR if fmt == "csv" else PARQUET_DIR for fmt in formats]
+    for directory in dirs:
+        os.makedirs(directory, exist_ok=True)
+    print(f"Created directories: {', '.join(f'{d}/' for d in dirs)}")
+
+
+def fetch_batches(conn, query, params=None, batch_size=BATCH_SIZE, name="export"):
+    """Run query on a server-side cursor and yield lists of at most batch_size
+    row tuples."""
+    with conn.cursor(name=name) as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def to_record_batch(rows, schema):
+    columns = zip(*rows)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def record_batches(conn, table_name, schema, batch_size=BATCH_SIZE):
+    """Stream a table through a server-side cursor as Arrow record batches of at
+    most batch_size rows, typed by schema."""
+    query = sql.SQL("SELECT {columns} FROM {table}").format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, schema.names)),
+        table=sql.Identifier(table_name),
+    )
+
+    for rows in fetch_batches(conn, query, None, batch_size, f"export_{table_name}"):
+        yield to_record_batch(rows, schema)
+
+
+def export_table_to_parquet(table_name, batch_size=BATCH_SIZE):
+    schema = TABLE_SCHEMAS[table_name]
+    parquet_filepath = os.path.join(PARQUET_DIR, f"{table_name}.parquet")
+    # written next to the target and renamed at the end, so a failed export
+    # never leaves a truncated file behind
+    tmp_filepath = f"{parquet_filepath}.tmp"
+
+    rows = 0
+    with closing(psycopg2.connect(**db_params)) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SET TIME ZONE 'UTC'")
 
-def create_directories():
-    os.makedirs(CSV_DIR, exist_ok=True)
-    os.makedirs(PARQUET_DIR, exist_ok=True)
-    print(f"Created directories: '{CSV_DIR}/' and '{PARQUET_DIR}/'")
+        with pq.ParquetWriter(tmp_filepath, schema, compression="snappy") as writer:
+            for batch in record_batches(conn, table_name, schema, batch_size):
+                writer.write_batch(batch, row_group_size=batch_size)
+                rows += batch.num_rows
 
+    os.replace(tmp_filepath, parquet_filepath)
+    return parquet_filepath, rows
 
-def export_postgres_to_csv():
-    print("\n--- Starting PostgreSQL to CSV Export ---")
-    try:
-        with psycopg2.connect(**db_params) as conn:
-            with conn.cursor() as cursor:
-                for table_name in tables_to_export:
-                    csv_filepath = os.path.join(CSV_DIR, f"{table_name}.csv")
-                    print(f"Exporting table '{table_name}' to '{csv_filepath}'...")
 
-                    sql_query = f"COPY {table_name} TO STDOUT WITH CSV HEADER"
+def export_table_to_csv(table_name):
+    csv_filepath = os.path.join(CSV_DIR, f"{table_name}.csv")
+    sql_query = f"COPY {table_name} TO STDOUT WITH CSV HEADER"
 
-                    with open(csv_filepath, "w", encoding="utf-8") as f:
-                        cursor.copy_expert(sql_query, f)
+    with closing(psycopg2.connect(**db_params)) as conn:
+        with conn.cursor() as cursor:
+            with open(csv_filepath, "w", encoding="utf-8") as f:
+                cursor.copy_expert(sql_query, f)
 
-                    print(f"Successfully exported '{table_name}'.")
+    return csv_filepath, None
 
-    except psycopg2.OperationalError as e:
-        print(f"Error connecting to the database: {e}")
-        print("Please check your .env file and ensure PostgreSQL is running.")
-    except Exception as e:
-        print(f"An unexpected error occurred during CSV export: {e}")
 
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH, encoding="utf-8") as f:
+        return json.load(f)
 
-def convert_csv_to_parquet():
-    print("\n--- Starting CSV to Parquet Conversion ---")
-    try:
-        for table_name in tables_to_export:
-            csv_filepath = os.path.join(CSV_DIR, f"{table_name}.csv")
-            parquet_filepath = os.path.join(PARQUET_DIR, f"{table_name}.parquet")
 
-            if os.path.exists(csv_filepath):
-                print(f"Converting '{csv_filepath}' to '{parquet_filepath}'...")
+def save_manifest(manifest):
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
 
-                df = pd.read_csv(csv_filepath)
 
-                df.to_parquet(parquet_filepath, index=False)
+def incremental_query(table_name, schema, watermark_column):
+    """New rows of table_name with their partition keys, sorted by partition so
+    each partition's rows arrive together."""
+    if table_name == "comments":
+        source = sql.SQL("comments AS t")
+    else:
+        source = sql.SQL(
+            "{table} AS t JOIN comments AS c ON c.comment_id = t.comment_id"
+        ).format(table=sql.Identifier(table_name))
+    comment_alias = "t" if table_name == "comments" else "c"
 
-                print(f"Successfully converted '{table_name}' to Parquet.")
+    return sql.SQL("""
+        SELECT {columns}, s.subreddit,
+            to_char({c}.created_utc AT TIME ZONE 'UTC', 'YYYY-MM') AS month
+        FROM {source}
+        JOIN posts AS p ON p.post_id = {c}.post_id
+        JOIN subreddits AS s ON s.subreddit_id = p.subreddit_id
+        WHERE (%(since)s::timestamptz IS NULL OR t.{watermark} > %(since)s)
+            AND t.{watermark} <= %(cutoff)s
+        ORDER BY s.subreddit, month
+        """).format(
+        columns=sql.SQL(", ").join(sql.Identifier("t", name) for name in schema.names),
+        c=sql.Identifier(comment_alias),
+        source=source,
+        watermark=sql.Identifier(watermark_column),
+    )
+
+
+def export_table_incremental(
+    table_name, since=None, settle_seconds=SETTLE_SECONDS, batch_size=BATCH_SIZE
+):
+    """Export the rows written after since (an ISO timestamp, None for all) as
+    one new file per touched partition. Returns (files, rows, new watermark);
+    on failure the files of this run are removed, so a retry starts clean."""
+    schema = TABLE_SCHEMAS[table_name]
+    query = incremental_query(table_name, schema, INCREMENTAL_TABLES[table_name])
+
+    files = []
+    rows = 0
+    writer = None
+    with closing(psycopg2.connect(**db_params)) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SET TIME ZONE 'UTC'")
+            cursor.execute(
+                "SELECT now() - make_interval(secs => %s)", (settle_seconds,)
+            )
+            cutoff = cursor.fetchone()[0]
+
+        run_id = cutoff.strftime("%Y%m%dT%H%M%S")
+        params = {"since": since, "cutoff": cutoff}
+        partition = None
+
+        try:
+            for batch in fetch_batches(
+                conn, query, params, batch_size, f"export_{table_name}"
+            ):
+                for key, group in groupby(batch, key=lambda row: row[-2:]):
+                    if key != partition:
+                        if writer is not None:
+                            writer.close()
+                            os.replace(f"{files[-1]}.tmp", files[-1])
+                        partition = key
+                        subreddit, month = key
+                        partition_dir = os.path.join(
+                            PARQUET_DIR,
+                            table_name,
+                            f"subreddit={subreddit}",
+                            f"month={month}",
+                        )
+                        os.makedirs(partition_dir, exist_ok=True)
+                        files.append(
+                            os.path.join(partition_dir, f"part-{run_id}.parquet")
+                        )
+                        writer = pq.ParquetWriter(
+                            f"{files[-1]}.tmp", schema, compression="snappy"
+                        )
+
+                    group_rows = [row[:-2] for row in group]
+                    writer.write_batch(to_record_batch(group_rows, schema))
+                    rows += len(group_rows)
+
+            if writer is not None:
+                writer.close()
+                os.replace(f"{files[-1]}.tmp", files[-1])
+        except Exception:
+            if writer is not None:
+                writer.close()
+            for path in files:
+                for leftover in (path, f"{path}.tmp"):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+            raise
+
+    return files, rows, cutoff.isoformat()
+
+
+def export_tables(
+    fmt="parquet",
+    workers=4,
+    batch_size=BATCH_SIZE,
+    incremental=False,
+    settle_seconds=SETTLE_SECONDS,
+):
+    """Export every table in parallel, one connection per table. With
+    incremental (Parquet only), INCREMENTAL_TABLES export just their new rows and
+    the manifest's watermarks advance for the tables that succeeded."""
+    mode = " (incremental)" if incremental else ""
+    print(f"\n--- Starting PostgreSQL to {fmt.upper()} Export{mode} ---")
+    manifest = load_manifest() if incremental else {}
+
+    def export(table_name):
+        if fmt == "csv":
+            return export_table_to_csv(table_name)
+        if incremental and table_name in INCREMENTAL_TABLES:
+            since = manifest.get(table_name, {}).get("watermark")
+            return export_table_incremental(
+                table_name, since, settle_seconds, batch_size
+            )
+        return export_table_to_parquet(table_name, batch_size)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(export, table): table for table in tables_to_export}
+        for future in as_completed(futures):
+            table_name = futures[future]
+            try:
+                result = future.result()
+            except psycopg2.OperationalError as e:
+                failed.append(table_name)
+                print(f"Error connecting to the database: {e}")
+                print("Please check your .env file and ensure PostgreSQL is running.")
+                continue
+            except Exception as e:
+                failed.append(table_name)
+                print(f"An unexpected error occurred exporting '{table_name}': {e}")
+                continue
+
+            if len(result) == 3:
+                files, rows, watermark = result
+                manifest[table_name] = {"watermark": watermark}
+                save_manifest(manifest)
+                print(
+                    f"Successfully exported {rows} new '{table_name}' rows to "
+                    f"{len(files)} partition file(s); watermark now {watermark}."
+                )
             else:
+                filepath, rows = result
+                row_note = f" ({rows} rows)" if rows is not None else ""
                 print(
-                    f"Warning: CSV file for table '{table_name}' not found. Skipping."
+                    f"Successfully exported '{table_name}' to '{filepath}'{row_note}."
                 )
 
-    except Exception as e:
-        print(f"An error occurred during Parquet conversion: {e}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the database tables.")
+    parser.add_argument(
+        "--format",
+        choices=("parquet", "csv", "both"),
+        default="parquet",
+        help="output format (default: parquet)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="tables exported in parallel"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="rows per fetch and per Parquet row group",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="export only rows added since the last run, hive-partitioned by "
+        "subreddit and month (Parquet only)",
+    )
+    parser.add_argument(
+        "--settle-seconds",
+        type=int,
+        default=SETTLE_SECONDS,
+        help="with --incremental, leave rows younger than this to the next run",
+    )
+    args = parser.parse_args()
+
+    if args.incremental and args.format != "parquet":
+        parser.error("--incremental only supports --format parquet")
 
+    formats = ["parquet", "csv"] if args.format == "both" else [args.format]
 
-print("--- Starting PostgreSQL to Parquet ---")
-create_directories()
-export_postgres_to_csv()
-convert_csv_to_parquet()
-print("\n--- Process Finished ---")
+    print("--- Starting PostgreSQL Export ---")
+    create_directories(formats)
+    for fmt in formats:
+        export_tables(
+            fmt,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            incremental=args.incremental,
+            settle_seconds=args.settle_seconds,
+        )
+    print("\n--- Process Finished ---")
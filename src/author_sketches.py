@@ -0,0 +1,585 @@
+"""Mergeable sketches of each subreddit's comment authors, by ISO week.
+
+For every (subreddit, week) author_sketches holds:
+
+    distinct_authors  a HyperLogLog of the authors who commented
+    activity          a Count-Min sketch of comments per author, with the
+                      TOP_K authors of highest estimated count
+    negativity        the same for comments scored at or below
+                      NEGATIVE_THRESHOLD
+
+Sketches merge (register max, counter sums), so distinct commenters and the
+most prolific or negative authors of any set of subreddits and weeks come from
+a few rows instead of a GROUP BY over comments. update_author_sketches() folds
+in the comments and sentiment rows written since the last update; the
+enrichment daemon and the pipeline run it after each pass.
+
+    python author_sketches.py show --subreddits SQL datascience --start 2025-01-06
+    python author_sketches.py update
+    python author_sketches.py rebuild
+    python author_sketches.py check
+"""
+
+import argparse
+from datetime import date
+import hashlib
+import logging
+import math
+import os
+import struct
+import sys
+
+import numpy as np
+
+from clients import DBClient
+from config import DB_URL
+from instrumentation import metrics
+from sentiment_trends import bucket_start
+from usefulness_index import NEGATIVE_THRESHOLD
+
+# 2**12 registers: ~1.6% standard error on distinct counts
+HLL_PRECISION = 12
+# a count is overestimated by at most e / CMS_WIDTH (~0.13%) of the sketch's
+# total, with probability 1 - exp(-CMS_DEPTH) (~98%); never underestimated
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+TOP_K = 50
+# rows newer than this wait for the next update: as in export_db's incremental
+# exports, a row's timestamp is its transaction's start, so a slow transaction
+# can commit behind the watermark
+SETTLE_SECONDS = 60
+# serializes updates and rebuilds (schema_migrations uses 7_346_201 and the
+# metric rollup triggers 7_346_203)
+ADVISORY_LOCK_KEY = 7_346_202
+SKETCH_COLUMNS = ("distinct_authors", "activity", "negativity")
+
+
+def author_hashes(authors):
+    """64-bit hashes of author ids, as a uint64 array."""
+    return np.fromiter(
+        (
+            int.from_bytes(
+                hashlib.blake2b(author.encode(), digest_size=8).digest(), "little"
+            )
+            for author in authors
+        ),
+        dtype=np.uint64,
+        count=len(authors),
+    )
+
+
+def _bit_length(values):
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= np.uint64(1 << shift)
+        lengths[high] += shift
+        values[high] = values[high] >> np.uint64(shift)
+    return lengths + (values > 0)
+
+
+class HyperLogLog:
+    """Distinct count estimate from 2**precision one-byte registers."""
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = (
+            np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+        )
+
+    def add(self, hashes):
+        # the top precision bits pick the register, the rest give the rank
+        p = self.precision
+        index = (hashes >> np.uint64(64 - p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        rank = (64 - p + 1 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError(
+                f"Can't merge HyperLogLogs of precision {self.precision} "
+                f"and {other.precision}"
+            )
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.ldexp(1.0, -self.registers.astype(int)).sum()
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # small ranges: linear counting of the empty registers
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        return bytes([self.precision]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        registers = np.frombuffer(data, dtype=np.uint8, offset=1).copy()
+        return cls(data[0], registers)
+
+
+class CountMinTopK:
+    """Count-Min sketch of per-author counts, and the k authors with the
+    highest estimated counts seen so far."""
+
+    HEADER = struct.Struct("<HHH")
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH, k=TOP_K, table=None):
+        self.k = k
+        self.table = (
+            np.zeros((depth, width), dtype=np.int64) if table is None else table
+        )
+        self.candidates = []
+
+    @property
+    def total(self):
+        return int(self.table[0].sum())
+
+    @property
+    def error_bound(self):
+        """The most an estimate exceeds the true count, with probability
+        1 - exp(-depth)."""
+        depth, width = self.table.shape
+        return math.ceil(math.e / width * self.total)
+
+    def _columns(self, hashes):
+        """Each hash's column in every row: h1 + row * h2 from the two halves."""
+        depth, width = self.table.shape
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(depth, dtype=np.uint64)[:, None]
+        return ((low + rows * high) % np.uint64(width)).astype(np.intp)
+
+    def estimate(self, authors):
+        columns = self._columns(author_hashes(authors))
+        rows = np.arange(self.table.shape[0])[:, None]
+        return self.table[rows, columns].min(axis=0)
+
+    def add(self, authors, counts):
+        """Count counts[i] more for authors[i]; authors must be distinct."""
+        columns = self._columns(author_hashes(authors))
+        for row, row_columns in enumerate(columns):
+            np.add.at(self.table[row], row_columns, counts)
+        self._keep_top(authors)
+
+    def merge(self, other):
+        if other.table.shape != self.table.shape:
+            raise ValueError(
+                f"Can't merge Count-Min sketches of shape {self.table.shape} "
+                f"and {other.table.shape}"
+            )
+        self.table += other.table
+        self._keep_top(other.candidates)
+        return self
+
+    def _keep_top(self, authors):
+        pool = list(dict.fromkeys([*self.candidates, *authors]))
+        if not pool:
+            return
+        estimates = self.estimate(pool)
+        order = np.argsort(-estimates, kind="stable")[: self.k]
+        self.candidates = [pool[i] for i in order]
+
+    def top(self, n=None):
+        """(author, estimated count) of the top n candidates, highest first."""
+        if not self.candidates:
+            return []
+        estimates = self.estimate(self.candidates)
+        ranked = sorted(zip(self.candidates, estimates.tolist()), key=lambda t: -t[1])
+        return ranked[:n]
+
+    def to_bytes(self):
+        depth, width = self.table.shape
+        return (
+            self.HEADER.pack(depth, width, self.k)
+            # one (subreddit, week) never needs more than 32-bit counters
+            + self.table.astype("<i4").tobytes()
+            + "\n".join(self.candidates).encode()
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        depth, width, k = cls.HEADER.unpack_from(data)
+        offset = cls.HEADER.size
+        table = np.frombuffer(data, dtype="<i4", count=depth * width, offset=offset)
+        sketch = cls(width, depth, k, table.reshape(depth, width).astype(np.int64))
+        tail = data[offset + depth * width * 4 :].decode()
+        sketch.candidates = tail.split("\n") if tail else []
+        return sketch
+
+
+class AuthorSketches:
+    """The three sketches of one or more (subreddit, week) buckets."""
+
+    def __init__(self, distinct_authors=None, activity=None, negativity=None):
+        self.distinct_authors = distinct_authors or HyperLogLog()
+        self.activity = activity or CountMinTopK()
+        self.negativity = negativity or CountMinTopK()
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            HyperLogLog.from_bytes(row["distinct_authors"]),
+            CountMinTopK.from_bytes(row["activity"]),
+            CountMinTopK.from_bytes(row["negativity"]),
+        )
+
+    def to_row(self):
+        return {name: getattr(self, name).to_bytes() for name in SKETCH_COLUMNS}
+
+    def merge(self, other):
+        for name in SKETCH_COLUMNS:
+            getattr(self, name).merge(getattr(other, name))
+        return self
+
+    def add_comments(self, authors, counts):
+        """Fold in counts[i] new comments by authors[i] (distinct)."""
+        self.distinct_authors.add(author_hashes(authors))
+        self.activity.add(authors, counts)
+
+    def add_negative(self, authors, counts):
+        self.negativity.add(authors, counts)
+
+
+def _delta_query(source, since):
+    """Per subreddit, week and author: the rows of source written in
+    (since, cutoff]; for sentiment_analysis, only the negative ones."""
+    if source == "comments":
+        watermark = "c.ingested_at"
+        source_sql = "comments c"
+        negative = ""
+    else:
+        watermark = "sa.analysis_date"
+        source_sql = """sentiment_analysis sa
+            JOIN comments c ON c.comment_id = sa.comment_id"""
+        negative = "AND sa.vader_compound <= :negative"
+    return f"""
+        SELECT p.subreddit_id,
+            date_trunc('week', c.created_utc AT TIME ZONE 'UTC')::date AS bucket,
+            c.author_fullname,
+            COUNT(*) AS n
+        FROM {source_sql}
+        JOIN posts p ON p.post_id = c.post_id
+        WHERE c.author_fullname IS NOT NULL {negative}
+            {f"AND {watermark} > :since" if since is not None else ""}
+            AND {watermark} <= :cutoff
+        GROUP BY 1, 2, 3
+    """
+
+
+def _group(rows):
+    """{(subreddit_id, bucket): (authors, counts)} of delta rows."""
+    groups = {}
+    for row in rows:
+        authors, counts = groups.setdefault(
+            (row["subreddit_id"], row["bucket"]), ([], [])
+        )
+        authors.append(row["author_fullname"])
+        counts.append(row["n"])
+    return groups
+
+
+def _update(session, settle_seconds):
+    """update_author_sketches() within session's transaction."""
+    session.execute("SELECT pg_advisory_xact_lock(:key)", {"key": ADVISORY_LOCK_KEY})
+    cutoff = session.fetch_one(
+        "SELECT now() - make_interval(secs => :settle) AS cutoff",
+        {"settle": settle_seconds},
+    )["cutoff"]
+    watermarks = {
+        row["source"]: row["watermark"]
+        for row in session.fetch_all(
+            "SELECT source, watermark FROM author_sketch_watermarks"
+        )
+    }
+
+    deltas = {}
+    for source in ("comments", "sentiment_analysis"):
+        since = watermarks.get(source)
+        if since is not None and since >= cutoff:
+            deltas[source] = {}
+            continue
+        rows = session.fetch_all(
+            _delta_query(source, since),
+            {"since": since, "cutoff": cutoff, "negative": NEGATIVE_THRESHOLD},
+        )
+        deltas[source] = _group(rows)
+        metrics.increment("author_sketch_rows_total", len(rows), source=source)
+
+    keys = deltas["comments"].keys() | deltas["sentiment_analysis"].keys()
+    if keys:
+        rows = session.fetch_all(
+            f"""
+            SELECT subreddit_id, bucket, {", ".join(SKETCH_COLUMNS)}
+            FROM author_sketches
+            WHERE subreddit_id = ANY(:subreddit_ids) AND bucket = ANY(:buckets)
+            """,
+            {
+                "subreddit_ids": sorted({key[0] for key in keys}),
+                "buckets": sorted({key[1] for key in keys}),
+            },
+        )
+        stored = {(row["subreddit_id"], row["bucket"]): row for row in rows}
+
+        for key in sorted(keys):
+            sketches = (
+                AuthorSketches.from_row(stored[key])
+                if key in stored
+                else AuthorSketches()
+            )
+            if key in deltas["comments"]:
+                sketches.add_comments(*deltas["comments"][key])
+            if key in deltas["sentiment_analysis"]:
+                sketches.add_negative(*deltas["sentiment_analysis"][key])
+            session.execute(
+                f"""
+                INSERT INTO author_sketches (
+                    subreddit_id, bucket, {", ".join(SKETCH_COLUMNS)}
+                )
+                VALUES (
+                    :subreddit_id, :bucket,
+                    {", ".join(f":{c}" for c in SKETCH_COLUMNS)}
+                )
+                ON CONFLICT (subreddit_id, bucket) DO UPDATE SET
+                    {", ".join(f"{c} = EXCLUDED.{c}" for c in SKETCH_COLUMNS)},
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                {"subreddit_id": key[0], "bucket": key[1], **sketches.to_row()},
+            )
+
+    for source in deltas:
+        session.execute(
+            """
+            INSERT INTO author_sketch_watermarks (source, watermark)
+            VALUES (:source, :cutoff)
+            ON CONFLICT (source) DO UPDATE SET
+                watermark = GREATEST(
+                    author_sketch_watermarks.watermark, EXCLUDED.watermark
+                )
+            """,
+            {"source": source, "cutoff": cutoff},
+        )
+    return len(keys)
+
+
+def update_author_sketches(db_client, settle_seconds=SETTLE_SECONDS):
+    """Fold the comments (by ingested_at) and negative sentiment rows (by
+    analysis_date) written since the last update into author_sketches, in the
+    same transaction that moves the watermarks, so every row is counted once.
+    Returns the (subreddit, week) sketches written; 0 on failure."""
+    try:
+        with metrics.stage("author_sketches"):
+            with db_client.session() as s:
+                written = _update(s, settle_seconds)
+        if written:
+            logging.info(f"Updated {written} author sketches.")
+        return written
+    except Exception as e:
+        logging.error(f"Error updating author sketches: {e}", exc_info=True)
+        return 0
+
+
+def rebuild_author_sketches(db_client, settle_seconds=SETTLE_SECONDS):
+    """Recompute every sketch from the full comment history in one transaction.
+    Returns the (subreddit, week) sketches written; 0 on failure."""
+    try:
+        with db_client.session() as s:
+            s.execute("SELECT pg_advisory_xact_lock(:key)", {"key": ADVISORY_LOCK_KEY})
+            s.execute("DELETE FROM author_sketches")
+            s.execute("DELETE FROM author_sketch_watermarks")
+            written = _update(s, settle_seconds)
+        logging.info(f"Rebuilt {written} author sketches.")
+        return written
+    except Exception as e:
+        logging.error(f"Error rebuilding author sketches: {e}", exc_info=True)
+        return 0
+
+
+def merged_sketches(db_client, subreddits=None, start=None, end=None):
+    """The sketches of the weeks in [start, end) (dates; either may be None)
+    of subreddits (default: all), merged into one AuthorSketches. start is
+    rounded down to its week's Monday."""
+    where = []
+    params = {}
+    if subreddits is not None:
+        where.append("s.subreddit = ANY(:subreddits)")
+        params["subreddits"] = list(subreddits)
+    if start is not None:
+        where.append("a.bucket >= :start")
+        params["start"] = bucket_start(start, "week")
+    if end is not None:
+        where.append("a.bucket < :end")
+        params["end"] = end
+
+    query = f"""
+        SELECT {", ".join(f"a.{c}" for c in SKETCH_COLUMNS)}
+        FROM author_sketches a
+        JOIN subreddits s ON s.subreddit_id = a.subreddit_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+    """
+    merged = AuthorSketches()
+    for row in db_client.fetch_all(query, params):
+        merged.merge(AuthorSketches.from_row(row))
+    return merged
+
+
+def distinct_authors(db_client, subreddits=None, start=None, end=None):
+    """Estimated distinct comment authors across subreddits and [start, end)."""
+    return merged_sketches(db_client, subreddits, start, end).distinct_authors.count()
+
+
+def with_names(db_client, ranked):
+    """(author_fullname, author_name, estimate) of (author_fullname, estimate)
+    pairs, in the same order."""
+    if not ranked:
+        return []
+    rows = db_client.fetch_all(
+        "SELECT author_fullname, author_name FROM authors "
+        "WHERE author_fullname = ANY(:ids)",
+        {"ids": [author for author, _ in ranked]},
+    )
+    names = {row["author_fullname"]: row["author_name"] for row in rows}
+    return [(author, names.get(author), count) for author, count in ranked]
+
+
+def top_authors(
+    db_client, kind="activity", n=10, subreddits=None, start=None, end=None
+):
+    """(author_fullname, author_name, estimated comments) of the n authors with
+    the most comments (kind="activity") or negative comments
+    ("negativity") across subreddits and [start, end)."""
+    sketches = merged_sketches(db_client, subreddits, start, end)
+    return with_names(db_client, getattr(sketches, kind).top(n))
+
+
+def check_author_sketches(db_client, subreddits=None, start=None, end=None, n=10):
+    """Sketch estimates next to exact counts (the GROUP BYs the sketches
+    replace), over the rows already folded in. Returns (distinct estimate,
+    exact distinct, [(kind, author, estimate, exact count)] of the top n)."""
+    where = ["c.author_fullname IS NOT NULL"]
+    params = {"negative": NEGATIVE_THRESHOLD}
+    if subreddits is not None:
+        where.append("s.subreddit = ANY(:subreddits)")
+        params["subreddits"] = list(subreddits)
+    # the same weeks merged_sketches() reads
+    week = "date_trunc('week', c.created_utc AT TIME ZONE 'UTC')::date"
+    if start is not None:
+        where.append(f"{week} >= :start")
+        params["start"] = bucket_start(start, "week")
+    if end is not None:
+        where.append(f"{week} < :end")
+        params["end"] = end
+    watermarks = {
+        row["source"]: row["watermark"]
+        for row in db_client.fetch_all(
+            "SELECT source, watermark FROM author_sketch_watermarks"
+        )
+    }
+    if "comments" not in watermarks:
+        return None
+    where.append("c.ingested_at <= :comments_watermark")
+    params["comments_watermark"] = watermarks["comments"]
+    params["sentiment_watermark"] = watermarks.get("sentiment_analysis")
+
+    query = f"""
+        SELECT c.author_fullname,
+            COUNT(*) AS activity,
+            COUNT(*) FILTER (
+                WHERE sa.vader_compound <= :negative
+                    AND sa.analysis_date <= :sentiment_watermark
+            ) AS negativity
+        FROM comments c
+        JOIN posts p ON p.post_id = c.post_id
+        JOIN subreddits s ON s.subreddit_id = p.subreddit_id
+        LEFT JOIN sentiment_analysis sa ON sa.comment_id = c.comment_id
+        WHERE {" AND ".join(where)}
+        GROUP BY 1
+    """
+    exact = {row["author_fullname"]: row for row in db_client.fetch_all(query, params)}
+    sketches = merged_sketches(db_client, subreddits, start, end)
+
+    top = []
+    for kind in ("activity", "negativity"):
+        for author, estimate in getattr(sketches, kind).top(n):
+            top.append(
+                (kind, author, estimate, exact[author][kind] if author in exact else 0)
+            )
+    return sketches.distinct_authors.count(), len(exact), top
+
+
+if __name__ == "__main__":
+    log_file_name = "author_sketches.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=("show", "update", "rebuild", "check"))
+    parser.add_argument("--subreddits", nargs="+", help="default: every subreddit")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat, help="exclusive")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--settle-seconds",
+        type=float,
+        default=SETTLE_SECONDS,
+        help="leave rows written in the last this many seconds for the next update",
+    )
+    args = parser.parse_args()
+
+    db_client = DBClient(DB_URL)
+    success = False
+
+    try:
+        if args.command == "update":
+            update_author_sketches(db_client, args.settle_seconds)
+        elif args.command == "rebuild":
+            rebuild_author_sketches(db_client, args.settle_seconds)
+        elif args.command == "check":
+            result = check_author_sketches(
+                db_client, args.subreddits, args.start, args.end, args.top
+            )
+            if result is None:
+                logging.info("No author sketches yet; run update or rebuild first.")
+            else:
+                estimate, exact, top = result
+                logging.info(f"Distinct authors: ~{estimate} (exact {exact}).")
+                for kind, author, estimate, count in top:
+                    logging.info(f"{kind} {author}: ~{estimate} (exact {count})")
+        else:
+            sketches = merged_sketches(db_client, args.subreddits, args.start, args.end)
+            logging.info(
+                f"~{sketches.distinct_authors.count()} distinct authors of "
+                f"{sketches.activity.total} comments."
+            )
+            for kind in ("activity", "negativity"):
+                sketch = getattr(sketches, kind)
+                logging.info(
+                    f"Top {kind} (estimates at most {sketch.error_bound} high):"
+                )
+                for author, name, count in with_names(db_client, sketch.top(args.top)):
+                    logging.info(f"{kind}: {name or author} ~{count}")
+        success = True
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+    finally:
+        metrics.export("author_sketches", success=success)
+
+    sys.exit(0 if success else 1)
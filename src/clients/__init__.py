@@ -1,2 +1,3 @@
 from .db_client import DBClient  # noqa: F401
 from .praw_client import PrawClient  # noqa: F401
+from .rate_limiter import TokenBucket  # noqa: F401
@@ -1,40 +1,429 @@
+from contextlib import contextmanager
+import csv
+import io
+import re
+import select
+import threading
+import time
+from psycopg2 import sql
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 from sqlalchemy import create_engine, text
-from config import DB_URL
+from config import (
+    DB_URL,
+    DB_MAX_OVERFLOW,
+    DB_PAGE_SIZE,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+)
+from instrumentation import ROW_BUCKETS, metrics, query_profiler
+
+# one pooled engine per database URL, shared by every DBClient in the process
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _shared_engine(db_url):
+    with _engines_lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            engine = create_engine(
+                db_url,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_recycle=DB_POOL_RECYCLE,
+                pool_pre_ping=True,
+                # executemany: multi-row VALUES for INSERTs, execute_batch for
+                # UPDATE/DELETE, DB_PAGE_SIZE parameter sets per round trip
+                executemany_mode="values_plus_batch",
+                insertmanyvalues_page_size=DB_PAGE_SIZE,
+                executemany_batch_page_size=DB_PAGE_SIZE,
+            )
+            _engines[db_url] = engine
+        return engine
+
+
+class _CopyBuffer:
+    """File-like CSV view over an iterable of row dicts, consumed by COPY."""
+
+    def __init__(self, rows, columns):
+        self._rows = iter(rows)
+        self._columns = columns
+        self._out = io.StringIO()
+        # NULLs go out unquoted, everything else quoted, so "" stays an empty string
+        self._writer = csv.writer(
+            self._out, quoting=csv.QUOTE_NOTNULL, lineterminator="\n"
+        )
+
+    def read(self, size=-1):
+        while size < 0 or self._out.tell() < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow([row[column] for column in self._columns])
+
+        data = self._out.getvalue()
+        chunk, rest = (data, "") if size < 0 else (data[:size], data[size:])
+
+        self._out.seek(0)
+        self._out.truncate()
+        self._out.write(rest)
+        return chunk
+
+
+class Session:
+    """One transaction on one pooled connection; see DBClient.session()."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._stages = 0
+
+    def fetch_one(self, query, params=None):
+        started = time.perf_counter()
+        with metrics.timer("db_query_seconds", op="fetch_one"):
+            result = self.conn.execute(text(query), params or {})
+            row = result.mappings().first()
+        _profile(
+            self.conn, query, params, time.perf_counter() - started, row is not None
+        )
+        return row
+
+    def fetch_all(self, query, params=None):
+        started = time.perf_counter()
+        with metrics.timer("db_query_seconds", op="fetch_all"):
+            result = self.conn.execute(text(query), params or {})
+            rows = result.mappings().all()
+        _profile(self.conn, query, params, time.perf_counter() - started, len(rows))
+        return rows
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        with metrics.timer("db_query_seconds", op="execute"):
+            result = self.conn.execute(text(query), params or {})
+        _profile(
+            self.conn,
+            query,
+            params,
+            time.perf_counter() - started,
+            max(result.rowcount, 0),
+        )
+        return result.rowcount
+
+    def bulk_load(
+        self, table, rows, conflict_key, on_conflict="nothing", update_columns=None
+    ):
+        """COPY rows into a temp staging table, then merge them into table with a
+        single INSERT ... SELECT ... ON CONFLICT. rows is an iterable of dicts or
+        a pyarrow Table, whose CSV is written by Arrow without a Python object
+        per value. on_conflict="update" overwrites update_columns (default:
+        every non-key column). Returns the merged row count."""
+        _check_on_conflict(on_conflict)
+
+        counted = None
+        if isinstance(rows, pa.Table):
+            if not rows.num_rows:
+                return 0
+            columns = rows.column_names
+            data = _arrow_csv(rows)
+        else:
+            rows = iter(rows)
+            first_row = next(rows, None)
+            if first_row is None:
+                return 0
+            columns = list(first_row)
+            counted = _Counted(_prepend(first_row, rows))
+            data = _CopyBuffer(counted, columns)
+
+        conflict_columns = (
+            [conflict_key] if isinstance(conflict_key, str) else list(conflict_key)
+        )
+
+        self._stages += 1
+        started = time.perf_counter()
+        with metrics.timer("db_write_seconds", table=table):
+            with self.conn.connection.cursor() as cursor:
+                merged = _copy_merge(
+                    cursor,
+                    f"_stage_{table}_{self._stages}",
+                    table,
+                    columns,
+                    data,
+                    conflict_columns,
+                    on_conflict,
+                    update_columns,
+                )
+
+        if query_profiler.enabled:
+            # COPY + merge, which can't be EXPLAINed
+            query_profiler.record(
+                f"bulk_load {table}", time.perf_counter() - started, merged
+            )
+
+        row_count = rows.num_rows if counted is None else counted.count
+        metrics.observe("db_write_rows", row_count, ROW_BUCKETS, table=table)
+        metrics.increment("db_rows_written_total", merged, table=table)
+        return merged
 
 
 class DBClient:
     def __init__(self, db_url=DB_URL):
         try:
-            self.engine = create_engine(db_url)
+            self.engine = _shared_engine(db_url)
             print("Successful DBClient init")
         except Exception as e:
             print(f"Failed to create DB engine: {e}")
             raise
 
+    @contextmanager
+    def session(self):
+        """Unit of work: every call on the yielded Session shares one pooled
+        connection and one transaction, committed on exit and rolled back (and
+        re-raised) on error."""
+        with self.engine.begin() as conn:
+            yield Session(conn)
+
     def fetch_one(self, query, params=None):
         try:
-            with self.engine.connect() as conn:
-                result = conn.execute(text(query), params or {})
-                return result.mappings().first()
+            with self.session() as s:
+                return s.fetch_one(query, params)
         except Exception as e:
             print(f"Error fetching single row: {e}")
             return None
 
     def fetch_all(self, query, params=None):
         try:
-            with self.engine.connect() as conn:
-                result = conn.execute(text(query), params or {})
-                return result.mappings().all()
+            with self.session() as s:
+                return s.fetch_all(query, params)
         except Exception as e:
             print(f"Error fetching data: {e}")
             return []
 
-    def execute(self, query, params=None):
+    def stream(self, query, params=None, chunk_size=5000):
+        """Yield the rows of query in chunks of up to chunk_size row mappings.
+        Yields nothing if the query fails outright, like fetch_all; a failure
+        after the first chunk is re-raised, so a stream cut short can't pass
+        for a complete one."""
+        # server-side (named) cursor: only chunk_size rows are held client-side
+        streamed = False
         try:
             with self.engine.connect() as conn:
-                result = conn.execute(text(query), params or {})
-                conn.commit()
-                return result.rowcount
+                started = time.perf_counter()
+                result = conn.execution_options(
+                    stream_results=True, yield_per=chunk_size
+                ).execute(text(query), params or {})
+                chunks = result.mappings().partitions()
+                # the profiler gets the time spent in the database, not in the
+                # caller between chunks
+                seconds = time.perf_counter() - started
+                rows = 0
+                while True:
+                    started = time.perf_counter()
+                    chunk = next(chunks, None)
+                    fetch_seconds = time.perf_counter() - started
+                    seconds += fetch_seconds
+                    metrics.observe("db_stream_fetch_seconds", fetch_seconds)
+                    if chunk is None:
+                        break
+                    rows += len(chunk)
+                    metrics.increment("db_rows_streamed_total", len(chunk))
+                    streamed = True
+                    yield chunk
+                # the EXPLAIN, if any, runs on a plain cursor
+                conn.execution_options(stream_results=False, yield_per=None)
+                _profile(conn, query, params, seconds, rows)
+        except Exception as e:
+            print(f"Error streaming data: {e}")
+            if streamed:
+                raise
+
+    def notifications(self, channels, timeout):
+        """LISTEN on channels and yield the payloads of the NOTIFYs received,
+        batched: a list whenever any arrive, [] after timeout seconds without
+        any. Holds a connection of its own until closed. Unlike the other
+        methods it raises when the connection fails, so callers can reconnect
+        and catch up on what they missed."""
+        conn = self.engine.raw_connection()
+        try:
+            listener = conn.driver_connection
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                for channel in channels:
+                    cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+
+            while True:
+                if select.select([listener], [], [], timeout) != ([], [], []):
+                    listener.poll()
+                payloads = [notify.payload for notify in listener.notifies]
+                listener.notifies.clear()
+                yield payloads
+        finally:
+            # a LISTENing autocommit connection must not go back to the pool
+            conn.invalidate()
+
+    def execute(self, query, params=None):
+        try:
+            with self.session() as s:
+                return s.execute(query, params)
         except Exception as e:
             print(f"Error executing query: {e}")
             return 0
+
+    def bulk_load(
+        self, table, rows, conflict_key, on_conflict="nothing", update_columns=None
+    ):
+        """Session.bulk_load in its own transaction. Returns 0 on failure."""
+        load = {
+            "table": table,
+            "rows": rows,
+            "conflict_key": conflict_key,
+            "on_conflict": on_conflict,
+            "update_columns": update_columns,
+        }
+        return self.bulk_load_many([load])[0]
+
+    def bulk_load_many(self, loads):
+        """Run several bulk_load merges in one transaction, in order. Each load is
+        a dict of bulk_load keyword arguments. Returns the merged row count per
+        load; all zeros if anything failed and the transaction was rolled back."""
+        for load in loads:
+            _check_on_conflict(load.get("on_conflict", "nothing"))
+
+        try:
+            with self.session() as s:
+                return [s.bulk_load(**load) for load in loads]
+        except Exception as e:
+            tables = ", ".join(load["table"] for load in loads)
+            print(f"Error bulk loading into {tables}: {e}")
+            return [0] * len(loads)
+
+
+# statements EXPLAIN ANALYZE may run again: plain reads, no data-modifying CTEs
+_READ_ONLY = re.compile(
+    r"\s*(SELECT|WITH)\b(?!.*\b(INSERT|UPDATE|DELETE)\b)", re.IGNORECASE | re.DOTALL
+)
+
+
+def _explain(conn, query, params):
+    """The plan of a statement that just ran on conn. Reads are run again under
+    EXPLAIN (ANALYZE, BUFFERS); writes only get their estimated plan. Runs in a
+    savepoint, so a failed EXPLAIN can't abort the caller's transaction."""
+    options = "ANALYZE, BUFFERS" if _READ_ONLY.match(query) else "COSTS"
+    with conn.begin_nested():
+        result = conn.execute(text(f"EXPLAIN ({options}) {query}"), params or {})
+        return "\n".join(row[0] for row in result)
+
+
+def _profile(conn, query, params, seconds, rows):
+    """Hand a statement that just ran on conn to the query profiler."""
+    if query_profiler.enabled:
+        query_profiler.record(
+            query,
+            seconds,
+            rows,
+            explain=lambda: _explain(conn, query, params),
+        )
+
+
+def _check_on_conflict(on_conflict):
+    if on_conflict not in ("nothing", "update"):
+        raise ValueError(
+            f"on_conflict must be 'nothing' or 'update', got {on_conflict!r}"
+        )
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+class _Counted:
+    """Iterator wrapper counting the rows COPY consumed."""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self._rows)
+        self.count += 1
+        return row
+
+
+def _arrow_csv(table):
+    """COPY input for an Arrow table. NULLs go out unquoted and every other value
+    quoted, as _CopyBuffer does, so "" stays an empty string."""
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(
+        table,
+        sink,
+        pa_csv.WriteOptions(include_header=False, quoting_style="all_valid"),
+    )
+    return pa.BufferReader(sink.getvalue())
+
+
+def _copy_merge(
+    cursor,
+    stage_name,
+    table,
+    columns,
+    data,
+    conflict_columns,
+    on_conflict,
+    update_columns=None,
+):
+    # the staging table is dropped at commit, which saves a round trip
+    stage = sql.Identifier(stage_name)
+    target = sql.Identifier(table)
+    column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+    key_list = sql.SQL(", ").join(map(sql.Identifier, conflict_columns))
+
+    cursor.execute(
+        sql.SQL(
+            "CREATE TEMP TABLE {stage} ON COMMIT DROP AS "
+            "SELECT {columns} FROM {target} WITH NO DATA"
+        ).format(stage=stage, columns=column_list, target=target)
+    )
+    cursor.copy_expert(
+        sql.SQL("COPY {stage} ({columns}) FROM STDIN WITH (FORMAT csv)")
+        .format(stage=stage, columns=column_list)
+        .as_string(cursor),
+        data,
+    )
+
+    if update_columns is None:
+        update_columns = [c for c in columns if c not in conflict_columns]
+
+    if on_conflict == "update" and update_columns:
+        action = sql.SQL("DO UPDATE SET {}").format(
+            sql.SQL(", ").join(
+                sql.SQL("{col} = EXCLUDED.{col}").format(col=sql.Identifier(c))
+                for c in update_columns
+            )
+        )
+        # a row may appear twice in one batch; DO UPDATE can only touch it once,
+        # so keep the last copy (ctid follows COPY order in a fresh temp table)
+        select = sql.SQL(
+            "SELECT DISTINCT ON ({keys}) {columns} FROM {stage} "
+            "ORDER BY {keys}, ctid DESC"
+        ).format(keys=key_list, columns=column_list, stage=stage)
+    else:
+        action = sql.SQL("DO NOTHING")
+        select = sql.SQL("SELECT {columns} FROM {stage}").format(
+            columns=column_list, stage=stage
+        )
+
+    cursor.execute(
+        sql.SQL(
+            "INSERT INTO {target} ({columns}) {select} ON CONFLICT ({keys}) {action}"
+        ).format(
+            target=target,
+            columns=column_list,
+            select=select,
+            keys=key_list,
+            action=action,
+        )
+    )
+    return cursor.rowcount
@@ -1,26 +1,79 @@
 import praw
+import prawcore
 import os
+import threading
 from dotenv import load_dotenv
 
+from config import REDDIT_BURST, REDDIT_REQUESTS_PER_MINUTE
+from instrumentation import metrics
+from .rate_limiter import TokenBucket
+
 load_dotenv()
 
 
-class PrawClient:
-    def __init__(self):
-        try:
-            client_id = os.getenv("REDDIT_CLIENT_ID")
-            client_secret = os.getenv("REDDIT_CLIENT_SECRET")
-            client_user_agent = os.getenv("REDDIT_USER_AGENT")
+class RateLimitedRequestor(prawcore.Requestor):
+    """prawcore requestor that takes a token from a shared bucket before every
+    HTTP request, including the ones PRAW makes inside replace_more()."""
+
+    def __init__(self, *args, rate_limiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+
+    def request(self, *args, **kwargs):
+        if self.rate_limiter is not None:
+            waited = self.rate_limiter.acquire()
+            if waited:
+                metrics.increment("reddit_rate_limit_sleeps_total")
+                metrics.increment("reddit_rate_limit_sleep_seconds_total", waited)
+
+        method = str(args[0] if args else kwargs.get("method", "")).upper()
+        metrics.increment("reddit_api_requests_total", method=method)
+        with metrics.timer("reddit_api_request_seconds", method=method):
+            try:
+                return super().request(*args, **kwargs)
+            except Exception:
+                metrics.increment("reddit_api_errors_total", method=method)
+                raise
 
-            self.reddit = praw.Reddit(
-                client_id=client_id,
-                client_secret=client_secret,
-                user_agent=client_user_agent,
-            )
 
+class PrawClient:
+    def __init__(self, rate_limiter=None, **reddit_kwargs):
+        # reddit_kwargs go straight to praw.Reddit, e.g. oauth_url/reddit_url to
+        # point the client at a local stand-in server
+        self.rate_limiter = rate_limiter or TokenBucket(
+            rate=REDDIT_REQUESTS_PER_MINUTE / 60, capacity=REDDIT_BURST
+        )
+        self.reddit_kwargs = reddit_kwargs
+        self._local = threading.local()
+
+        try:
+            self.reddit = self._new_reddit()
         except Exception as e:
             print(f"Error occurred during PRAW init: {e}")
             self.reddit = None
 
+    def _new_reddit(self):
+        client_id = os.getenv("REDDIT_CLIENT_ID")
+        client_secret = os.getenv("REDDIT_CLIENT_SECRET")
+        client_user_agent = os.getenv("REDDIT_USER_AGENT")
+
+        return praw.Reddit(
+            client_id=client_id,
+            client_secret=client_secret,
+            user_agent=client_user_agent,
+            requestor_class=RateLimitedRequestor,
+            requestor_kwargs={"rate_limiter": self.rate_limiter},
+            **self.reddit_kwargs,
+        )
+
     def reddit_instance(self):
         return self.reddit
+
+    def thread_reddit(self):
+        """A praw.Reddit for the calling thread (PRAW instances are not thread
+        safe). All of them share this client's rate limiter."""
+        reddit = getattr(self._local, "reddit", None)
+        if reddit is None:
+            reddit = self._new_reddit()
+            self._local.reddit = reddit
+        return reddit
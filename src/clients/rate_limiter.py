@@ -0,0 +1,40 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket. One instance is shared by every Reddit session
+    in the process so concurrent collectors stay inside a single API quota."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available. Returns the seconds spent waiting."""
+        if tokens > self.capacity:
+            # the bucket never holds more than capacity, so this would wait forever
+            raise ValueError(
+                f"Can't acquire {tokens} tokens from a bucket of capacity "
+                f"{self.capacity}"
+            )
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+
+                delay = (tokens - self._tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
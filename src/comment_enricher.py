@@ -0,0 +1,447 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+import re
+import time
+import nltk
+from nltk.corpus import stopwords
+from tqdm import tqdm
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+from clients import DBClient
+from config import (
+    DB_URL,
+    RESULT_CACHE_PERSIST,
+    SENTIMENT_WORKERS,
+    STREAM_CHUNK_SIZE,
+)
+from instrumentation import metrics
+from result_cache import (
+    ResultCache,
+    body_key,
+    load_persisted,
+    persist_loads,
+    stop_words_fingerprint,
+)
+
+STAGES = ("clean", "score")
+
+
+def load_stop_words():
+    try:
+        nltk.data.find("corpora/stopwords")
+    except LookupError:
+        logging.info("Downloading NLTK stopwords package...")
+        nltk.download("stopwords")
+
+    return set(stopwords.words("english"))
+
+
+def get_comments(
+    db_client, stages=STAGES, chunk_size=STREAM_CHUNK_SIZE, comment_ids=None
+):
+    """Stream comments missing a cleaned_comments and/or sentiment_analysis row,
+    flagged with which of the requested stages each one still needs. With
+    comment_ids, only those comments are looked at."""
+    logging.info(f"Streaming new comments for {' + '.join(stages)}...")
+
+    joins = []
+    needs = []
+    pending = []
+
+    if "clean" in stages:
+        joins.append("LEFT JOIN cleaned_comments AS cc ON c.comment_id = cc.comment_id")
+        needs.append("cc.comment_id IS NULL AS needs_clean")
+        pending.append("cc.comment_id IS NULL")
+    else:
+        needs.append("FALSE AS needs_clean")
+
+    if "score" in stages:
+        joins.append(
+            "LEFT JOIN sentiment_analysis AS sa ON c.comment_id = sa.comment_id"
+        )
+        needs.append("sa.comment_id IS NULL AS needs_score")
+        pending.append("sa.comment_id IS NULL")
+    else:
+        needs.append("FALSE AS needs_score")
+
+    where = f"({' OR '.join(pending)})"
+    params = {}
+    if comment_ids is not None:
+        where += " AND c.comment_id = ANY(:comment_ids)"
+        params["comment_ids"] = list(comment_ids)
+
+    query = f"""
+    SELECT c.comment_id, c.body, {", ".join(needs)}
+    FROM comments AS c
+    {" ".join(joins)}
+    WHERE {where};
+    """
+
+    return db_client.stream(query, params, chunk_size=chunk_size)
+
+
+def clean_text(text, stop_words):
+    # remove URLs
+    text = re.sub(r"http\S+", "", text)
+    # remove non-alpha chars
+    text = re.sub(r"[^a-zA-Z\s]", "", text)
+    text = text.lower()
+    tokens = text.split()
+    # 5. Remove stopwords
+    cleaned_tokens = [word for word in tokens if word not in stop_words]
+
+    # for Information Density (ID) metric
+    word_count = len(cleaned_tokens)
+
+    cleaned_body = " ".join(cleaned_tokens)
+
+    return cleaned_body, word_count
+
+
+class CommentEnricher:
+    """Holds the warm resources (stopword set, VADER lexicon) for one process."""
+
+    def __init__(self, stop_words, stages=STAGES):
+        self.stop_words = stop_words
+        self.analyzer = SentimentIntensityAnalyzer() if "score" in stages else None
+
+    def enrich(self, comments):
+        """comments: (comment_id, body, needs_clean, needs_score) tuples.
+        Returns (cleaned_comments rows, sentiment_analysis rows)."""
+        cleaned_rows = []
+        sentiment_rows = []
+
+        for comment_id, body, needs_clean, needs_score in comments:
+            if needs_clean:
+                cleaned_body, word_count = clean_text(body, self.stop_words)
+                cleaned_rows.append(
+                    {
+                        "comment_id": comment_id,
+                        "cleaned_body": cleaned_body,
+                        "word_count": word_count,
+                    }
+                )
+
+            if needs_score:
+                scores = self.analyzer.polarity_scores(body)
+                sentiment_rows.append(
+                    {
+                        "comment_id": comment_id,
+                        "vader_compound": scores["compound"],
+                        "vader_positive": scores["pos"],
+                        "vader_negative": scores["neg"],
+                        "vader_neutral": scores["neu"],
+                    }
+                )
+
+        return cleaned_rows, sentiment_rows
+
+
+# one warm enricher per pool worker, built once by the pool initializer
+_worker_enricher = None
+
+
+def _init_worker(stop_words, stages):
+    global _worker_enricher
+    _worker_enricher = CommentEnricher(stop_words, stages)
+
+
+def _timed_enrich(enricher, comments):
+    started = time.perf_counter()
+    cleaned_rows, sentiment_rows = enricher.enrich(comments)
+    return cleaned_rows, sentiment_rows, time.perf_counter() - started
+
+
+def _enrich_in_worker(comments):
+    return _timed_enrich(_worker_enricher, comments)
+
+
+def enriched_chunks(chunks, stop_words, stages=STAGES, workers=1, enricher=None):
+    """Yield (chunk size, cleaned rows, sentiment rows, seconds spent enriching)
+    in input order, enriching on a process pool when workers > 1. Up to
+    2 * workers chunks are in flight, so the pool keeps working while the caller
+    writes the previous chunk.
+
+    A None chunk yields nothing; it lets chunks that have finished through
+    without waiting for more input, for callers feeding chunks as they arrive.
+    In-process runs use enricher if given, so long-lived callers keep it warm."""
+    if workers <= 1:
+        enricher = enricher or CommentEnricher(stop_words, stages)
+        for comments in chunks:
+            if comments is not None:
+                yield len(comments), *_timed_enrich(enricher, comments)
+        return
+
+    in_flight = deque()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(stop_words, stages),
+    ) as pool:
+        for comments in chunks:
+            if comments is not None:
+                in_flight.append(
+                    (len(comments), pool.submit(_enrich_in_worker, comments))
+                )
+            while in_flight and (
+                len(in_flight) >= 2 * workers or in_flight[0][1].done()
+            ):
+                size, future = in_flight.popleft()
+                yield size, *future.result()
+
+        while in_flight:
+            size, future = in_flight.popleft()
+            yield size, *future.result()
+
+
+def plan_chunk(comments, cache, db_client=None, fingerprint=None):
+    """Turn a chunk of (comment_id, body, needs_clean, needs_score) tuples into
+    enrichment requests: one per distinct cacheable body the cache cannot
+    answer (its body hash standing in for the comment_id), plus one per
+    uncacheable comment. With db_client, bodies missing from the in-memory cache
+    are looked up in enrichment_cache first.
+
+    Returns (plan, requests); pass the plan to resolve_chunk()."""
+    keys = [
+        body_key(body) if cache.cacheable(body) else None for _, body, _, _ in comments
+    ]
+    persisted = {}
+    if db_client is not None:
+        unseen = {key for key in keys if key is not None and cache.get(key) is None}
+        persisted = load_persisted(db_client, cache, unseen, fingerprint)
+
+    # snapshot of the entries used, so evictions before resolve_chunk() are harmless
+    cached = {}
+    requests = {}
+    for (comment_id, body, needs_clean, needs_score), key in zip(comments, keys):
+        if key is not None:
+            if key not in cached:
+                cached[key] = dict(persisted.get(key) or cache.get(key) or {})
+            needs_clean = needs_clean and "clean" not in cached[key]
+            needs_score = needs_score and "score" not in cached[key]
+        if not (needs_clean or needs_score):
+            continue
+
+        request_id = key or comment_id
+        _, _, clean_before, score_before = requests.get(
+            request_id, (None, None, False, False)
+        )
+        requests[request_id] = (
+            request_id,
+            body,
+            needs_clean or clean_before,
+            needs_score or score_before,
+        )
+
+    return (comments, keys, cached), list(requests.values())
+
+
+def resolve_chunk(plan, cleaned, sentiment, cache):
+    """Expand the rows computed for plan_chunk()'s requests back to one row per
+    comment, and cache the new results.
+
+    Returns (cleaned rows, sentiment rows, new cleaning results, new scores); the
+    last two are keyed by body hash."""
+    comments, keys, cached = plan
+    computed_clean = {row.pop("comment_id"): row for row in cleaned}
+    computed_score = {row.pop("comment_id"): row for row in sentiment}
+
+    new_clean = {key: row for key, row in computed_clean.items() if key in cached}
+    new_score = {key: row for key, row in computed_score.items() if key in cached}
+    for key, row in new_clean.items():
+        cache.put(key, clean=row)
+    for key, row in new_score.items():
+        cache.put(key, score=row)
+
+    cleaned_rows = []
+    sentiment_rows = []
+    for (comment_id, _, needs_clean, needs_score), key in zip(comments, keys):
+        request_id = key or comment_id
+        entry = cached.get(request_id, {})
+        if needs_clean:
+            row = computed_clean.get(request_id) or entry["clean"]
+            cleaned_rows.append({"comment_id": comment_id, **row})
+        if needs_score:
+            row = computed_score.get(request_id) or entry["score"]
+            sentiment_rows.append({"comment_id": comment_id, **row})
+
+    return cleaned_rows, sentiment_rows, new_clean, new_score
+
+
+def bulk_insert_enrichments(db_client, cleaned_rows, sentiment_rows, extra_loads=()):
+    """Write one chunk's cleaned_comments and sentiment_analysis rows (plus any
+    extra_loads, e.g. result cache rows) in a single transaction. Returns
+    (cleaned inserted, sentiment inserted)."""
+    if not cleaned_rows and not sentiment_rows:
+        return 0, 0
+
+    try:
+        cleaned_count, sentiment_count, *_ = db_client.bulk_load_many(
+            [
+                {
+                    "table": "cleaned_comments",
+                    "rows": cleaned_rows,
+                    "conflict_key": "comment_id",
+                },
+                {
+                    "table": "sentiment_analysis",
+                    "rows": sentiment_rows,
+                    "conflict_key": "comment_id",
+                },
+                *extra_loads,
+            ]
+        )
+        logging.info(
+            f"Inserted {cleaned_count} cleaned comments and "
+            f"{sentiment_count} sentiment analysis rows."
+        )
+        return cleaned_count, sentiment_count
+    except Exception as e:
+        logging.error(f"Error during bulk enrichment insert: {e}", exc_info=True)
+        return 0, 0
+
+
+def enrich_comments(
+    db_client,
+    stop_words=None,
+    stages=STAGES,
+    chunk_size=STREAM_CHUNK_SIZE,
+    workers=SENTIMENT_WORKERS,
+    cache=None,
+    persist_cache=RESULT_CACHE_PERSIST,
+    chunks=None,
+    enricher=None,
+):
+    """Read each pending comment body once and produce the requested stages'
+    rows for it: cleaned_comments ("clean") and/or sentiment_analysis ("score").
+    Each distinct body is enriched once; repeats are served from cache (a
+    ResultCache, by default a fresh one sized from config), and with
+    persist_cache from/to the enrichment_cache table across runs.
+
+    chunks replaces the pending comments streamed from the database with lists
+    of rows shaped like get_comments()'s (None chunks as in enriched_chunks()).
+    enricher is a warm CommentEnricher to reuse when workers is 1."""
+    if "clean" in stages and stop_words is None:
+        stop_words = load_stop_words()
+    if cache is None:
+        cache = ResultCache()
+    fingerprint = stop_words_fingerprint(stop_words)
+
+    logging.info(
+        f"Enriching comments ({' + '.join(stages)}) with {workers} worker(s)..."
+    )
+    total_comments = 0
+    total_cleaned = 0
+    total_scored = 0
+    computed = 0
+    enrich_seconds = 0.0
+
+    plans = deque()
+
+    if chunks is None:
+        chunks = get_comments(db_client, stages, chunk_size=chunk_size)
+
+    def requests():
+        for comments in chunks:
+            if comments is None:
+                yield None
+                continue
+            plan, chunk_requests = plan_chunk(
+                [
+                    (
+                        comment["comment_id"],
+                        comment["body"],
+                        comment["needs_clean"],
+                        comment["needs_score"],
+                    )
+                    for comment in comments
+                ],
+                cache,
+                db_client if persist_cache else None,
+                fingerprint,
+            )
+            plans.append(plan)
+            yield chunk_requests
+
+    with (
+        metrics.stage("enrich") as stage,
+        tqdm(desc="Enriching Comments", unit=" comments") as progress,
+    ):
+        for size, cleaned, sentiment, seconds in enriched_chunks(
+            requests(), stop_words, stages=stages, workers=workers, enricher=enricher
+        ):
+            plan = plans.popleft()
+            cleaned_rows, sentiment_rows, new_clean, new_score = resolve_chunk(
+                plan, cleaned, sentiment, cache
+            )
+            extra_loads = (
+                persist_loads(new_clean, new_score, fingerprint)
+                if persist_cache
+                else ()
+            )
+            cleaned_count, sentiment_count = bulk_insert_enrichments(
+                db_client, cleaned_rows, sentiment_rows, extra_loads
+            )
+            chunk_comments = len(plan[0])
+            total_comments += chunk_comments
+            total_cleaned += cleaned_count
+            total_scored += sentiment_count
+            computed += size
+            enrich_seconds += seconds
+            stage.add_rows(chunk_comments)
+            progress.update(chunk_comments)
+
+    if not total_comments:
+        logging.info("No new comments to process. Exiting.")
+        return 0, 0
+
+    served = total_comments - computed
+    saved = served * enrich_seconds / computed if computed else 0.0
+    metrics.increment("result_cache_hits_total", served)
+    metrics.increment("result_cache_misses_total", computed)
+    metrics.increment("enrich_compute_seconds_total", enrich_seconds)
+    logging.info(
+        f"Result cache: {served} of {total_comments} comments served without "
+        f"recomputing ({served / total_comments:.1%} hit rate), ~{saved:.1f}s of "
+        f"enrichment saved; {len(cache)} bodies cached."
+    )
+    logging.info(
+        f"Enriched {total_comments} new comments. Inserted {total_cleaned} "
+        f"cleaned comments and {total_scored} sentiment analysis rows."
+    )
+    return total_cleaned, total_scored
+
+
+if __name__ == "__main__":
+    log_file_name = "comment_enrichment.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    logging.info("--- STARTING COMMENT ENRICHMENT SCRIPT ---")
+
+    db_client = DBClient(DB_URL)
+    success = False
+
+    try:
+        enrich_comments(db_client=db_client)
+        success = True
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+    finally:
+        metrics.export("comment_enrichment", success=success)
+        logging.info("--- COMMENT ENRICHMENT SCRIPT FINISHED ---")
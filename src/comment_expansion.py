@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import time
+from praw.models import MoreComments
+
+from config import MORE_COMMENTS_MAX_CALLS, MORE_COMMENTS_MAX_SECONDS
+from instrumentation import metrics
+
+
+class ExpansionPolicy:
+    """Budget for expanding a submission's "load more comments" stubs.
+
+    max_calls caps the API calls (one per expanded stub) and max_seconds the wall
+    time spent per submission; None means unlimited. Stubs are expanded largest
+    first (by hidden child count), shallower first on ties."""
+
+    def __init__(
+        self, max_calls=MORE_COMMENTS_MAX_CALLS, max_seconds=MORE_COMMENTS_MAX_SECONDS
+    ):
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+
+    @staticmethod
+    def priority(more):
+        return (-(more.count or 0), getattr(more, "depth", 0) or 0)
+
+    def exhausted(self, calls, started):
+        if self.max_calls is not None and calls >= self.max_calls:
+            return True
+        if self.max_seconds is not None:
+            return time.monotonic() - started >= self.max_seconds
+        return False
+
+
+def expand_comments(submission, items, policy, since=None):
+    """Walk items (Comment and MoreComments objects, e.g. a submission's
+    top-level comment forest) and their replies, and expand MoreComments in
+    priority order until the policy's budget runs out.
+
+    since (epoch seconds) is for re-crawls of a thread sorted by new: a stub
+    whose level already holds a comment created at or before since only hides
+    older siblings, so it is dropped instead of expanded (new replies nested
+    under those older siblings are not reached).
+
+    Returns (comments, unexpanded MoreComments, API calls made)."""
+    comments = {}
+    heap = []
+    queued = set()
+    # parent fullname -> creation time of its oldest reply seen so far
+    oldest_reply = {}
+    tiebreak = itertools.count()
+
+    def collect(objects):
+        stack = list(objects)
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, MoreComments):
+                # reached again through a flattened list: queue each stub once,
+                # or it costs a second call and can be saved as pending after
+                # it was expanded ("continue this thread" stubs all have id "_")
+                key = (obj.parent_id, obj.id)
+                if key in queued:
+                    continue
+                queued.add(key)
+                obj.submission = submission
+                heapq.heappush(heap, (policy.priority(obj), next(tiebreak), obj))
+            elif obj.id not in comments:
+                comments[obj.id] = obj
+                if since is not None:
+                    oldest_reply[obj.parent_id] = min(
+                        oldest_reply.get(obj.parent_id, obj.created_utc),
+                        obj.created_utc,
+                    )
+                stack.extend(getattr(obj, "replies", []) or [])
+
+    def behind_watermark(more):
+        return (
+            since is not None and oldest_reply.get(more.parent_id, since + 1) <= since
+        )
+
+    collect(items)
+
+    calls = 0
+    pruned = 0
+    started = time.monotonic()
+    while heap and not policy.exhausted(calls, started):
+        _, _, more = heapq.heappop(heap)
+        if behind_watermark(more):
+            pruned += 1
+            continue
+        collect(more.comments(update=False))
+        calls += 1
+
+    unexpanded = []
+    for _, _, more in sorted(heap):
+        if behind_watermark(more):
+            pruned += 1
+        else:
+            unexpanded.append(more)
+    if pruned:
+        metrics.increment("more_comments_pruned_total", pruned)
+    return list(comments.values()), unexpanded, calls
+
+
+def stub_to_row(post_id, more):
+    return {
+        "post_id": post_id,
+        "parent_id": more.parent_id,
+        "more_id": more.id,
+        "child_count": more.count,
+        "depth": getattr(more, "depth", None),
+        "children": ",".join(more.children),
+    }
+
+
+def stub_from_row(reddit, submission, row):
+    more = MoreComments(
+        reddit,
+        _data={
+            "id": row["more_id"],
+            "name": f"t1_{row['more_id']}",
+            "parent_id": row["parent_id"],
+            "count": row["child_count"],
+            "depth": row["depth"],
+            "children": row["children"].split(",") if row["children"] else [],
+        },
+    )
+    more.submission = submission
+    return more
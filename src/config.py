@@ -36,6 +36,58 @@ SUBREDDITS = [
 
 DB_URL = os.getenv("DATABASE_URL")
 
+# connection pool shared by every DBClient in a process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# parameter sets sent per round trip when execute() is given a list of params
+DB_PAGE_SIZE = int(os.getenv("DB_PAGE_SIZE", "1000"))
+
+# rows per server-side cursor fetch / per write batch for the comment processors
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "5000"))
+# VADER scoring processes; 1 keeps scoring in the main process
+SENTIMENT_WORKERS = int(os.getenv("SENTIMENT_WORKERS", "1"))
+# in-memory LRU of cleaning/VADER results by body hash (0 = off); longer bodies
+# are not cached. RESULT_CACHE_PERSIST=1 also reads/writes enrichment_cache
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "100000"))
+RESULT_CACHE_MAX_BODY_CHARS = int(os.getenv("RESULT_CACHE_MAX_BODY_CHARS", "2000"))
+RESULT_CACHE_PERSIST = os.getenv("RESULT_CACHE_PERSIST", "0") == "1"
+# enrichment_daemon.py also sweeps for every pending comment this often
+# (seconds), in case a NOTIFY was missed
+ENRICH_DAEMON_SWEEP_SECONDS = float(os.getenv("ENRICH_DAEMON_SWEEP_SECONDS", "300"))
+
+# Reddit API quota shared by every PRAW session in a process (100 QPM for OAuth)
+REDDIT_REQUESTS_PER_MINUTE = float(os.getenv("REDDIT_REQUESTS_PER_MINUTE", "100"))
+REDDIT_BURST = int(os.getenv("REDDIT_BURST", "5"))
+# submissions whose comment trees are fetched concurrently
+HARVEST_WORKERS = int(os.getenv("HARVEST_WORKERS", "4"))
+# per-submission budget for expanding "load more comments" stubs (0 = unlimited)
+MORE_COMMENTS_MAX_CALLS = int(os.getenv("MORE_COMMENTS_MAX_CALLS", "32")) or None
+MORE_COMMENTS_MAX_SECONDS = float(os.getenv("MORE_COMMENTS_MAX_SECONDS", "120")) or None
+
+# subreddits whose posts are collected at once, listings (top/hot/new/
+# controversial) fetched at once across them, and how many known posts in a
+# row end paging through a subreddit's new listing
+POST_WORKERS = int(os.getenv("POST_WORKERS", "2"))
+LISTING_WORKERS = int(os.getenv("LISTING_WORKERS", "8"))
+NEW_LISTING_KNOWN_RUN = int(os.getenv("NEW_LISTING_KNOWN_RUN", "25"))
+# main.py pipeline: subreddits whose comments are crawled at once, and work
+# items a stage may queue for the next one before it blocks
+PIPELINE_COMMENT_WORKERS = int(os.getenv("PIPELINE_COMMENT_WORKERS", "1"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+
+# per-subreddit indexes of the post/comment ids already stored (seen_ids.py)
+SEEN_IDS_DIR = os.getenv("SEEN_IDS_DIR", os.path.join("data", "seen_ids"))
+
+# where scripts write their run metrics (<script>.json and <script>.prom)
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join("logs", "metrics"))
+# QUERY_PROFILE=1 times every DBClient statement and adds a ranked report of
+# the top QUERY_PROFILE_TOP_N (<script>.queries.txt) to the run metrics, with
+# the EXPLAIN output of statements slower than QUERY_PROFILE_SLOW_MS
+QUERY_PROFILE = os.getenv("QUERY_PROFILE", "0") == "1"
+QUERY_PROFILE_SLOW_MS = float(os.getenv("QUERY_PROFILE_SLOW_MS", "500"))
+QUERY_PROFILE_TOP_N = int(os.getenv("QUERY_PROFILE_TOP_N", "20"))
+
 used = [
     "dataisbeautiful",
     "SQL",
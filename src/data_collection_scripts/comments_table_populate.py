@@ -1,43 +1,67 @@
 import logging
 import os
-import pandas as pd
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from itertools import compress
+import numpy as np
+import pyarrow as pa
 from tqdm import tqdm
-from sqlalchemy import create_engine
 from clients import DBClient, PrawClient
-from config import SUBREDDITS, DB_URL
-
-log_file_name = "comments_table_populate.log"
-log_dir = os.path.join("logs", "scripts")
-log_path = os.path.join(log_dir, log_file_name)
-
-os.makedirs(log_dir, exist_ok=True)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] - %(message)s",
-    handlers=[
-        logging.FileHandler(log_path),
-        logging.StreamHandler(),
-    ],
+from comment_expansion import (
+    ExpansionPolicy,
+    expand_comments,
+    stub_from_row,
+    stub_to_row,
 )
+from config import SUBREDDITS, DB_URL, HARVEST_WORKERS
+from instrumentation import metrics
+from seen_ids import load_seen_ids
 
 
-def bulk_upsert_authors(db_client, authors):
-    if not authors:
-        return
-
+def write_comment_batch(
+    db_client, comments, authors, crawl_states, stubs=(), resumed_post_ids=()
+):
+    """Write one batch as a single unit of work: authors, comments (row dicts or
+    an Arrow table), the posts' crawl state and their unexpanded stubs. A failed
+    batch rolls back and leaves its posts queued for the next run. Returns the
+    number of new comments."""
     author_list = [
-        {"fullname": fullname, "name": name} for fullname, name in authors.items()
+        {"author_fullname": fullname, "author_name": name}
+        for fullname, name in authors.items()
     ]
 
-    query = """
-        INSERT INTO authors (author_fullname, author_name)
-        VALUES (:fullname, :name)
-        ON CONFLICT (author_fullname) DO NOTHING
-    """
+    try:
+        with db_client.session() as s:
+            s.bulk_load("authors", author_list, conflict_key="author_fullname")
+            # re-crawls and resumed stubs can overlap what is already stored
+            inserted_count = s.bulk_load(
+                "comments", comments, conflict_key="comment_id"
+            )
+            s.bulk_load(
+                "post_crawl_state",
+                crawl_states,
+                conflict_key="post_id",
+                on_conflict="update",
+            )
+
+            # stubs of resumed posts are replaced by whatever is still left
+            if resumed_post_ids:
+                s.execute(
+                    "DELETE FROM pending_more_comments WHERE post_id = ANY(:post_ids)",
+                    {"post_ids": list(resumed_post_ids)},
+                )
+            s.bulk_load(
+                "pending_more_comments",
+                stubs,
+                conflict_key=("post_id", "parent_id", "more_id"),
+                on_conflict="update",
+            )
 
-    db_client.execute(query, author_list)
-    logging.info(f"Bulk upserted {len(author_list)} unique authors.")
+        return inserted_count
+    except Exception as e:
+        logging.error(f"Error writing comment batch: {e}", exc_info=True)
+        return 0
 
 
 def get_subreddit_id(db_client, subreddit):
@@ -55,126 +79,368 @@ def get_subreddit_id(db_client, subreddit):
         raise ValueError(f"Subreddit 'r/{subreddit}' not found in the database.")
 
 
-def get_post_ids_for_subreddit(db_client, subreddit_id):
-    query = "SELECT post_id FROM posts WHERE subreddit_id = :subreddit_id"
+def get_posts_to_crawl(db_client, subreddit_id):
+    """Posts never crawled, or whose live num_comments grew past the count seen
+    at their last crawl. Maps post_id -> newest comment timestamp stored (None
+    for a first crawl)."""
+    query = """
+        SELECT p.post_id, s.newest_comment_utc
+        FROM posts p
+        LEFT JOIN post_crawl_state s ON s.post_id = p.post_id
+        WHERE p.subreddit_id = :subreddit_id
+            AND (s.post_id IS NULL OR p.num_comments > s.num_comments_seen)
+    """
 
     params = {"subreddit_id": subreddit_id}
     result = db_client.fetch_all(query, params)
 
-    return [row["post_id"] for row in result]
+    return {row["post_id"]: row["newest_comment_utc"] for row in result}
 
 
-def get_processed_post_ids(db_client, subreddit_id):
+def get_pending_stubs(db_client, subreddit_id):
     query = """
-        SELECT DISTINCT p.post_id
-        FROM posts p
-        JOIN comments c ON p.post_id = c.post_id
+        SELECT pm.post_id, pm.parent_id, pm.more_id, pm.child_count, pm.depth,
+            pm.children
+        FROM pending_more_comments pm
+        JOIN posts p ON p.post_id = pm.post_id
         WHERE p.subreddit_id = :subreddit_id
     """
 
     params = {"subreddit_id": subreddit_id}
     result = db_client.fetch_all(query, params)
 
-    return [row["post_id"] for row in result]
+    pending = {}
+    for row in result:
+        pending.setdefault(row["post_id"], []).append(row)
+    return pending
+
+
+COMMENT_SCHEMA = pa.schema(
+    [
+        ("comment_id", pa.string()),
+        ("post_id", pa.string()),
+        ("author_fullname", pa.string()),
+        ("parent_id", pa.string()),
+        ("body", pa.string()),
+        ("created_utc", pa.timestamp("us", tz="UTC")),
+        ("score", pa.int32()),
+        ("depth", pa.int32()),
+        ("is_submitter", pa.bool_()),
+        ("stickied", pa.bool_()),
+    ]
+)
 
 
-def comments_table_populate(
-    praw_client, db_client, sql_engine, subreddits, batch_size=25
+class CommentBatch:
+    """Comment rows collected column by column, for bulk_load as an Arrow table.
+    created_utc stays epoch seconds until to_arrow() converts the whole column
+    at once."""
+
+    def __init__(self):
+        self.columns = {name: [] for name in COMMENT_SCHEMA.names}
+
+    def __len__(self):
+        return len(self.columns["comment_id"])
+
+    def append(self, comment, post_id):
+        columns = self.columns
+        columns["comment_id"].append(comment.id)
+        columns["post_id"].append(post_id)
+        columns["author_fullname"].append(
+            comment.author_fullname if comment.author else None
+        )
+        columns["parent_id"].append(comment.parent_id)
+        columns["body"].append(comment.body)
+        columns["created_utc"].append(comment.created_utc)
+        columns["score"].append(comment.score)
+        columns["depth"].append(comment.depth)
+        columns["is_submitter"].append(comment.is_submitter)
+        columns["stickied"].append(comment.stickied)
+
+    def extend(self, other):
+        for name, values in other.columns.items():
+            self.columns[name].extend(values)
+
+    def filter(self, keep):
+        """A new batch of the rows where keep (booleans, one per row) is true."""
+        batch = CommentBatch()
+        for name, values in self.columns.items():
+            batch.columns[name] = list(compress(values, keep))
+        return batch
+
+    def to_arrow(self):
+        seconds = np.asarray(self.columns["created_utc"], dtype=np.float64)
+        micros = np.round(seconds * 1_000_000).astype(np.int64)
+        arrays = [
+            (
+                pa.array(micros, type=field.type)
+                if field.name == "created_utc"
+                else pa.array(self.columns[field.name], type=field.type)
+            )
+            for field in COMMENT_SCHEMA
+        ]
+        return pa.Table.from_arrays(arrays, schema=COMMENT_SCHEMA)
+
+
+def fetch_submission_comments(
+    praw_client, post_id, policy, watermark=None, pending_stubs=None
 ):
-    total_new_comments = 0
-    for subreddit_name in tqdm(subreddits, desc="Overall Progress"):
-        try:
-            logging.info(f"--- Starting comment collection for r/{subreddit_name} ---")
+    """Collect a submission's comments within the expansion policy's budget.
+
+    - pending_stubs: only expand those previously unexpanded stubs.
+    - watermark (newest stored comment time): re-crawl sorted by new, expand
+      only stubs that can still hide newer comments, and keep only comments
+      created after it.
+    - otherwise: first crawl of the whole thread.
+
+    Returns (CommentBatch, authors, unexpanded stub rows, crawl state row or
+    None)."""
+    # runs on a harvester thread, so it uses that thread's own Reddit instance
+    reddit = praw_client.thread_reddit()
+    submission = reddit.submission(id=post_id)
+
+    if pending_stubs:
+        items = [stub_from_row(reddit, submission, row) for row in pending_stubs]
+    else:
+        if watermark is not None:
+            submission.comment_sort = "new"
+        # the top-level forest: expand_comments walks the replies itself
+        items = list(submission.comments)
+
+    since = watermark.timestamp() if watermark is not None else None
+    found, unexpanded, calls = expand_comments(submission, items, policy, since)
+
+    newest = since
+
+    comments = CommentBatch()
+    authors = {}
+
+    for comment in found:
+        if not hasattr(comment, "body"):
+            continue
+        if since is not None and comment.created_utc <= since:
+            continue
+
+        if comment.author:
+            authors[comment.author_fullname] = comment.author.name
+
+        comments.append(comment, post_id)
+        newest = max(newest or comment.created_utc, comment.created_utc)
+
+    if unexpanded:
+        logging.info(
+            f"Post {post_id}: {len(unexpanded)} 'load more' stubs left after "
+            f"{calls} expansions."
+        )
+
+    # a re-crawl's leftovers are the stubs that can still hide new comments
+    # (the rest were dropped); saved like any other, since num_comments_seen
+    # below already counts what they hide
+    stubs = [stub_to_row(post_id, more) for more in unexpanded]
+
+    crawl_state = None
+    if not pending_stubs:
+        crawl_state = {
+            "post_id": post_id,
+            "comments_fetched_at": datetime.now(timezone.utc),
+            "num_comments_seen": submission.num_comments,
+            "newest_comment_utc": (
+                datetime.fromtimestamp(newest, tz=timezone.utc)
+                if newest is not None
+                else None
+            ),
+        }
+
+    return comments, authors, stubs, crawl_state
+
+
+def harvest_comments(praw_client, tasks, policy, workers=HARVEST_WORKERS):
+    """tasks maps post_id -> fetch_submission_comments keyword arguments.
+
+    Yield (post_id, result) as submissions finish, keeping up to 2 * workers
+    submissions in flight. result is fetch_submission_comments' tuple, or None
+    if the post failed."""
+    tasks = iter(tasks.items())
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="harvester"
+    ) as pool:
+        in_flight = {}
+
+        def submit_next():
+            task = next(tasks, None)
+            if task is None:
+                return False
+            post_id, kwargs = task
+            future = pool.submit(
+                fetch_submission_comments, praw_client, post_id, policy, **kwargs
+            )
+            in_flight[future] = post_id
+            return True
 
-            subreddit_id = get_subreddit_id(db_client, subreddit_name)
+        for _ in range(2 * workers):
+            if not submit_next():
+                break
 
-            all_post_ids = get_post_ids_for_subreddit(db_client, subreddit_id)
-            if not all_post_ids:
-                logging.warning(
-                    f"No posts found in database for r/{subreddit_name}. Skipping."
-                )
-                continue
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                post_id = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"Could not process comments for post {post_id}: {e}")
+                    result = None
 
-            processed_post_ids = get_processed_post_ids(db_client, subreddit_id)
+                submit_next()
+                yield post_id, result
 
-            posts_to_process = list(set(all_post_ids) - set(processed_post_ids))
 
-            logging.info(
-                f"Found {len(all_post_ids)} total posts. {len(processed_post_ids)} already processed."
-            )
-            if not posts_to_process:
-                logging.info(
-                    f"No new posts to process for r/{subreddit_name}. Skipping."
-                )
-                continue
+def collect_subreddit_comments(
+    praw_client,
+    db_client,
+    subreddit_name,
+    batch_size=25,
+    workers=HARVEST_WORKERS,
+    policy=None,
+    on_batch=None,
+    stop=None,
+):
+    """Crawl the comments of one subreddit's new, grown and unfinished posts,
+    writing them in batches of batch_size posts. Returns the number of new
+    comments.
+
+    on_batch(comments) is called with each batch's CommentBatch once it is
+    written and holds new comments. Setting the stop event ends the crawl after
+    the next batch is written; the rest of the posts are picked up next run."""
+    policy = policy or ExpansionPolicy()
+    logging.info(f"--- Starting comment collection for r/{subreddit_name} ---")
+
+    subreddit_id = get_subreddit_id(db_client, subreddit_name)
+    seen_comment_ids = load_seen_ids(
+        db_client, "comments", subreddit_name, subreddit_id
+    )
 
-            logging.info(
-                f"Processing comments for {len(posts_to_process)} new posts..."
-            )
+    to_crawl = get_posts_to_crawl(db_client, subreddit_id)
+    # posts whose last crawl ran out of expansion budget
+    pending = get_pending_stubs(db_client, subreddit_id)
 
-            comments_in_batch = []
-            authors_in_batch = {}
+    tasks = {
+        post_id: {"watermark": watermark} for post_id, watermark in to_crawl.items()
+    }
+    # a post due for a re-crawl finishes its old stubs on a later run
+    for post_id, stub_rows in pending.items():
+        tasks.setdefault(post_id, {"pending_stubs": stub_rows})
 
-            post_ids_iter = tqdm(
-                posts_to_process, desc=f"r/{subreddit_name}", leave=False
-            )
+    recrawls = sum(1 for w in to_crawl.values() if w is not None)
+    logging.info(
+        f"Found {len(to_crawl) - recrawls} new posts, {recrawls} posts with "
+        f"new comments and {len(pending)} posts with unexpanded comment stubs."
+    )
+    if not tasks:
+        logging.info(f"No new posts to process for r/{subreddit_name}. Skipping.")
+        return 0
 
-            for idx, post_id in enumerate(post_ids_iter):
-                try:
-                    submission = praw_client.reddit.submission(id=post_id)
-                    submission.comments.replace_more(limit=None)
-
-                    for comment in submission.comments.list():
-                        if not hasattr(comment, "body"):
-                            continue
-
-                        author_fullname = None
-                        if comment.author:
-                            author_fullname = comment.author_fullname
-                            authors_in_batch[comment.author_fullname] = (
-                                comment.author.name
-                            )
-
-                        comments_in_batch.append(
-                            {
-                                "comment_id": comment.id,
-                                "post_id": post_id,
-                                "author_fullname": author_fullname,
-                                "parent_id": comment.parent_id,
-                                "body": comment.body,
-                                "created_utc": pd.to_datetime(
-                                    comment.created_utc, unit="s", utc=True
-                                ),
-                                "score": comment.score,
-                                "depth": comment.depth,
-                                "is_submitter": comment.is_submitter,
-                                "stickied": comment.stickied,
-                            }
-                        )
-                except Exception as e:
-                    logging.error(f"Could not process comments for post {post_id}: {e}")
+    logging.info(
+        f"Processing comments for {len(tasks)} posts "
+        f"with {workers} harvester threads..."
+    )
 
-                if (idx + 1) % batch_size == 0 or (idx + 1) == len(posts_to_process):
-                    if not comments_in_batch:
-                        continue
+    total_new_comments = 0
+    comments_in_batch = CommentBatch()
+    authors_in_batch = {}
+    crawl_states_in_batch = []
+    stubs_in_batch = []
+    resumed_in_batch = set()
+
+    harvest = harvest_comments(praw_client, tasks, policy, workers=workers)
+    harvested = tqdm(
+        harvest,
+        total=len(tasks),
+        desc=f"r/{subreddit_name}",
+        leave=False,
+    )
 
-                    bulk_upsert_authors(db_client, authors_in_batch)
+    # harvester threads only fetch; this loop is the single DB writer
+    for idx, (post_id, result) in enumerate(harvested):
+        if result is not None:
+            comments, authors, stubs, crawl_state = result
+            comments_in_batch.extend(comments)
+            authors_in_batch.update(authors)
+            stubs_in_batch.extend(stubs)
+            if crawl_state is not None:
+                crawl_states_in_batch.append(crawl_state)
+            else:
+                resumed_in_batch.add(post_id)
+
+        stopping = stop is not None and stop.is_set()
+        if (idx + 1) % batch_size == 0 or (idx + 1) == len(tasks) or stopping:
+            # a resumed crawl or a re-crawl can bring back comments already stored
+            known = seen_comment_ids.contains(comments_in_batch.columns["comment_id"])
+            if known.any():
+                metrics.increment("seen_ids_skipped_total", int(known.sum()))
+                comments_in_batch = comments_in_batch.filter(~known)
+
+            inserted_count = write_comment_batch(
+                db_client,
+                comments_in_batch.to_arrow(),
+                authors_in_batch,
+                crawl_states_in_batch,
+                stubs_in_batch,
+                resumed_in_batch,
+            )
+            total_new_comments += inserted_count
+            # a batch with new comments committed, so all of them are stored now
+            if inserted_count:
+                seen_comment_ids.add(comments_in_batch.columns["comment_id"])
+            logging.info(
+                f"Saved a batch of {inserted_count} comments for r/{subreddit_name}."
+            )
+            if on_batch is not None and inserted_count:
+                on_batch(comments_in_batch)
 
-                    df = pd.DataFrame(comments_in_batch)
-                    df.to_sql(
-                        name="comments", con=sql_engine, if_exists="append", index=False
-                    )
+            comments_in_batch = CommentBatch()
+            authors_in_batch = {}
+            crawl_states_in_batch = []
+            stubs_in_batch = []
+            resumed_in_batch = set()
 
-                    inserted_count = len(df)
-                    total_new_comments += inserted_count
-                    logging.info(
-                        f"Saved a batch of {inserted_count} comments for r/{subreddit_name}."
-                    )
+        if stopping:
+            logging.info(f"Stopping r/{subreddit_name} early.")
+            # waits for the submissions in flight, whose posts stay queued
+            harvested.close()
+            harvest.close()
+            seen_comment_ids.save()
+            return total_new_comments
 
-                    comments_in_batch = []
-                    authors_in_batch = {}
+    # once per run: a run that dies first leaves the saved index behind the
+    # database, and the next load rebuilds it
+    seen_comment_ids.save()
+    logging.info(f"Completed r/{subreddit_name}.")
+    return total_new_comments
 
-            logging.info(f"Completed r/{subreddit_name}.")
+
+def comments_table_populate(
+    praw_client,
+    db_client,
+    subreddits,
+    batch_size=25,
+    workers=HARVEST_WORKERS,
+    policy=None,
+):
+    policy = policy or ExpansionPolicy()
+    started = time.perf_counter()
+    total_new_comments = 0
+    for subreddit_name in tqdm(subreddits, desc="Overall Progress"):
+        try:
+            total_new_comments += collect_subreddit_comments(
+                praw_client,
+                db_client,
+                subreddit_name,
+                batch_size=batch_size,
+                workers=workers,
+                policy=policy,
+            )
 
         except Exception as e:
             logging.error(
@@ -182,25 +448,43 @@ def comments_table_populate(
                 exc_info=True,
             )
 
+    metrics.record_stage("comments", total_new_comments, time.perf_counter() - started)
     logging.info("--- FINISHED ---")
     logging.info(
         f"Total new comments inserted across all subreddits: {total_new_comments}"
     )
 
 
-praw_client = PrawClient()
-db_client = DBClient(DB_URL)
-sql_engine = create_engine(DB_URL)
+if __name__ == "__main__":
+    log_file_name = "comments_table_populate.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
 
-try:
-    comments_table_populate(
-        praw_client=praw_client,
-        db_client=db_client,
-        sql_engine=sql_engine,
-        subreddits=SUBREDDITS,
-        batch_size=25,
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
     )
-except Exception as e:
-    logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
-finally:
-    logging.info("Comment collection script finished.")
+
+    praw_client = PrawClient()
+    db_client = DBClient(DB_URL)
+    success = False
+
+    try:
+        comments_table_populate(
+            praw_client=praw_client,
+            db_client=db_client,
+            subreddits=SUBREDDITS,
+            batch_size=25,
+        )
+        success = True
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+    finally:
+        metrics.export("comments_table_populate", success=success)
+        logging.info("Comment collection script finished.")
@@ -1,62 +1,95 @@
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
+from functools import partial
 from tqdm import tqdm
 from clients import DBClient, PrawClient
-from config import SUBREDDITS, DB_URL
-
-log_file_name = "posts_table_populate.log"
-log_dir = os.path.join("logs", "scripts")
-log_path = os.path.join(log_dir, log_file_name)
-
-os.makedirs(log_dir, exist_ok=True)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] - %(message)s",
-    handlers=[
-        logging.FileHandler(log_path),
-        logging.StreamHandler(),
-    ],
+from config import (
+    SUBREDDITS,
+    DB_URL,
+    LISTING_WORKERS,
+    NEW_LISTING_KNOWN_RUN,
+    POST_WORKERS,
 )
-
-
-def fetch_diverse_posts(subreddit, limit, time_interval):
-    logging.info(f"Fetching diverse posts for r/{subreddit.display_name}...")
-
-    posts = {}
-
-    try:
-        for post in subreddit.top(limit=limit, time_filter=time_interval):
-            posts[post.id] = post
-    except Exception as e:
-        logging.warning(
-            f"Could not fetch 'top' posts for r/{subreddit.display_name}: {e}"
-        )
-
-    try:
-        for post in subreddit.hot(limit=limit):
-            posts[post.id] = post
-    except Exception as e:
-        logging.warning(
-            f"Could not fetch 'hot' posts for r/{subreddit.display_name}: {e}"
+from instrumentation import metrics
+from seen_ids import load_seen_ids
+
+# listings fetched per subreddit; top and controversial also take a time filter
+LISTINGS = ("top", "hot", "new", "controversial")
+
+
+def fetch_listing(
+    praw_client, subreddit_name, listing, limit, time_interval, known_post_ids=None
+):
+    """One listing's posts. new is newest first, so given known_post_ids it stops
+    paging after NEW_LISTING_KNOWN_RUN known posts in a row: everything older
+    was seen by an earlier run. known_post_ids is anything supporting `in`,
+    e.g. a SeenIds."""
+    # runs on a listing thread, so it uses that thread's own Reddit instance
+    subreddit = praw_client.thread_reddit().subreddit(subreddit_name)
+    if listing in ("top", "controversial"):
+        listing_posts = getattr(subreddit, listing)(
+            limit=limit, time_filter=time_interval
         )
+    else:
+        listing_posts = getattr(subreddit, listing)(limit=limit)
+
+    posts = []
+    known_run = 0
+    for post in listing_posts:
+        posts.append(post)
+        if listing == "new" and known_post_ids is not None:
+            known_run = known_run + 1 if post.id in known_post_ids else 0
+            if known_run >= NEW_LISTING_KNOWN_RUN:
+                metrics.increment("listing_early_stops_total", listing=listing)
+                break
+
+    metrics.increment("listing_posts_total", len(posts), listing=listing)
+    return posts
+
+
+def fetch_diverse_posts(
+    praw_client,
+    subreddit_name,
+    limit,
+    time_interval,
+    known_post_ids=None,
+    listing_pool=None,
+):
+    """Unique posts across the subreddit's listings, fetched concurrently on
+    listing_pool (one after another without one)."""
+    logging.info(f"Fetching diverse posts for r/{subreddit_name}...")
+
+    args = (praw_client, subreddit_name)
+    kwargs = {
+        "limit": limit,
+        "time_interval": time_interval,
+        "known_post_ids": known_post_ids,
+    }
+    if listing_pool is not None:
+        futures = {
+            listing: listing_pool.submit(fetch_listing, *args, listing, **kwargs)
+            for listing in LISTINGS
+        }
+        fetchers = {listing: future.result for listing, future in futures.items()}
+    else:
+        fetchers = {
+            listing: partial(fetch_listing, *args, listing, **kwargs)
+            for listing in LISTINGS
+        }
 
-    try:
-        for post in subreddit.new(limit=limit):
-            posts[post.id] = post
-    except Exception as e:
-        logging.warning(
-            f"Could not fetch 'new' posts for r/{subreddit.display_name}: {e}"
-        )
+    posts = {}
 
-    try:
-        for post in subreddit.controversial(limit=limit, time_filter=time_interval):
-            posts[post.id] = post
-    except Exception as e:
-        logging.warning(
-            f"Could not fetch 'controversial' posts for r/{subreddit.display_name}: {e}"
-        )
+    for listing, fetch in fetchers.items():
+        try:
+            for post in fetch():
+                posts[post.id] = post
+        except Exception as e:
+            logging.warning(
+                f"Could not fetch '{listing}' posts for r/{subreddit_name}: {e}"
+            )
 
     logging.info(f"Found {len(posts)} unique posts across categories.")
 
@@ -68,36 +101,29 @@ def bulk_upsert_authors(db_client, authors):
         return
 
     author_list = [
-        {"fullname": fullname, "name": name} for fullname, name in authors.items()
+        {"author_fullname": fullname, "author_name": name}
+        for fullname, name in authors.items()
     ]
 
-    query = """
-        INSERT INTO authors (author_fullname, author_name)
-        VALUES (:fullname, :name)
-        ON CONFLICT (author_fullname) DO NOTHING
-    """
-
-    db_client.execute(query, author_list)
+    db_client.bulk_load("authors", author_list, conflict_key="author_fullname")
     logging.info(f"Bulk upserted {len(author_list)} unique authors.")
 
 
+# refreshed on posts we already have, so comment growth can trigger a re-crawl
+POST_STAT_COLUMNS = ("score", "num_comments", "upvote_ratio", "stickied")
+
+
 def bulk_upsert_posts(db_client, posts):
     if not posts:
         return 0
 
-    query = """
-        INSERT INTO posts (
-            post_id, subreddit_id, author_fullname, title, selftext, url, 
-            flair, created_utc, score, num_comments, upvote_ratio, stickied
-        )
-        VALUES (
-            :post_id, :subreddit_id, :author_fullname, :title, :selftext, :url, 
-            :flair, :created_utc, :score, :num_comments, :upvote_ratio, :stickied
-        )
-        ON CONFLICT (post_id) DO NOTHING
-    """
-
-    row_count = db_client.execute(query, posts)
+    row_count = db_client.bulk_load(
+        "posts",
+        posts,
+        conflict_key="post_id",
+        on_conflict="update",
+        update_columns=POST_STAT_COLUMNS,
+    )
     return row_count
 
 
@@ -117,104 +143,165 @@ def get_subreddit_id(db_client, subreddit):
         raise ValueError(f"Subreddit 'r/{subreddit}' not found in the database. ")
 
 
-def get_existing_post_ids(db_client, subreddit_id):
-    query = """SELECT post_id
-    FROM posts
-    WHERE subreddit_id = :subreddit_id
-    """
-
-    params = {"subreddit_id": subreddit_id}
-    result = db_client.fetch_all(query, params)
-
-    return {row["post_id"] for row in result}
+def collect_subreddit_posts(
+    praw_client, db_client, subreddit_name, limit, time_interval, listing_pool=None
+):
+    """Fetch one subreddit's posts and upsert them with their authors. Returns
+    (posts fetched, new posts inserted)."""
+    logging.info(f"--- Starting collection for r/{subreddit_name} ---")
 
+    subreddit_id = get_subreddit_id(db_client, subreddit_name)
 
-def posts_table_populate(praw_client, db_client, subreddits, limit, time_interval):
-    total_new_posts = 0
-    for subreddit in tqdm(subreddits, desc="Overall Progress"):
-        try:
-            logging.info(f"--- Starting collection for r/{subreddit} ---")
+    seen_post_ids = load_seen_ids(db_client, "posts", subreddit_name, subreddit_id)
 
-            subreddit_id = get_subreddit_id(db_client, subreddit)
+    all_posts = fetch_diverse_posts(
+        praw_client,
+        subreddit_name,
+        limit=limit,
+        time_interval=time_interval,
+        known_post_ids=seen_post_ids,
+        listing_pool=listing_pool,
+    )
 
-            existing_post_ids = get_existing_post_ids(db_client, subreddit_id)
+    posts = []
+    authors = {}
+
+    all_posts_iter = tqdm(all_posts, desc=f"r/{subreddit_name}", leave=False)
+
+    for post in all_posts_iter:
+        if post.author:
+            authors[post.author_fullname] = post.author.name
+            author_fullname = post.author_fullname
+        else:
+            author_fullname = None
+
+        posts.append(
+            {
+                "post_id": post.id,
+                "subreddit_id": subreddit_id,
+                "author_fullname": author_fullname,
+                "title": post.title,
+                "flair": post.link_flair_text,
+                "selftext": post.selftext,
+                "url": post.url,
+                "created_utc": datetime.fromtimestamp(
+                    post.created_utc, tz=timezone.utc
+                ),
+                "score": post.score,
+                "num_comments": post.num_comments,
+                "upvote_ratio": post.upvote_ratio,
+                "stickied": post.stickied,
+            }
+        )
 
-            subreddit = praw_client.reddit.subreddit(subreddit)
-            all_posts = fetch_diverse_posts(
-                subreddit, limit=limit, time_interval=time_interval
-            )
+    if not posts:
+        logging.warning(f"No posts found for r/{subreddit_name}. Skipping.")
+        return 0, 0
+
+    # authors and posts land together or not at all
+    with db_client.session() as s:
+        bulk_upsert_authors(s, authors)
+        bulk_upsert_posts(s, posts)
+
+    post_ids = [post["post_id"] for post in posts]
+    inserted_count = int((~seen_post_ids.contains(post_ids)).sum())
+    seen_post_ids.add(post_ids)
+    seen_post_ids.save()
+
+    logging.info(
+        f"Completed r/{subreddit_name}. "
+        f"Fetched {len(posts)} posts from API. "
+        f"Inserted {inserted_count} new posts into the database and "
+        f"refreshed stats on {len(posts) - inserted_count} existing posts."
+    )
+    return len(posts), inserted_count
+
+
+def posts_table_populate(
+    praw_client,
+    db_client,
+    subreddits,
+    limit,
+    time_interval,
+    workers=POST_WORKERS,
+    listing_workers=LISTING_WORKERS,
+):
+    """Collect up to workers subreddits at once, their listings fetched on a
+    shared pool of listing_workers threads. Every thread draws on praw_client's
+    rate limiter."""
+    started = time.perf_counter()
+    total_posts = 0
+    total_new_posts = 0
 
-            posts = []
-            authors = {}
-
-            all_posts_iter = tqdm(all_posts, desc=f"f/{subreddit}", leave=False)
-
-            for post in all_posts_iter:
-                if post.id in existing_post_ids:
-                    continue
-
-                if post.author:
-                    authors[post.author_fullname] = post.author.name
-                    author_fullname = post.author_fullname
-                else:
-                    author_fullname = None
-
-                posts.append(
-                    {
-                        "post_id": post.id,
-                        "subreddit_id": subreddit_id,
-                        "author_fullname": author_fullname,
-                        "title": post.title,
-                        "flair": post.link_flair_text,
-                        "selftext": post.selftext,
-                        "url": post.url,
-                        "created_utc": datetime.fromtimestamp(
-                            post.created_utc, tz=timezone.utc
-                        ),
-                        "score": post.score,
-                        "num_comments": post.num_comments,
-                        "upvote_ratio": post.upvote_ratio,
-                        "stickied": post.stickied,
-                    }
+    with (
+        ThreadPoolExecutor(
+            max_workers=listing_workers, thread_name_prefix="listing"
+        ) as listing_pool,
+        ThreadPoolExecutor(max_workers=workers, thread_name_prefix="posts") as pool,
+    ):
+        futures = {
+            pool.submit(
+                collect_subreddit_posts,
+                praw_client,
+                db_client,
+                subreddit,
+                limit,
+                time_interval,
+                listing_pool,
+            ): subreddit
+            for subreddit in subreddits
+        }
+        for future in tqdm(
+            as_completed(futures), total=len(futures), desc="Overall Progress"
+        ):
+            subreddit = futures[future]
+            try:
+                fetched_count, inserted_count = future.result()
+                total_posts += fetched_count
+                total_new_posts += inserted_count
+
+            except Exception as e:
+                logging.error(
+                    f"An error occurred while processing r/{subreddit}: {e}",
+                    exc_info=True,
                 )
 
-            if not posts:
-                logging.warning(f"No posts found for r/{subreddit}. Skipping.")
-                continue
-
-            bulk_upsert_authors(db_client, authors)
-
-            inserted_count = bulk_upsert_posts(db_client, posts)
-            total_new_posts += inserted_count
-
-            logging.info(
-                f"Completed r/{subreddit}. "
-                f"Fetched {len(posts)} posts from API. "
-                f"Inserted {inserted_count} new posts into the database."
-            )
-
-        except Exception as e:
-            logging.error(
-                f"An error occurred while processing r/{subreddit}: {e}",
-                exc_info=True,
-            )
-
+    metrics.record_stage("posts", total_posts, time.perf_counter() - started)
     logging.info("--- FINISHED ---")
     logging.info(f"Total new posts inserted across all subreddits: {total_new_posts}")
 
 
-praw_client = PrawClient()
-db_client = DBClient(DB_URL)
+if __name__ == "__main__":
+    log_file_name = "posts_table_populate.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
 
-try:
-    posts_table_populate(
-        praw_client=praw_client,
-        db_client=db_client,
-        subreddits=SUBREDDITS,
-        limit=None,
-        time_interval="all",
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
     )
-except Exception as e:
-    logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
-finally:
-    logging.info("Finished")
+
+    praw_client = PrawClient()
+    db_client = DBClient(DB_URL)
+    success = False
+
+    try:
+        posts_table_populate(
+            praw_client=praw_client,
+            db_client=db_client,
+            subreddits=SUBREDDITS,
+            limit=None,
+            time_interval="all",
+        )
+        success = True
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+    finally:
+        metrics.export("posts_table_populate", success=success)
+        logging.info("Finished")
@@ -2,6 +2,7 @@ from tqdm import tqdm
 from datetime import datetime
 from clients import DBClient, PrawClient
 from config import SUBREDDITS, DB_URL
+from instrumentation import metrics
 
 
 def subreddits_table_populate(praw_client, db_client, subreddits):
@@ -42,15 +43,18 @@ def subreddits_table_populate(praw_client, db_client, subreddits):
     try:
         print(f"Executing query to insert/update {len(data)} rows...")
         row_count = db_client.execute(query, data)
+        metrics.increment("subreddits_upserted_total", row_count)
         print(f"{row_count} rows were inserted/updated successfully.")
 
     except Exception as e:
         print(f"Error occurred trying to populate subreddits table: {e}")
 
 
-praw_client = PrawClient()
-db_client = DBClient(DB_URL)
+if __name__ == "__main__":
+    praw_client = PrawClient()
+    db_client = DBClient(DB_URL)
 
-subreddits_table_populate(
-    praw_client=praw_client, db_client=db_client, subreddits=SUBREDDITS
-)
+    subreddits_table_populate(
+        praw_client=praw_client, db_client=db_client, subreddits=SUBREDDITS
+    )
+    metrics.export("subreddits_table_populate")
@@ -0,0 +1,184 @@
+"""Long-running replacement for the comment_cleaner.py / sentiment_analyzer.py
+cron jobs.
+
+Keeps the stopword set, VADER lexicon and result cache warm, and LISTENs for
+the NOTIFYs sent when comments are inserted (migrations 0006_comments_notify
+and 0012_chunked_comments_notify), so new comments are cleaned and scored
+within seconds of being written. A full sweep for pending comments runs at
+startup, every ENRICH_DAEMON_SWEEP_SECONDS, and after a lost database
+connection, in case a notification was missed. Each pass also folds what was
+written into the author sketches (author_sketches.py).
+
+    python enrichment_daemon.py
+    python enrichment_daemon.py --stages score --sweep-seconds 600
+"""
+
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+
+from author_sketches import update_author_sketches
+from clients import DBClient
+from comment_enricher import (
+    STAGES,
+    CommentEnricher,
+    enrich_comments,
+    get_comments,
+    load_stop_words,
+)
+from config import DB_URL, ENRICH_DAEMON_SWEEP_SECONDS
+from instrumentation import metrics
+from result_cache import ResultCache
+
+NOTIFY_CHANNEL = "comments_inserted"
+# how long to wait on the connection before checking for shutdown / a sweep
+WAKE_SECONDS = 1.0
+RECONNECT_SECONDS = 10.0
+
+
+def notified_comment_ids(payloads):
+    """The comment_ids in a batch of NOTIFY payloads (a large insert sends its
+    ids over several), or None if one of them came empty and a full sweep is
+    needed."""
+    comment_ids = set()
+    for payload in payloads:
+        if not payload:
+            return None
+        comment_ids.update(payload.split(","))
+    return comment_ids
+
+
+class EnrichmentDaemon:
+    def __init__(
+        self, db_client, stages=STAGES, sweep_seconds=ENRICH_DAEMON_SWEEP_SECONDS
+    ):
+        self.db_client = db_client
+        self.stages = stages
+        self.sweep_seconds = sweep_seconds
+        self.stop = threading.Event()
+
+        # loaded once, reused by every pass
+        self.stop_words = load_stop_words() if "clean" in stages else None
+        self.enricher = CommentEnricher(self.stop_words, stages)
+        self.cache = ResultCache()
+        self.last_sweep = None
+
+    def request_stop(self, signum=None, frame=None):
+        logging.info("Stop requested; exiting after the current pass.")
+        self.stop.set()
+
+    def _enrich(self, chunks=None):
+        cleaned_count, sentiment_count = enrich_comments(
+            self.db_client,
+            stop_words=self.stop_words,
+            stages=self.stages,
+            workers=1,
+            cache=self.cache,
+            chunks=chunks,
+            enricher=self.enricher,
+        )
+        update_author_sketches(self.db_client)
+        # a daemon never finishes, so keep its metrics file current instead
+        metrics.export("enrichment_daemon")
+        return cleaned_count, sentiment_count
+
+    def sweep(self):
+        logging.info("Sweeping for pending comments...")
+        self.last_sweep = time.monotonic()
+        self._enrich()
+
+    def enrich_notified(self, comment_ids):
+        started = time.perf_counter()
+        chunks = get_comments(self.db_client, self.stages, comment_ids=comment_ids)
+        self._enrich(chunks)
+        metrics.observe("daemon_pass_seconds", time.perf_counter() - started)
+
+    def listen(self):
+        """LISTEN, sweep for whatever arrived while nobody was listening, then
+        handle notifications until stopped. Raises if the connection drops."""
+        notifications = self.db_client.notifications(
+            [NOTIFY_CHANNEL], timeout=WAKE_SECONDS
+        )
+        try:
+            # the first batch comes once LISTEN is in place, so comments written
+            # during the sweep are notified rather than missed
+            payloads = next(notifications)
+            self.sweep()
+
+            while not self.stop.is_set():
+                if payloads:
+                    metrics.increment("daemon_notifications_total", len(payloads))
+                    comment_ids = notified_comment_ids(payloads)
+                    if comment_ids is None:
+                        self.sweep()
+                    else:
+                        logging.info(f"Notified of {len(comment_ids)} new comments.")
+                        self.enrich_notified(comment_ids)
+
+                if time.monotonic() - self.last_sweep >= self.sweep_seconds:
+                    self.sweep()
+                payloads = next(notifications)
+        finally:
+            notifications.close()
+
+    def run(self):
+        logging.info(
+            f"Enrichment daemon ({' + '.join(self.stages)}) listening on "
+            f"'{NOTIFY_CHANNEL}', sweeping every {self.sweep_seconds:.0f}s."
+        )
+        while not self.stop.is_set():
+            try:
+                self.listen()
+            except Exception as e:
+                metrics.increment("daemon_reconnects_total")
+                logging.error(
+                    f"Lost the database connection: {e}. "
+                    f"Reconnecting in {RECONNECT_SECONDS:.0f}s.",
+                    exc_info=True,
+                )
+                self.stop.wait(RECONNECT_SECONDS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=list(STAGES),
+        help="clean (comment_cleaner.py) and/or score (sentiment_analyzer.py)",
+    )
+    parser.add_argument(
+        "--sweep-seconds",
+        type=float,
+        default=ENRICH_DAEMON_SWEEP_SECONDS,
+        help="full sweep interval, in case a notification is missed",
+    )
+    args = parser.parse_args()
+
+    log_file_name = "enrichment_daemon.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    daemon = EnrichmentDaemon(
+        DBClient(DB_URL), stages=tuple(args.stages), sweep_seconds=args.sweep_seconds
+    )
+    signal.signal(signal.SIGINT, daemon.request_stop)
+    signal.signal(signal.SIGTERM, daemon.request_stop)
+
+    daemon.run()
+    logging.info("--- ENRICHMENT DAEMON STOPPED ---")
@@ -0,0 +1,379 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import os
+import re
+import resource
+import sys
+import threading
+import time
+
+from config import (
+    METRICS_DIR,
+    QUERY_PROFILE,
+    QUERY_PROFILE_SLOW_MS,
+    QUERY_PROFILE_TOP_N,
+)
+
+PREFIX = "reddit_pipeline_"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (1, 10, 100, 500, 1000, 5000, 10000, 50000)
+
+METRIC_HELP = {
+    "reddit_api_requests_total": "Reddit API HTTP requests made.",
+    "reddit_api_errors_total": "Reddit API requests that raised.",
+    "reddit_api_request_seconds": "Reddit API request latency.",
+    "reddit_rate_limit_sleeps_total": "Requests that waited on the rate limiter.",
+    "reddit_rate_limit_sleep_seconds_total": (
+        "Seconds spent waiting on the rate limiter."
+    ),
+    "listing_posts_total": "Posts read from subreddit listings.",
+    "listing_early_stops_total": "Listings that stopped paging at known posts.",
+    "seen_ids_skipped_total": "Comments dropped before writing as already stored.",
+    "seen_ids_rebuilds_total": "Seen-id indexes found stale and rebuilt.",
+    "more_comments_pruned_total": "Re-crawl stubs skipped as older than the watermark.",
+    "subreddits_upserted_total": "Subreddit rows inserted or updated.",
+    "author_sketch_rows_total": "(subreddit, week, author) rows folded into sketches.",
+    "db_query_seconds": "Database query latency.",
+    "db_write_seconds": "Database bulk write latency.",
+    "db_write_rows": "Rows per bulk write batch.",
+    "db_rows_written_total": "Rows written by bulk loads.",
+    "db_stream_fetch_seconds": "Time to fetch one server-side cursor chunk.",
+    "db_rows_streamed_total": "Rows read through server-side cursors.",
+    "result_cache_hits_total": "Comments enriched from the result cache.",
+    "result_cache_misses_total": "Distinct bodies enriched from scratch.",
+    "enrich_compute_seconds_total": "Seconds spent cleaning and scoring.",
+    "pipeline_queue_max_depth": "Most items waiting in a pipeline queue at once.",
+    "pipeline_blocked_seconds_total": "Seconds a stage waited on a full queue.",
+    "daemon_notifications_total": "Comment insert notifications received.",
+    "daemon_pass_seconds": "Time to enrich the comments of one notification batch.",
+    "daemon_reconnects_total": "Times the daemon lost its database connection.",
+    "stage_rows": "Rows processed by a pipeline stage.",
+    "stage_duration_seconds": "Wall time spent in a pipeline stage.",
+    "stage_rows_per_second": "Pipeline stage throughput.",
+    "peak_rss_bytes": "Peak resident memory of the process.",
+    "children_peak_rss_bytes": "Peak resident memory of the largest child process.",
+    "run_duration_seconds": "Wall time of the run.",
+    "run_success": "1 if the run finished without a critical error.",
+    "last_run_timestamp_seconds": "Unix time the run finished.",
+}
+# what each pipeline stage (the stage label of the stage_* gauges) counts as rows
+STAGE_HELP = {
+    "posts": "Posts fetched from subreddit listings.",
+    "comments": "New comments written by the collector.",
+    "enrich": "Pending comments cleaned and/or scored.",
+    "thread_tree_load": "Comments loaded into thread trees.",
+    "thread_metrics": "Comments summarised into per-thread metrics.",
+    "author_sketches": "Author sketch update; rows in author_sketch_rows_total.",
+}
+
+
+def _peak_rss_bytes(who):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "max": round(self.max, 6),
+            "buckets": dict(zip(map(str, self.buckets), self.bucket_counts)),
+        }
+
+
+class _Stage:
+    def __init__(self):
+        self.rows = 0
+
+    def add_rows(self, rows):
+        self.rows += rows
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms for one run, shared by every thread in
+    the process. Scripts call export() once at the end to write a JSON summary
+    and a Prometheus textfile (for node_exporter's textfile collector)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+            self._stages = {}
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage; call add_rows() on the yielded object as rows
+        are processed. Repeated stages of the same name add up."""
+        stage = _Stage()
+        started = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            self.record_stage(name, stage.rows, time.perf_counter() - started)
+
+    def record_stage(self, name, rows, seconds):
+        with self._lock:
+            total_rows, total_seconds = self._stages.get(name, (0, 0.0))
+            self._stages[name] = (total_rows + rows, total_seconds + seconds)
+
+    def _snapshot(self):
+        with self._lock:
+            gauges = dict(self._gauges)
+            for stage, (rows, seconds) in self._stages.items():
+                labels = (("stage", stage),)
+                gauges[("stage_rows", labels)] = rows
+                gauges[("stage_duration_seconds", labels)] = seconds
+                gauges[("stage_rows_per_second", labels)] = (
+                    rows / seconds if seconds else 0.0
+                )
+            gauges[("peak_rss_bytes", ())] = _peak_rss_bytes(resource.RUSAGE_SELF)
+            gauges[("children_peak_rss_bytes", ())] = _peak_rss_bytes(
+                resource.RUSAGE_CHILDREN
+            )
+            gauges[("run_duration_seconds", ())] = time.time() - self.started
+            return dict(self._counters), gauges, dict(self._histograms)
+
+    def summary(self):
+        counters, gauges, histograms = self._snapshot()
+
+        def flatten(metrics, value=lambda v: v):
+            out = {}
+            for (name, labels), metric in sorted(metrics.items()):
+                key = name + "".join(f"[{k}={v}]" for k, v in labels)
+                out[key] = value(metric)
+            return out
+
+        return {
+            "started_at": datetime.fromtimestamp(
+                self.started, timezone.utc
+            ).isoformat(),
+            "stages": {
+                stage: STAGE_HELP.get(stage, stage)
+                for (name, labels) in gauges
+                if name == "stage_rows"
+                for _, stage in labels
+            },
+            "counters": flatten(counters),
+            "gauges": flatten(gauges),
+            "histograms": flatten(histograms, lambda h: h.summary()),
+        }
+
+    def to_prometheus(self, **const_labels):
+        counters, gauges, histograms = self._snapshot()
+        lines = []
+
+        def label_text(labels, **extra):
+            pairs = [*const_labels.items(), *labels, *extra.items()]
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+        def header(name, kind, seen):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {PREFIX}{name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter", seen)
+            lines.append(f"{PREFIX}{name}{label_text(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge", seen)
+            lines.append(f"{PREFIX}{name}{label_text(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            header(name, "histogram", seen)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                cumulative += count
+                lines.append(
+                    f"{PREFIX}{name}_bucket{label_text(labels, le=bound)} {cumulative}"
+                )
+            lines.append(
+                f"{PREFIX}{name}_bucket{label_text(labels, le='+Inf')} "
+                f"{histogram.count}"
+            )
+            lines.append(f"{PREFIX}{name}_sum{label_text(labels)} {histogram.sum}")
+            lines.append(f"{PREFIX}{name}_count{label_text(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, job, success=True, directory=METRICS_DIR):
+        """Write <directory>/<job>.json and <directory>/<job>.prom. Each file is
+        replaced atomically, so a scraper never reads a half-written one."""
+        self.set_gauge("run_success", 1 if success else 0)
+        self.set_gauge("last_run_timestamp_seconds", time.time())
+        os.makedirs(directory, exist_ok=True)
+
+        outputs = {
+            f"{job}.json": json.dumps({"job": job, **self.summary()}, indent=2),
+            f"{job}.prom": self.to_prometheus(job=job),
+        }
+        if query_profiler.enabled:
+            outputs[f"{job}.queries.txt"] = query_profiler.report()
+        for file_name, content in outputs.items():
+            path = os.path.join(directory, file_name)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+
+
+def fingerprint(query):
+    """query with its literals, bind parameters and layout normalised, so every
+    call of one statement shares a key."""
+    query = re.sub(r"--[^\n]*", " ", query)
+    query = re.sub(r"'(?:[^']|'')*'", "?", query)
+    query = re.sub(r"(?<![:\w]):\w+|%\(\w+\)s|\b\d+(?:\.\d+)?\b", "?", query)
+    return " ".join(query.split()).rstrip(";").strip()
+
+
+class _QueryStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.plan = None
+        self.plan_seconds = 0.0
+
+
+class QueryProfiler:
+    """Per-statement timings of DBClient, off unless QUERY_PROFILE=1. The first
+    call of a statement slower than slow_seconds, and any slower one after it,
+    gets its EXPLAIN output captured (see DBClient's _explain)."""
+
+    def __init__(
+        self,
+        enabled=QUERY_PROFILE,
+        slow_seconds=QUERY_PROFILE_SLOW_MS / 1000,
+        top_n=QUERY_PROFILE_TOP_N,
+    ):
+        self.enabled = enabled
+        self.slow_seconds = slow_seconds
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, query, seconds, rows, explain=None):
+        """Add one call of query. explain, if given, returns the statement's plan
+        and is only called when this call is the slowest slow one so far."""
+        key = fingerprint(query)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _QueryStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows
+            wants_plan = (
+                explain is not None
+                and seconds >= self.slow_seconds
+                and seconds > stats.plan_seconds
+            )
+            if wants_plan:
+                # claimed before explaining, so concurrent slow calls don't all
+                # run an EXPLAIN ANALYZE
+                stats.plan_seconds = seconds
+
+        if wants_plan:
+            try:
+                plan = explain()
+            except Exception as e:
+                plan = f"(EXPLAIN failed: {e})"
+            with self._lock:
+                if stats.plan_seconds == seconds:
+                    stats.plan = plan
+
+    def report(self):
+        """The top_n statements by total time, as text."""
+        with self._lock:
+            ranked = sorted(
+                self._stats.items(), key=lambda item: item[1].seconds, reverse=True
+            )
+            total_calls = sum(stats.calls for _, stats in ranked)
+            total_seconds = sum(stats.seconds for _, stats in ranked)
+            lines = [
+                f"{total_calls} statement calls ({len(ranked)} distinct), "
+                f"{total_seconds:.3f}s in the database; "
+                f"top {min(self.top_n, len(ranked))} by total time.",
+            ]
+            for rank, (key, stats) in enumerate(ranked[: self.top_n], 1):
+                share = stats.seconds / total_seconds if total_seconds else 0.0
+                lines += [
+                    "",
+                    f"#{rank}  {stats.seconds:.3f}s ({share:.0%})  "
+                    f"{stats.calls} calls  "
+                    f"mean {stats.seconds / stats.calls * 1000:.1f}ms  "
+                    f"max {stats.max_seconds * 1000:.1f}ms  "
+                    f"{stats.rows} rows",
+                    f"    {key}",
+                ]
+                if stats.plan:
+                    lines.append(
+                        f"    plan of a {stats.plan_seconds * 1000:.0f}ms call:"
+                    )
+                    lines += [f"      {line}" for line in stats.plan.splitlines()]
+        return "\n".join(lines) + "\n"
+
+
+# the process-wide registry and query profiler
+metrics = MetricsRegistry()
+query_profiler = QueryProfiler()
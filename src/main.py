@@ -1,9 +1,428 @@
-from clients import PrawClient
+"""End-to-end collection and enrichment pipeline.
+
+Runs what cron used to run as five separate scripts as concurrent stages
+connected by bounded queues:
+
+    subreddits -> posts -> comments -> clean + score
+
+A subreddit moves on to the comments stage as soon as its posts are stored,
+and each comment batch is cleaned and scored as soon as it is written. A full
+queue blocks the stage feeding it, so a slow stage throttles the ones before
+it instead of piling work up in memory.
+
+SIGINT/SIGTERM stop the collectors after the batch they are writing; work
+already queued is still enriched. A second signal abandons the queued work.
+
+    python src/main.py --post-workers 2 --harvest-workers 4 --enrich-workers 4
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_collection_scripts"),
+)
+
+from author_sketches import update_author_sketches  # noqa: E402
+from clients import DBClient, PrawClient  # noqa: E402
+from comment_enricher import enrich_comments  # noqa: E402
+from comment_expansion import ExpansionPolicy  # noqa: E402
+from comments_table_populate import collect_subreddit_comments  # noqa: E402
+from config import (  # noqa: E402
+    DB_URL,
+    HARVEST_WORKERS,
+    LISTING_WORKERS,
+    PIPELINE_COMMENT_WORKERS,
+    PIPELINE_QUEUE_SIZE,
+    POST_WORKERS,
+    SENTIMENT_WORKERS,
+    SUBREDDITS,
+)
+from instrumentation import metrics  # noqa: E402
+from posts_table_populate import collect_subreddit_posts  # noqa: E402
+from subreddits_table_populate import subreddits_table_populate  # noqa: E402
+
+# end of a queue's input
+DONE = object()
+# how often blocked stages look up to check for shutdown
+POLL_SECONDS = 1.0
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class StageQueue:
+    """A bounded queue between two stages. put() blocks while it is full, but
+    gives up once the pipeline is aborted, so a producer never hangs on a
+    consumer that died."""
+
+    def __init__(self, name, maxsize, aborted):
+        self.name = name
+        self.aborted = aborted
+        self._queue = queue.Queue(maxsize)
+        self._max_depth = 0
+
+    def put(self, item, stage):
+        started = time.perf_counter()
+        while True:
+            if self.aborted.is_set():
+                raise PipelineAborted(
+                    f"Pipeline aborted; dropped work for {self.name}."
+                )
+            try:
+                self._queue.put(item, timeout=POLL_SECONDS)
+                break
+            except queue.Full:
+                continue
+
+        waited = time.perf_counter() - started
+        if waited > 0.01:
+            metrics.increment("pipeline_blocked_seconds_total", waited, stage=stage)
+        depth = self._queue.qsize()
+        if depth > self._max_depth:
+            self._max_depth = depth
+            metrics.set_gauge("pipeline_queue_max_depth", depth, queue=self.name)
+
+    def get(self, timeout=None):
+        """The next item, DONE once the producers are finished, or None if
+        nothing arrived within timeout."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self, consumers=1):
+        """Send each consumer DONE. After an abort the consumers stop on their
+        own and nobody drains the queue, so this gives up."""
+        for _ in range(consumers):
+            while not self.aborted.is_set():
+                try:
+                    self._queue.put(DONE, timeout=POLL_SECONDS)
+                    break
+                except queue.Full:
+                    continue
+
+
+class Pipeline:
+    def __init__(
+        self,
+        praw_client,
+        db_client,
+        subreddits,
+        post_workers=POST_WORKERS,
+        listing_workers=LISTING_WORKERS,
+        comment_workers=PIPELINE_COMMENT_WORKERS,
+        harvest_workers=HARVEST_WORKERS,
+        enrich_workers=SENTIMENT_WORKERS,
+        queue_size=PIPELINE_QUEUE_SIZE,
+        batch_size=25,
+        post_limit=None,
+        time_filter="all",
+        sweep=True,
+    ):
+        self.praw_client = praw_client
+        self.db_client = db_client
+        self.subreddits = subreddits
+        self.post_workers = post_workers
+        self.listing_workers = listing_workers
+        self.comment_workers = comment_workers
+        self.harvest_workers = harvest_workers
+        self.enrich_workers = enrich_workers
+        self.batch_size = batch_size
+        self.post_limit = post_limit
+        self.time_filter = time_filter
+        self.sweep = sweep
+        self.policy = ExpansionPolicy()
+
+        # stop: collectors start nothing new; aborted: drop queued work too
+        self.stop = threading.Event()
+        self.aborted = threading.Event()
+        self.failed_stages = []
+
+        self.todo = queue.Queue()
+        for subreddit in subreddits:
+            self.todo.put(subreddit)
+        self.posted = StageQueue("posted_subreddits", queue_size, self.aborted)
+        self.written = StageQueue("written_comment_batches", queue_size, self.aborted)
+
+    def request_stop(self, signum=None, frame=None):
+        if self.stop.is_set():
+            logging.warning("Second stop request: abandoning queued work.")
+            self.aborted.set()
+        else:
+            logging.warning(
+                "Stop requested: finishing the current batches and queued work."
+            )
+            self.stop.set()
+
+    def _run_stage(self, name, target):
+        try:
+            target()
+        except PipelineAborted as e:
+            logging.warning(f"Stage '{name}': {e}")
+        except Exception as e:
+            logging.critical(f"Stage '{name}' failed: {e}", exc_info=True)
+            self.failed_stages.append(name)
+            # nothing downstream can be trusted to drain the queues any more
+            self.stop.set()
+            self.aborted.set()
+
+    def _start(self, name, target, count=1):
+        threads = []
+        for i in range(count):
+            thread = threading.Thread(
+                target=self._run_stage,
+                args=(name, target),
+                name=f"{name}-{i}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    @staticmethod
+    def _join(threads):
+        # join with a timeout so the main thread keeps handling signals
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(POLL_SECONDS)
+
+    def posts_stage(self):
+        while not self.stop.is_set():
+            try:
+                subreddit = self.todo.get_nowait()
+            except queue.Empty:
+                return
+
+            started = time.perf_counter()
+            try:
+                fetched_count, _ = collect_subreddit_posts(
+                    self.praw_client,
+                    self.db_client,
+                    subreddit,
+                    limit=self.post_limit,
+                    time_interval=self.time_filter,
+                    listing_pool=self.listing_pool,
+                )
+            except Exception as e:
+                # as in posts_table_populate: one subreddit failing skips it
+                logging.error(
+                    f"An error occurred while processing r/{subreddit}: {e}",
+                    exc_info=True,
+                )
+                continue
+            metrics.record_stage("posts", fetched_count, time.perf_counter() - started)
+            self.posted.put(subreddit, stage="posts")
+
+    def comments_stage(self):
+        def on_batch(comments):
+            chunk = [
+                {
+                    "comment_id": comment_id,
+                    "body": body,
+                    "needs_clean": True,
+                    "needs_score": True,
+                }
+                for comment_id, body in zip(
+                    comments.columns["comment_id"], comments.columns["body"]
+                )
+            ]
+            self.written.put(chunk, stage="comments")
+
+        while True:
+            subreddit = self.posted.get(timeout=POLL_SECONDS)
+            if subreddit is DONE or self.aborted.is_set():
+                return
+            if subreddit is None or self.stop.is_set():
+                # after a stop, drain what the posts stage queued
+                continue
+
+            started = time.perf_counter()
+            try:
+                inserted_count = collect_subreddit_comments(
+                    self.praw_client,
+                    self.db_client,
+                    subreddit,
+                    batch_size=self.batch_size,
+                    workers=self.harvest_workers,
+                    policy=self.policy,
+                    on_batch=on_batch,
+                    stop=self.stop,
+                )
+            except PipelineAborted:
+                raise
+            except Exception as e:
+                logging.error(
+                    f"An error occurred while processing r/{subreddit}: {e}",
+                    exc_info=True,
+                )
+                continue
+            metrics.record_stage(
+                "comments", inserted_count, time.perf_counter() - started
+            )
+
+    def written_batches(self):
+        """The enrichment input: each written comment batch, with None while
+        none arrives so finished chunks are still written promptly."""
+        while not self.aborted.is_set():
+            chunk = self.written.get(timeout=POLL_SECONDS)
+            if chunk is DONE:
+                return
+            yield chunk
+
+    def enrich_stage(self):
+        enrich_comments(
+            self.db_client, workers=self.enrich_workers, chunks=self.written_batches()
+        )
+
+    def run(self):
+        """Run every stage to completion. Returns True if none of them failed."""
+        logging.info(
+            f"Pipeline: {len(self.subreddits)} subreddits, "
+            f"{self.post_workers} post / {self.comment_workers} comment workers, "
+            f"{self.harvest_workers} harvester threads, "
+            f"{self.enrich_workers} enrichment worker(s)."
+        )
+        subreddits_table_populate(self.praw_client, self.db_client, self.subreddits)
+
+        # shared by the post workers, like posts_table_populate's
+        self.listing_pool = ThreadPoolExecutor(
+            max_workers=self.listing_workers, thread_name_prefix="listing"
+        )
+        posts = self._start("posts", self.posts_stage, self.post_workers)
+        comments = self._start("comments", self.comments_stage, self.comment_workers)
+        enrich = self._start("enrich", self.enrich_stage)
+
+        # each queue closes once every producer feeding it has finished
+        self._join(posts)
+        self.listing_pool.shutdown()
+        self.posted.close(consumers=self.comment_workers)
+        self._join(comments)
+        self.written.close()
+        self._join(enrich)
+
+        # anything the stream missed: failed batches, earlier interrupted runs
+        if self.sweep and not self.stop.is_set():
+            logging.info("Enriching any comments still pending...")
+            enrich_comments(self.db_client, workers=self.enrich_workers)
+
+        update_author_sketches(self.db_client)
+
+        if self.failed_stages:
+            logging.critical(f"Stages failed: {', '.join(self.failed_stages)}")
+        return not self.failed_stages
 
 
 def main():
-    client = PrawClient()
-    print(client)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--subreddits", nargs="+", default=SUBREDDITS, help="default: config"
+    )
+    parser.add_argument(
+        "--post-workers",
+        type=int,
+        default=POST_WORKERS,
+        help="subreddits whose posts are fetched concurrently",
+    )
+    parser.add_argument(
+        "--listing-workers",
+        type=int,
+        default=LISTING_WORKERS,
+        help="subreddit listings fetched concurrently, shared by the post workers",
+    )
+    parser.add_argument(
+        "--comment-workers",
+        type=int,
+        default=PIPELINE_COMMENT_WORKERS,
+        help="subreddits whose comments are crawled concurrently",
+    )
+    parser.add_argument(
+        "--harvest-workers",
+        type=int,
+        default=HARVEST_WORKERS,
+        help="submissions fetched concurrently per comment worker",
+    )
+    parser.add_argument(
+        "--enrich-workers",
+        type=int,
+        default=SENTIMENT_WORKERS,
+        help="cleaning/scoring processes; 1 enriches in this process",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=PIPELINE_QUEUE_SIZE,
+        help="items queued between two stages before the earlier one blocks",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=25, help="posts per comment write"
+    )
+    parser.add_argument(
+        "--post-limit", type=int, default=None, help="posts per listing (default: all)"
+    )
+    parser.add_argument("--time-filter", default="all", help="for top/controversial")
+    parser.add_argument(
+        "--no-sweep",
+        dest="sweep",
+        action="store_false",
+        help="skip the final pass over comments still missing enrichment",
+    )
+    args = parser.parse_args()
+
+    log_file_name = "pipeline.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(threadName)s - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    logging.info("--- STARTING PIPELINE ---")
+
+    pipeline = Pipeline(
+        PrawClient(),
+        DBClient(DB_URL),
+        args.subreddits,
+        post_workers=args.post_workers,
+        listing_workers=args.listing_workers,
+        comment_workers=args.comment_workers,
+        harvest_workers=args.harvest_workers,
+        enrich_workers=args.enrich_workers,
+        queue_size=args.queue_size,
+        batch_size=args.batch_size,
+        post_limit=args.post_limit,
+        time_filter=args.time_filter,
+        sweep=args.sweep,
+    )
+    signal.signal(signal.SIGINT, pipeline.request_stop)
+    signal.signal(signal.SIGTERM, pipeline.request_stop)
+
+    success = False
+    try:
+        success = pipeline.run()
+    except Exception as e:
+        logging.critical(f"A critical error stopped the pipeline: {e}", exc_info=True)
+    finally:
+        metrics.export("pipeline", success=success)
+        logging.info("--- PIPELINE FINISHED ---")
+
+    sys.exit(0 if success else 1)
 
 
 if __name__ == "__main__":
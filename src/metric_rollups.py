@@ -0,0 +1,119 @@
+import argparse
+import logging
+import math
+import os
+import sys
+
+from clients import DBClient
+from config import DB_URL
+from usefulness_index import (
+    NEGATIVE_THRESHOLD,
+    POSITIVE_THRESHOLD,
+    SUM_COLUMNS,
+    get_metric_sums,
+    get_rollup_sums,
+)
+
+# subreddit_metric_rollups is kept current by the insert triggers of
+# sql/migrations/0003_subreddit_metric_rollups.sql, which take turns under the
+# advisory lock of 0011_rollup_writer_lock.sql so that separate cleaning and
+# scoring writers can't both miss the ID term; rebuild_rollups() recomputes
+# it from scratch (after migrating an existing database, or when check_rollups()
+# finds drift, e.g. after rows were deleted by hand: only inserts are tracked)
+
+
+def rebuild_rollups(db_client):
+    """Recompute every subreddit's rollup row in one transaction. The table lock
+    makes concurrent enrichment inserts wait for the rebuild, so their trigger
+    deltas land on top of it instead of being counted twice or lost."""
+    query = """
+        INSERT INTO subreddit_metric_rollups (
+            subreddit_id, n, sum_compound, sum_weighted_compound, positive_count,
+            negative_count, sum_neutral_density, n_cleaned
+        )
+        SELECT p.subreddit_id,
+            COUNT(*),
+            SUM(sa.vader_compound),
+            SUM(sa.vader_compound * LN(GREATEST(c.score, 0) + 1)),
+            COUNT(*) FILTER (WHERE sa.vader_compound >= :positive),
+            COUNT(*) FILTER (WHERE sa.vader_compound <= :negative),
+            COALESCE(SUM(sa.vader_neutral * LN(cc.word_count + 1)), 0),
+            COUNT(cc.word_count)
+        FROM sentiment_analysis sa
+        JOIN comments c ON c.comment_id = sa.comment_id
+        JOIN posts p ON p.post_id = c.post_id
+        LEFT JOIN cleaned_comments cc ON cc.comment_id = sa.comment_id
+        GROUP BY p.subreddit_id
+    """
+    params = {"positive": POSITIVE_THRESHOLD, "negative": NEGATIVE_THRESHOLD}
+
+    try:
+        with db_client.session() as s:
+            s.execute("LOCK TABLE subreddit_metric_rollups IN EXCLUSIVE MODE")
+            s.execute("DELETE FROM subreddit_metric_rollups")
+            count = s.execute(query, params)
+        logging.info(f"Rebuilt metric rollups for {count} subreddits.")
+        return count
+    except Exception as e:
+        logging.error(f"Error rebuilding metric rollups: {e}", exc_info=True)
+        return 0
+
+
+def check_rollups(db_client, rel_tol=1e-9):
+    """Compare the rollups against a full recomputation. Returns a list of
+    (subreddit, column, rollup value, recomputed value) mismatches; counts must
+    match exactly, float sums within rel_tol (they are summed in another order)."""
+    recomputed = {row["subreddit"]: row for row in get_metric_sums(db_client)}
+    rollups = {row["subreddit"]: row for row in get_rollup_sums(db_client)}
+
+    mismatches = []
+    for subreddit in sorted(recomputed.keys() | rollups.keys()):
+        expected = recomputed.get(subreddit, {})
+        actual = rollups.get(subreddit, {})
+        for column in SUM_COLUMNS:
+            want = float(expected.get(column) or 0)
+            got = float(actual.get(column) or 0)
+            if not math.isclose(got, want, rel_tol=rel_tol, abs_tol=1e-9):
+                mismatches.append((subreddit, column, got, want))
+
+    return mismatches
+
+
+if __name__ == "__main__":
+    log_file_name = "metric_rollups.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    parser = argparse.ArgumentParser(description="Maintain subreddit_metric_rollups.")
+    parser.add_argument("command", choices=("rebuild", "check"))
+    args = parser.parse_args()
+
+    db_client = DBClient(DB_URL)
+    mismatches = []
+
+    try:
+        if args.command == "rebuild":
+            rebuild_rollups(db_client)
+        else:
+            mismatches = check_rollups(db_client)
+            for subreddit, column, got, want in mismatches:
+                logging.warning(
+                    f"r/{subreddit} {column}: rollup {got!r} != recomputed {want!r}"
+                )
+            logging.info(f"Rollup check found {len(mismatches)} mismatches.")
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+        sys.exit(1)
+
+    sys.exit(1 if mismatches else 0)
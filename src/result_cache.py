@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import hashlib
+
+from config import RESULT_CACHE_MAX_BODY_CHARS, RESULT_CACHE_SIZE
+
+CLEAN_COLUMNS = ("cleaned_body", "word_count")
+SCORE_COLUMNS = ("vader_compound", "vader_positive", "vader_negative", "vader_neutral")
+
+
+def body_key(body):
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def stop_words_fingerprint(stop_words):
+    """Cleaned text depends on the stopword list, so persisted cleaning results
+    are only reused under the same list."""
+    if stop_words is None:
+        return None
+    joined = "\n".join(sorted(stop_words)).encode("utf-8")
+    return hashlib.blake2b(joined, digest_size=8).hexdigest()
+
+
+class ResultCache:
+    """LRU of enrichment results keyed by body hash. An entry holds a "clean"
+    and/or a "score" dict of result columns. Bodies longer than max_body_chars
+    are never cached: repeats are short boilerplate, and long bodies would
+    dominate the memory bound. max_entries=0 disables the cache."""
+
+    def __init__(
+        self,
+        max_entries=RESULT_CACHE_SIZE,
+        max_body_chars=RESULT_CACHE_MAX_BODY_CHARS,
+    ):
+        self.max_entries = max_entries
+        self.max_body_chars = max_body_chars
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def cacheable(self, body):
+        return self.max_entries > 0 and len(body) <= self.max_body_chars
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, **results):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {}
+        entry.update(results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def load_persisted(db_client, cache, keys, fingerprint):
+    """Fill the cache with the enrichment_cache rows for keys, and return them
+    as {body hash: results}. Cleaning results made under another stopword list
+    are skipped."""
+    found = {}
+    if not keys:
+        return found
+
+    query = f"""
+        SELECT body_hash, stop_words_hash, {", ".join(CLEAN_COLUMNS + SCORE_COLUMNS)}
+        FROM enrichment_cache
+        WHERE body_hash = ANY(:keys)
+    """
+    for row in db_client.fetch_all(query, {"keys": list(keys)}):
+        results = {}
+        if row["cleaned_body"] is not None and row["stop_words_hash"] == fingerprint:
+            results["clean"] = {column: row[column] for column in CLEAN_COLUMNS}
+        if row["vader_compound"] is not None:
+            results["score"] = {column: row[column] for column in SCORE_COLUMNS}
+        if results:
+            cache.put(row["body_hash"], **results)
+            found[row["body_hash"]] = results
+
+    return found
+
+
+def persist_loads(clean_entries, score_entries, fingerprint):
+    """bulk_load arguments writing newly computed results to enrichment_cache.
+    Cleaning and scoring results go in separate loads, so each one only
+    overwrites its own columns."""
+    clean_rows = [
+        {"body_hash": key, "stop_words_hash": fingerprint, **results}
+        for key, results in clean_entries.items()
+    ]
+    score_rows = [
+        {"body_hash": key, **results} for key, results in score_entries.items()
+    ]
+    return [
+        {
+            "table": "enrichment_cache",
+            "rows": clean_rows,
+            "conflict_key": "body_hash",
+            "on_conflict": "update",
+        },
+        {
+            "table": "enrichment_cache",
+            "rows": score_rows,
+            "conflict_key": "body_hash",
+            "on_conflict": "update",
+        },
+    ]
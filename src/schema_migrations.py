@@ -0,0 +1,140 @@
+import argparse
+import logging
+import os
+import re
+import sys
+
+from clients import DBClient
+from config import DB_URL
+
+# Versioned schema changes. sql/schema.sql is always the whole current schema;
+# every change to it also gets a numbered sql/migrations/NNNN_name.sql that
+# brings an older database up to date. Migrations must be safe to re-run
+# (IF NOT EXISTS, CREATE OR REPLACE), because a database that predates the
+# schema_migrations table gets all of them.
+#
+# comments is deliberately not partitioned by month: Postgres requires every
+# unique constraint of a partitioned table to include the partition key, so
+# comment_id could no longer be the foreign key target of the enrichment
+# tables or the ON CONFLICT key of the comment bulk loads.
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql")
+SCHEMA_SQL = os.path.join(SQL_DIR, "schema.sql")
+MIGRATIONS_DIR = os.path.join(SQL_DIR, "migrations")
+MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+# any constant will do, as long as every migrate run takes the same one
+ADVISORY_LOCK_KEY = 7_346_201
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """(version, name, path) of every migration file, in version order."""
+    migrations = []
+    for file_name in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE.match(file_name)
+        if match:
+            path = os.path.join(directory, file_name)
+            migrations.append((int(match[1]), match[2], path))
+    return migrations
+
+
+def _run_file(session, path):
+    with open(path, encoding="utf-8") as f:
+        # exec_driver_sql: no bind parameter parsing of the :: casts and $$ bodies
+        session.conn.exec_driver_sql(f.read())
+
+
+def applied_versions(session):
+    session.execute(CREATE_MIGRATIONS_TABLE)
+    rows = session.fetch_all("SELECT version FROM schema_migrations")
+    return {row["version"] for row in rows}
+
+
+def _record(session, version, name):
+    session.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES (:version, :name)",
+        {"version": version, "name": name},
+    )
+
+
+def migrate(db_client, migrations=None):
+    """Bring the database's schema up to date, in one transaction. An empty
+    database gets schema.sql with every migration recorded as applied; any
+    other gets the migrations it has not had yet. Returns the versions
+    applied."""
+    migrations = load_migrations() if migrations is None else migrations
+
+    with db_client.session() as s:
+        s.execute("SELECT pg_advisory_xact_lock(:key)", {"key": ADVISORY_LOCK_KEY})
+
+        if s.fetch_one("SELECT to_regclass('subreddits') AS t")["t"] is None:
+            logging.info("Empty database: creating the schema from schema.sql.")
+            _run_file(s, SCHEMA_SQL)
+            applied_versions(s)
+            for version, name, _ in migrations:
+                _record(s, version, name)
+            return []
+
+        done = applied_versions(s)
+        applied = []
+        for version, name, path in migrations:
+            if version in done:
+                continue
+            logging.info(f"Applying migration {version:04d} ({name})...")
+            _run_file(s, path)
+            _record(s, version, name)
+            applied.append(version)
+
+    if applied:
+        logging.info(f"Applied {len(applied)} migrations.")
+    else:
+        logging.info("Schema already up to date.")
+    return applied
+
+
+def pending_migrations(db_client, migrations=None):
+    migrations = load_migrations() if migrations is None else migrations
+    with db_client.session() as s:
+        done = applied_versions(s)
+    return [m for m in migrations if m[0] not in done]
+
+
+if __name__ == "__main__":
+    log_file_name = "schema_migrations.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    parser = argparse.ArgumentParser(description="Create or upgrade the schema.")
+    parser.add_argument("command", choices=("migrate", "status"))
+    args = parser.parse_args()
+
+    try:
+        db_client = DBClient(DB_URL)
+        if args.command == "migrate":
+            migrate(db_client)
+        else:
+            pending = pending_migrations(db_client)
+            for version, name, _ in pending:
+                logging.info(f"Pending: {version:04d} ({name})")
+            logging.info(f"{len(pending)} migrations pending.")
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,220 @@
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from clients import DBClient
+from config import DB_URL, SEEN_IDS_DIR, STREAM_CHUNK_SIZE
+from instrumentation import metrics
+
+# Per-subreddit indexes of the post and comment ids already stored, so the
+# collectors can tell known ids apart without pulling them from the database
+# every run. Each one is a sorted int64 array of the base36 ids, saved as
+# <SEEN_IDS_DIR>/<database>/<kind>/<subreddit>.npy (database: a hash of the
+# connection URL) and memory-mapped on load.
+#
+# The index is only an optimization: an id it lists wrongly would be dropped as
+# already stored. It only ever lists ids that were committed, and its size and
+# largest id double as a high-water mark: on load they are checked against the
+# count and largest id the database holds for the subreddit, and an index that
+# doesn't match (rows deleted, the database truncated or restored) is rebuilt.
+
+KINDS = ("posts", "comments")
+
+
+def decode_ids(ids):
+    """Base36 ids (e.g. "1abc2d") as an int64 array."""
+    if isinstance(ids, np.ndarray) and ids.dtype == np.int64:
+        return ids
+    return np.fromiter((int(i, 36) for i in ids), dtype=np.int64)
+
+
+class SeenIds:
+    """One kind of id for one subreddit. Not thread safe; the collectors handle
+    a subreddit on one thread at a time.
+
+    Ids added since the last save are kept in a small sorted array beside the
+    saved (memory-mapped) one, so add() never sorts or copies the whole index;
+    save() merges them in and writes the file once per run."""
+
+    def __init__(self, path, ids=None):
+        self.path = path
+        self._ids = np.empty(0, dtype=np.int64) if ids is None else ids
+        self._added = np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def load(cls, kind, subreddit, fetch_ids, mark, directory=SEEN_IDS_DIR):
+        """The saved index if it matches mark, the (count, largest id) of the
+        ids stored in the database; otherwise one built from fetch_ids() (an
+        iterable of those ids) and saved."""
+        path = os.path.join(directory, kind, f"{subreddit}.npy")
+        if os.path.exists(path):
+            saved = cls(path, np.load(path, mmap_mode="r"))
+            if saved.mark == mark:
+                return saved
+            logging.warning(
+                f"The {kind} seen-id index of r/{subreddit} holds {saved.mark} "
+                f"(ids, largest) but the database {mark}; rebuilding it."
+            )
+            metrics.increment("seen_ids_rebuilds_total", kind=kind)
+
+        seen = cls(path)
+        seen.add(fetch_ids())
+        seen.save()
+        logging.info(
+            f"Built the {kind} seen-id index of r/{subreddit}: {len(seen)} ids."
+        )
+        return seen
+
+    def __len__(self):
+        return len(self._ids) + len(self._added)
+
+    @property
+    def mark(self):
+        """(number of ids, largest id), None for the largest of an empty index."""
+        largest = [int(ids[-1]) for ids in (self._ids, self._added) if len(ids)]
+        return len(self), max(largest, default=None)
+
+    def __contains__(self, id_):
+        return bool(self.contains([id_])[0])
+
+    def contains(self, ids):
+        """Boolean array: which of ids are already known."""
+        values = decode_ids(ids)
+        return _members(self._ids, values) | _members(self._added, values)
+
+    def add(self, ids):
+        """Record ids as stored; save() writes them to the index file."""
+        values = decode_ids(ids)
+        values = np.unique(values[~self.contains(values)])
+        if len(values):
+            # one merge of two sorted arrays the size of the new ids
+            self._added = np.insert(
+                self._added, np.searchsorted(self._added, values), values
+            )
+
+    def save(self):
+        """Merge the added ids into the saved ones and write the index. An index
+        saved behind the database is rebuilt by the next load()."""
+        if not len(self._added) and os.path.exists(self.path):
+            return
+        ids = np.insert(self._ids, np.searchsorted(self._ids, self._added), self._added)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, ids)
+        os.replace(tmp_path, self.path)
+        self._ids = np.load(self.path, mmap_mode="r")
+        self._added = np.empty(0, dtype=np.int64)
+
+
+def _members(ids, values):
+    """Which of values are in the sorted array ids."""
+    if not len(ids):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(ids, values)
+    positions[positions == len(ids)] = 0
+    return ids[positions] == values
+
+
+def stored_post_ids(db_client, subreddit_id, chunk_size=STREAM_CHUNK_SIZE):
+    query = "SELECT post_id FROM posts WHERE subreddit_id = :subreddit_id"
+    for chunk in db_client.stream(query, {"subreddit_id": subreddit_id}, chunk_size):
+        yield from (row["post_id"] for row in chunk)
+
+
+def stored_comment_ids(db_client, subreddit_id, chunk_size=STREAM_CHUNK_SIZE):
+    query = """
+        SELECT c.comment_id
+        FROM comments c
+        JOIN posts p ON p.post_id = c.post_id
+        WHERE p.subreddit_id = :subreddit_id
+    """
+    for chunk in db_client.stream(query, {"subreddit_id": subreddit_id}, chunk_size):
+        yield from (row["comment_id"] for row in chunk)
+
+
+def stored_mark(db_client, kind, subreddit_id):
+    """(count, largest id) of the ids stored for a subreddit, as SeenIds.mark.
+    Zero-padding the base36 ids makes their text order numeric."""
+    if kind == "posts":
+        query = """
+            SELECT COUNT(*) AS n, MAX(LPAD(post_id, 13, '0')) AS largest
+            FROM posts
+            WHERE subreddit_id = :subreddit_id
+        """
+    else:
+        query = """
+            SELECT COUNT(*) AS n, MAX(LPAD(c.comment_id, 13, '0')) AS largest
+            FROM comments c
+            JOIN posts p ON p.post_id = c.post_id
+            WHERE p.subreddit_id = :subreddit_id
+        """
+    row = db_client.fetch_one(query, {"subreddit_id": subreddit_id})
+    if row is None:
+        # unknown, so no saved index is trusted
+        return None
+    return row["n"], int(row["largest"], 36) if row["largest"] else None
+
+
+def database_directory(db_client, directory=SEEN_IDS_DIR):
+    """Where the indexes of db_client's database live, apart from those of any
+    other database."""
+    url = db_client.engine.url.render_as_string(hide_password=True)
+    return os.path.join(
+        directory, hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
+    )
+
+
+def load_seen_ids(db_client, kind, subreddit, subreddit_id, directory=SEEN_IDS_DIR):
+    fetch = stored_post_ids if kind == "posts" else stored_comment_ids
+    return SeenIds.load(
+        kind,
+        subreddit,
+        lambda: fetch(db_client, subreddit_id),
+        stored_mark(db_client, kind, subreddit_id),
+        database_directory(db_client, directory),
+    )
+
+
+def rebuild_seen_ids(db_client, directory=SEEN_IDS_DIR):
+    """Drop the database's indexes and rebuild them from it."""
+    shutil.rmtree(database_directory(db_client, directory), ignore_errors=True)
+    subreddits = db_client.fetch_all("SELECT subreddit_id, subreddit FROM subreddits")
+    for row in subreddits:
+        for kind in KINDS:
+            load_seen_ids(
+                db_client, kind, row["subreddit"], row["subreddit_id"], directory
+            )
+    logging.info(f"Rebuilt the seen-id indexes of {len(subreddits)} subreddits.")
+
+
+if __name__ == "__main__":
+    log_file_name = "seen_ids.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    parser = argparse.ArgumentParser(description="Maintain the seen-id indexes.")
+    parser.add_argument("command", choices=("rebuild",))
+    args = parser.parse_args()
+
+    try:
+        rebuild_seen_ids(DBClient(DB_URL))
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,296 @@
+import argparse
+from datetime import date, timedelta
+import logging
+import math
+import os
+import sys
+
+import pandas as pd
+
+from clients import DBClient
+from config import DB_URL
+from usefulness_index import NEGATIVE_THRESHOLD, POSITIVE_THRESHOLD
+
+# subreddit_daily_sentiment and subreddit_weekly_sentiment hold per-subreddit
+# sentiment sums by UTC day / ISO week (Monday) of the comment, kept current by
+# the insert trigger of sql/migrations/0009_sentiment_trends.sql. Trend queries
+# read a few rows per subreddit and bucket from their primary keys instead of
+# scanning comments. rebuild_trends() recomputes them from scratch (after
+# migrating an existing database, or when check_trends() finds drift).
+
+PERIODS = {
+    "day": ("subreddit_daily_sentiment", timedelta(days=1)),
+    "week": ("subreddit_weekly_sentiment", timedelta(weeks=1)),
+}
+SUM_COLUMNS = (
+    "n",
+    "sum_compound",
+    "sum_weighted_compound",
+    "positive_count",
+    "negative_count",
+)
+TREND_METRICS = ("avg_compound", "swe", "cr")
+
+
+def bucket_start(day, period):
+    """The bucket day falls in: the day itself, or the Monday of its week."""
+    return day - timedelta(days=day.weekday()) if period == "week" else day
+
+
+def get_trend_sums(db_client, period="day", subreddits=None, start=None, end=None):
+    """Rollup rows of the buckets in [start, end) (dates; either may be None),
+    ordered by subreddit and bucket."""
+    table, _ = PERIODS[period]
+    where = []
+    params = {}
+    if subreddits is not None:
+        where.append("s.subreddit = ANY(:subreddits)")
+        params["subreddits"] = list(subreddits)
+    if start is not None:
+        where.append("t.bucket >= :start")
+        params["start"] = bucket_start(start, period)
+    if end is not None:
+        where.append("t.bucket < :end")
+        params["end"] = end
+
+    query = f"""
+        SELECT s.subreddit, t.bucket, {", ".join(f"t.{c}" for c in SUM_COLUMNS)}
+        FROM {table} t
+        JOIN subreddits s ON s.subreddit_id = t.subreddit_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY s.subreddit, t.bucket
+    """
+    return db_client.fetch_all(query, params)
+
+
+def trend_metrics(sums):
+    """C̄, SWE and CR (as in the Usefulness Index) from summed rollup columns."""
+    metrics = pd.DataFrame(index=sums.index)
+    n = sums["n"].where(sums["n"] > 0)
+    metrics["avg_compound"] = sums["sum_compound"] / n
+    metrics["swe"] = sums["sum_weighted_compound"] / n
+    metrics["cr"] = (sums["positive_count"] / (sums["negative_count"] + 1)).where(
+        sums["n"] > 0
+    )
+    metrics["n"] = sums["n"].astype(int)
+    return metrics
+
+
+def sentiment_trend(
+    db_client, subreddits=None, period="day", start=None, end=None, window=1
+):
+    """Per-subreddit sentiment for every day or week bucket in [start, end), as
+    a DataFrame indexed by (subreddit, bucket). Buckets without comments are
+    included with n = 0; subreddits without any in the range are left out.
+    window > 1 gives rolling figures over the last window
+    buckets, computed from the summed rollups (not by averaging averages)."""
+    _, step = PERIODS[period]
+    fetch_start = None
+    if start is not None:
+        start = bucket_start(start, period)
+        fetch_start = start - step * (window - 1)
+
+    rows = get_trend_sums(db_client, period, subreddits, fetch_start, end)
+    if not rows:
+        index = pd.MultiIndex.from_arrays([[], []], names=["subreddit", "bucket"])
+        return pd.DataFrame(columns=[*TREND_METRICS, "n"], index=index)
+
+    df = pd.DataFrame([dict(row) for row in rows])
+    df["bucket"] = pd.to_datetime(df["bucket"])
+    sums = (
+        df.set_index(["bucket", "subreddit"])[list(SUM_COLUMNS)]
+        .astype(float)
+        .unstack("subreddit", fill_value=0.0)
+    )
+
+    # every bucket of the range, so empty ones hold their place in the window
+    first = pd.Timestamp(fetch_start) if fetch_start else sums.index.min()
+    last = pd.Timestamp(end - timedelta(days=1)) if end else sums.index.max()
+    sums = sums.reindex(pd.date_range(first, last, freq=step), fill_value=0.0)
+    sums.index.name = "bucket"
+    if window > 1:
+        sums = sums.rolling(window, min_periods=1).sum()
+    if start is not None:
+        sums = sums[sums.index >= pd.Timestamp(start)]
+
+    sums = sums.stack("subreddit", future_stack=True).swaplevel().sort_index()
+    return trend_metrics(sums)
+
+
+def sentiment_summary(db_client, start=None, end=None, subreddits=None):
+    """Per-subreddit sentiment over the days in [start, end), summed from the
+    daily rollups in Postgres."""
+    where = []
+    params = {}
+    if subreddits is not None:
+        where.append("s.subreddit = ANY(:subreddits)")
+        params["subreddits"] = list(subreddits)
+    if start is not None:
+        where.append("t.bucket >= :start")
+        params["start"] = start
+    if end is not None:
+        where.append("t.bucket < :end")
+        params["end"] = end
+
+    query = f"""
+        SELECT s.subreddit, {", ".join(f"SUM(t.{c}) AS {c}" for c in SUM_COLUMNS)}
+        FROM subreddit_daily_sentiment t
+        JOIN subreddits s ON s.subreddit_id = t.subreddit_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        GROUP BY s.subreddit
+    """
+    rows = db_client.fetch_all(query, params)
+    if not rows:
+        return pd.DataFrame(columns=[*TREND_METRICS, "n"])
+    sums = pd.DataFrame([dict(row) for row in rows]).set_index("subreddit")
+    return trend_metrics(sums.astype(float))
+
+
+def rebuild_trends(db_client):
+    """Recompute both trend tables in one transaction. As in rebuild_rollups(),
+    the table locks make concurrent enrichment inserts wait for the rebuild."""
+    daily = """
+        INSERT INTO subreddit_daily_sentiment (
+            subreddit_id, bucket, n, sum_compound, sum_weighted_compound,
+            positive_count, negative_count
+        )
+        SELECT p.subreddit_id,
+            (c.created_utc AT TIME ZONE 'UTC')::date,
+            COUNT(*),
+            SUM(sa.vader_compound),
+            SUM(sa.vader_compound * LN(GREATEST(c.score, 0) + 1)),
+            COUNT(*) FILTER (WHERE sa.vader_compound >= :positive),
+            COUNT(*) FILTER (WHERE sa.vader_compound <= :negative)
+        FROM sentiment_analysis sa
+        JOIN comments c ON c.comment_id = sa.comment_id
+        JOIN posts p ON p.post_id = c.post_id
+        GROUP BY 1, 2
+    """
+    weekly = f"""
+        INSERT INTO subreddit_weekly_sentiment (
+            subreddit_id, bucket, {", ".join(SUM_COLUMNS)}
+        )
+        SELECT subreddit_id, date_trunc('week', bucket)::date,
+            {", ".join(f"SUM({c})" for c in SUM_COLUMNS)}
+        FROM subreddit_daily_sentiment
+        GROUP BY 1, 2
+    """
+    params = {"positive": POSITIVE_THRESHOLD, "negative": NEGATIVE_THRESHOLD}
+
+    try:
+        with db_client.session() as s:
+            for table, _ in PERIODS.values():
+                s.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+                s.execute(f"DELETE FROM {table}")
+            days = s.execute(daily, params)
+            weeks = s.execute(weekly)
+        logging.info(f"Rebuilt sentiment trends: {days} days, {weeks} weeks.")
+        return days, weeks
+    except Exception as e:
+        logging.error(f"Error rebuilding sentiment trends: {e}", exc_info=True)
+        return 0, 0
+
+
+def check_trends(db_client, rel_tol=1e-9):
+    """Compare both trend tables against a full recomputation. Returns a list
+    of (period, subreddit, bucket, column, rollup value, recomputed value)
+    mismatches."""
+    query = """
+        SELECT s.subreddit,
+            (c.created_utc AT TIME ZONE 'UTC')::date AS day,
+            COUNT(*) AS n,
+            SUM(sa.vader_compound) AS sum_compound,
+            SUM(sa.vader_compound * LN(GREATEST(c.score, 0) + 1))
+                AS sum_weighted_compound,
+            COUNT(*) FILTER (WHERE sa.vader_compound >= :positive) AS positive_count,
+            COUNT(*) FILTER (WHERE sa.vader_compound <= :negative) AS negative_count
+        FROM sentiment_analysis sa
+        JOIN comments c ON c.comment_id = sa.comment_id
+        JOIN posts p ON p.post_id = c.post_id
+        JOIN subreddits s ON s.subreddit_id = p.subreddit_id
+        GROUP BY 1, 2
+    """
+    params = {"positive": POSITIVE_THRESHOLD, "negative": NEGATIVE_THRESHOLD}
+    recomputed_days = db_client.fetch_all(query, params)
+
+    mismatches = []
+    for period in PERIODS:
+        recomputed = {}
+        for row in recomputed_days:
+            key = (row["subreddit"], bucket_start(row["day"], period))
+            sums = recomputed.setdefault(key, dict.fromkeys(SUM_COLUMNS, 0.0))
+            for column in SUM_COLUMNS:
+                sums[column] += float(row[column] or 0)
+        rollups = {
+            (row["subreddit"], row["bucket"]): row
+            for row in get_trend_sums(db_client, period)
+        }
+
+        for key in sorted(recomputed.keys() | rollups.keys()):
+            expected = recomputed.get(key, {})
+            actual = rollups.get(key, {})
+            for column in SUM_COLUMNS:
+                want = float(expected.get(column) or 0)
+                got = float(actual.get(column) or 0)
+                if not math.isclose(got, want, rel_tol=rel_tol, abs_tol=1e-9):
+                    mismatches.append((period, *key, column, got, want))
+
+    return mismatches
+
+
+if __name__ == "__main__":
+    log_file_name = "sentiment_trends.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    parser = argparse.ArgumentParser(description="Sentiment trends by day or week.")
+    parser.add_argument("command", choices=("show", "rebuild", "check"))
+    parser.add_argument("--subreddits", nargs="+")
+    parser.add_argument("--period", choices=PERIODS, default="week")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat, help="exclusive")
+    parser.add_argument(
+        "--window", type=int, default=1, help="rolling window, in buckets"
+    )
+    args = parser.parse_args()
+
+    db_client = DBClient(DB_URL)
+    mismatches = []
+
+    try:
+        if args.command == "rebuild":
+            rebuild_trends(db_client)
+        elif args.command == "check":
+            mismatches = check_trends(db_client)
+            for period, subreddit, bucket, column, got, want in mismatches:
+                logging.warning(
+                    f"r/{subreddit} {period} {bucket} {column}: "
+                    f"rollup {got!r} != recomputed {want!r}"
+                )
+            logging.info(f"Trend check found {len(mismatches)} mismatches.")
+        else:
+            trend = sentiment_trend(
+                db_client,
+                args.subreddits,
+                args.period,
+                args.start,
+                args.end,
+                args.window,
+            )
+            logging.info(f"Sentiment by {args.period}:\n{trend.to_string()}")
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+        sys.exit(1)
+
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,24 @@
+-- post_crawl_state backfill
+-- one-off for databases created before post_crawl_state existed: posts that
+-- already have comments count as crawled at their current num_comments
+CREATE TABLE IF NOT EXISTS post_crawl_state (
+    post_id VARCHAR(20) PRIMARY KEY REFERENCES posts(post_id) ON DELETE CASCADE,
+    comments_fetched_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    num_comments_seen INTEGER,
+    newest_comment_utc TIMESTAMP WITH TIME ZONE
+);
+INSERT INTO post_crawl_state (
+        post_id,
+        comments_fetched_at,
+        num_comments_seen,
+        newest_comment_utc
+    )
+SELECT p.post_id,
+    CURRENT_TIMESTAMP,
+    p.num_comments,
+    MAX(c.created_utc)
+FROM posts p
+    JOIN comments c ON c.post_id = p.post_id
+GROUP BY p.post_id,
+    p.num_comments
+ON CONFLICT (post_id) DO NOTHING;
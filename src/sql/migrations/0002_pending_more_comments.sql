@@ -0,0 +1,13 @@
+-- pending_more_comments
+-- for databases created before the collector kept the "load more comments"
+-- stubs its per-submission budget left unexpanded
+CREATE TABLE IF NOT EXISTS pending_more_comments (
+    post_id VARCHAR(20) NOT NULL REFERENCES posts(post_id) ON DELETE CASCADE,
+    parent_id VARCHAR(20) NOT NULL,
+    more_id VARCHAR(20) NOT NULL,
+    child_count INTEGER,
+    depth INTEGER,
+    children TEXT,
+    recorded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (post_id, parent_id, more_id)
+);
@@ -0,0 +1,11 @@
+-- export watermarks
+-- one-off for databases created before comments.ingested_at and
+-- sentiment_analysis.analysis_date existed; existing rows get the time of the
+-- ALTER, so the first incremental export picks them all up
+ALTER TABLE comments
+ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE sentiment_analysis
+ADD COLUMN IF NOT EXISTS analysis_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_comments_ingested_at ON comments(ingested_at);
+CREATE INDEX IF NOT EXISTS idx_sentiment_analysis_analysis_date ON sentiment_analysis(analysis_date);
+CREATE INDEX IF NOT EXISTS idx_cleaned_comments_cleaning_date ON cleaned_comments(cleaning_date);
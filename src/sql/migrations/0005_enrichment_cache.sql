@@ -0,0 +1,13 @@
+-- enrichment_cache
+-- one-off for databases created before the persistent result cache existed
+CREATE TABLE IF NOT EXISTS enrichment_cache (
+    body_hash CHAR(32) PRIMARY KEY,
+    stop_words_hash CHAR(16),
+    cleaned_body TEXT,
+    word_count INTEGER,
+    vader_compound FLOAT,
+    vader_positive FLOAT,
+    vader_negative FLOAT,
+    vader_neutral FLOAT,
+    cached_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
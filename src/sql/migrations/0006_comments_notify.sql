@@ -0,0 +1,25 @@
+-- comments_notify
+-- NOTIFY on channel comments_inserted whenever comments are inserted, so
+-- `python enrichment_daemon.py` picks them up within seconds. The payload is
+-- the new comment_ids, comma separated, or empty when they would not fit in a
+-- NOTIFY (the daemon then sweeps every pending comment). Safe to re-run.
+CREATE OR REPLACE FUNCTION notify_new_comments() RETURNS trigger AS $$
+DECLARE ids TEXT;
+BEGIN
+SELECT string_agg(comment_id, ',') INTO ids
+FROM new_comments;
+IF ids IS NOT NULL THEN PERFORM pg_notify(
+    'comments_inserted',
+    CASE
+        WHEN octet_length(ids) < 7900 THEN ids
+        ELSE ''
+    END
+);
+END IF;
+RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS comments_notify ON comments;
+CREATE TRIGGER comments_notify
+AFTER
+INSERT ON comments REFERENCING NEW TABLE AS new_comments FOR EACH STATEMENT EXECUTE FUNCTION notify_new_comments();
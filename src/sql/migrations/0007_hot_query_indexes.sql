@@ -0,0 +1,14 @@
+-- hot query indexes
+-- covering indexes for the per-subreddit reads: the collectors' posts to crawl
+-- and the seen-id rebuilds become index-only scans, so they read only the
+-- subreddit's rows instead of hashing all of post_crawl_state
+CREATE INDEX IF NOT EXISTS idx_posts_subreddit_id_covering ON posts(subreddit_id) INCLUDE (post_id, num_comments);
+DROP INDEX IF EXISTS idx_posts_subreddit_id;
+CREATE INDEX IF NOT EXISTS idx_comments_post_id_covering ON comments(post_id) INCLUDE (comment_id);
+DROP INDEX IF EXISTS idx_comments_post_id;
+CREATE INDEX IF NOT EXISTS idx_post_crawl_state_covering ON post_crawl_state(post_id) INCLUDE (num_comments_seen, newest_comment_utc);
+-- duplicates of the indexes behind the comment_id primary keys / unique
+-- constraints; dropping them saves a write per enriched comment
+DROP INDEX IF EXISTS idx_sentiment_analysis_comment_id;
+DROP INDEX IF EXISTS idx_cleaned_comments_comment_id;
+DROP INDEX IF EXISTS idx_labeled_comments_comment_id;
@@ -0,0 +1,15 @@
+-- thread_metrics
+-- per-thread reply structure and sentiment, written by `python thread_tree.py`
+CREATE TABLE IF NOT EXISTS thread_metrics (
+    post_id VARCHAR(20) PRIMARY KEY REFERENCES posts(post_id) ON DELETE CASCADE,
+    n_comments INTEGER NOT NULL,
+    top_level_comments INTEGER NOT NULL,
+    max_depth INTEGER NOT NULL,
+    max_subtree_size INTEGER NOT NULL,
+    mean_compound FLOAT,
+    reply_drift FLOAT,
+    negative_reply_compound FLOAT,
+    first_comment_seconds FLOAT,
+    mean_first_reply_seconds FLOAT,
+    computed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
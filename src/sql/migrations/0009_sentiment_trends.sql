@@ -0,0 +1,100 @@
+-- sentiment trends
+-- per-subreddit sentiment sums by UTC day and by ISO week (starting Monday) of
+-- the comment, kept current by a statement-level trigger on sentiment_analysis.
+-- Only inserts are tracked, as for subreddit_metric_rollups; after installing
+-- on an existing database, populate them with `python sentiment_trends.py
+-- rebuild`.
+CREATE TABLE IF NOT EXISTS subreddit_daily_sentiment (
+    subreddit_id INTEGER NOT NULL REFERENCES subreddits(subreddit_id) ON DELETE CASCADE,
+    bucket DATE NOT NULL,
+    n BIGINT NOT NULL DEFAULT 0,
+    sum_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sum_weighted_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    positive_count BIGINT NOT NULL DEFAULT 0,
+    negative_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subreddit_id, bucket)
+);
+CREATE TABLE IF NOT EXISTS subreddit_weekly_sentiment (
+    subreddit_id INTEGER NOT NULL REFERENCES subreddits(subreddit_id) ON DELETE CASCADE,
+    bucket DATE NOT NULL,
+    n BIGINT NOT NULL DEFAULT 0,
+    sum_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sum_weighted_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    positive_count BIGINT NOT NULL DEFAULT 0,
+    negative_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subreddit_id, bucket)
+);
+-- weeks are summed from the new rows' days, so the comments are joined once
+CREATE OR REPLACE FUNCTION rollup_sentiment_trends() RETURNS trigger AS $$ BEGIN WITH daily AS (
+    SELECT p.subreddit_id,
+        (c.created_utc AT TIME ZONE 'UTC')::date AS bucket,
+        COUNT(*) AS n,
+        SUM(ns.vader_compound) AS sum_compound,
+        SUM(ns.vader_compound * LN(GREATEST(c.score, 0) + 1)) AS sum_weighted_compound,
+        COUNT(*) FILTER (
+            WHERE ns.vader_compound >= 0.05
+        ) AS positive_count,
+        COUNT(*) FILTER (
+            WHERE ns.vader_compound <= -0.05
+        ) AS negative_count
+    FROM new_sentiment ns
+        JOIN comments c ON c.comment_id = ns.comment_id
+        JOIN posts p ON p.post_id = c.post_id
+    GROUP BY 1,
+        2
+),
+daily_upsert AS (
+    INSERT INTO subreddit_daily_sentiment AS t (
+            subreddit_id,
+            bucket,
+            n,
+            sum_compound,
+            sum_weighted_compound,
+            positive_count,
+            negative_count
+        )
+    SELECT *
+    FROM daily
+    ON CONFLICT (subreddit_id, bucket) DO UPDATE
+    SET n = t.n + EXCLUDED.n,
+        sum_compound = t.sum_compound + EXCLUDED.sum_compound,
+        sum_weighted_compound = t.sum_weighted_compound + EXCLUDED.sum_weighted_compound,
+        positive_count = t.positive_count + EXCLUDED.positive_count,
+        negative_count = t.negative_count + EXCLUDED.negative_count,
+        updated_at = CURRENT_TIMESTAMP
+)
+INSERT INTO subreddit_weekly_sentiment AS t (
+        subreddit_id,
+        bucket,
+        n,
+        sum_compound,
+        sum_weighted_compound,
+        positive_count,
+        negative_count
+    )
+SELECT subreddit_id,
+    date_trunc('week', bucket)::date,
+    SUM(n),
+    SUM(sum_compound),
+    SUM(sum_weighted_compound),
+    SUM(positive_count),
+    SUM(negative_count)
+FROM daily
+GROUP BY 1,
+    2
+ON CONFLICT (subreddit_id, bucket) DO UPDATE
+SET n = t.n + EXCLUDED.n,
+    sum_compound = t.sum_compound + EXCLUDED.sum_compound,
+    sum_weighted_compound = t.sum_weighted_compound + EXCLUDED.sum_weighted_compound,
+    positive_count = t.positive_count + EXCLUDED.positive_count,
+    negative_count = t.negative_count + EXCLUDED.negative_count,
+    updated_at = CURRENT_TIMESTAMP;
+RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS sentiment_analysis_trends ON sentiment_analysis;
+CREATE TRIGGER sentiment_analysis_trends
+AFTER
+INSERT ON sentiment_analysis REFERENCING NEW TABLE AS new_sentiment FOR EACH STATEMENT EXECUTE FUNCTION rollup_sentiment_trends();
@@ -0,0 +1,16 @@
+-- author_sketches
+-- per-subreddit, per-ISO-week author sketches and the watermarks of the rows
+-- already folded into them, written by author_sketches.py
+CREATE TABLE IF NOT EXISTS author_sketches (
+    subreddit_id INTEGER NOT NULL REFERENCES subreddits(subreddit_id) ON DELETE CASCADE,
+    bucket DATE NOT NULL,
+    distinct_authors BYTEA NOT NULL,
+    activity BYTEA NOT NULL,
+    negativity BYTEA NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subreddit_id, bucket)
+);
+CREATE TABLE IF NOT EXISTS author_sketch_watermarks (
+    source VARCHAR(32) PRIMARY KEY,
+    watermark TIMESTAMP WITH TIME ZONE NOT NULL
+);
@@ -0,0 +1,65 @@
+-- rollup writer lock
+-- serializes the subreddit_metric_rollups triggers of sentiment_analysis and
+-- cleaned_comments (see schema.sql); same functions as 0003 otherwise
+-- new sentiment rows add every term; the ID term only for comments already cleaned
+CREATE OR REPLACE FUNCTION rollup_new_sentiment() RETURNS trigger AS $$ BEGIN
+PERFORM pg_advisory_xact_lock(7346203);
+INSERT INTO subreddit_metric_rollups AS r (
+        subreddit_id,
+        n,
+        sum_compound,
+        sum_weighted_compound,
+        positive_count,
+        negative_count,
+        sum_neutral_density,
+        n_cleaned
+    )
+SELECT p.subreddit_id,
+    COUNT(*),
+    SUM(ns.vader_compound),
+    SUM(ns.vader_compound * LN(GREATEST(c.score, 0) + 1)),
+    COUNT(*) FILTER (
+        WHERE ns.vader_compound >= 0.05
+    ),
+    COUNT(*) FILTER (
+        WHERE ns.vader_compound <= -0.05
+    ),
+    COALESCE(SUM(ns.vader_neutral * LN(cc.word_count + 1)), 0),
+    COUNT(cc.word_count)
+FROM new_sentiment ns
+    JOIN comments c ON c.comment_id = ns.comment_id
+    JOIN posts p ON p.post_id = c.post_id
+    LEFT JOIN cleaned_comments cc ON cc.comment_id = ns.comment_id
+GROUP BY p.subreddit_id
+ON CONFLICT (subreddit_id) DO UPDATE
+SET n = r.n + EXCLUDED.n,
+    sum_compound = r.sum_compound + EXCLUDED.sum_compound,
+    sum_weighted_compound = r.sum_weighted_compound + EXCLUDED.sum_weighted_compound,
+    positive_count = r.positive_count + EXCLUDED.positive_count,
+    negative_count = r.negative_count + EXCLUDED.negative_count,
+    sum_neutral_density = r.sum_neutral_density + EXCLUDED.sum_neutral_density,
+    n_cleaned = r.n_cleaned + EXCLUDED.n_cleaned,
+    updated_at = CURRENT_TIMESTAMP;
+RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+-- new cleaned rows add the ID term for comments that were already scored
+CREATE OR REPLACE FUNCTION rollup_new_cleaned() RETURNS trigger AS $$ BEGIN
+PERFORM pg_advisory_xact_lock(7346203);
+INSERT INTO subreddit_metric_rollups AS r (subreddit_id, sum_neutral_density, n_cleaned)
+SELECT p.subreddit_id,
+    SUM(sa.vader_neutral * LN(nc.word_count + 1)),
+    COUNT(nc.word_count)
+FROM new_cleaned nc
+    JOIN sentiment_analysis sa ON sa.comment_id = nc.comment_id
+    JOIN comments c ON c.comment_id = nc.comment_id
+    JOIN posts p ON p.post_id = c.post_id
+WHERE nc.word_count IS NOT NULL
+GROUP BY p.subreddit_id
+ON CONFLICT (subreddit_id) DO UPDATE
+SET sum_neutral_density = r.sum_neutral_density + EXCLUDED.sum_neutral_density,
+    n_cleaned = r.n_cleaned + EXCLUDED.n_cleaned,
+    updated_at = CURRENT_TIMESTAMP;
+RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,28 @@
+-- chunked comments notify
+-- one NOTIFY per chunk of new comment_ids instead of one per statement, so a
+-- bulk_load of thousands of comments still tells the daemon which ones they
+-- are rather than falling back to an empty payload (a full sweep). Each
+-- payload stays under 7900 bytes, the NOTIFY limit being 8000. Safe to re-run.
+CREATE OR REPLACE FUNCTION notify_new_comments() RETURNS trigger AS $$
+DECLARE next_id TEXT;
+chunk TEXT := '';
+BEGIN FOR next_id IN
+SELECT comment_id
+FROM new_comments LOOP -- only an id too long for any payload needs the sweep
+    IF octet_length(next_id) >= 7900 THEN PERFORM pg_notify('comments_inserted', '');
+CONTINUE;
+END IF;
+IF chunk <> ''
+AND octet_length(chunk) + 1 + octet_length(next_id) >= 7900 THEN PERFORM pg_notify('comments_inserted', chunk);
+chunk := '';
+END IF;
+chunk := CASE
+    WHEN chunk = '' THEN next_id
+    ELSE chunk || ',' || next_id
+END;
+END LOOP;
+IF chunk <> '' THEN PERFORM pg_notify('comments_inserted', chunk);
+END IF;
+RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
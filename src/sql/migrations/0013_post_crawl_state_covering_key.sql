@@ -0,0 +1,16 @@
+-- post_crawl_state covering key
+-- idx_post_crawl_state_covering (0007) repeated the primary key's post_id index
+-- to carry num_comments_seen and newest_comment_utc for index-only scans. The
+-- primary key now INCLUDEs them itself, so one index is kept per crawl state
+-- write instead of two. Safe to re-run.
+DO $$ BEGIN IF NOT EXISTS (
+    SELECT 1
+    FROM pg_index
+    WHERE indexrelid = 'post_crawl_state_pkey'::regclass
+        AND indnatts > indnkeyatts
+) THEN
+ALTER TABLE post_crawl_state DROP CONSTRAINT post_crawl_state_pkey,
+    ADD CONSTRAINT post_crawl_state_pkey PRIMARY KEY (post_id) INCLUDE (num_comments_seen, newest_comment_utc);
+END IF;
+END $$;
+DROP INDEX IF EXISTS idx_post_crawl_state_covering;
@@ -1,4 +1,14 @@
 -- schema.sql
+DROP TABLE IF EXISTS author_sketch_watermarks;
+DROP TABLE IF EXISTS author_sketches;
+DROP TABLE IF EXISTS subreddit_weekly_sentiment;
+DROP TABLE IF EXISTS subreddit_daily_sentiment;
+DROP TABLE IF EXISTS thread_metrics;
+DROP TABLE IF EXISTS enrichment_cache;
+DROP TABLE IF EXISTS subreddit_metric_rollups;
+DROP TABLE IF EXISTS labeled_comments;
+DROP TABLE IF EXISTS post_crawl_state;
+DROP TABLE IF EXISTS pending_more_comments;
 DROP TABLE IF EXISTS cleaned_comments;
 DROP TABLE IF EXISTS sentiment_analysis;
 DROP TABLE IF EXISTS comments;
@@ -44,7 +54,8 @@ CREATE TABLE comments (
     score INTEGER,
     depth INTEGER,
     is_submitter BOOLEAN,
-    stickied BOOLEAN
+    stickied BOOLEAN,
+    ingested_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 -- sentiment_analysis: the sentiment scores for each comment
 CREATE TABLE sentiment_analysis (
@@ -54,6 +65,7 @@ CREATE TABLE sentiment_analysis (
     vader_positive FLOAT,
     vader_negative FLOAT,
     vader_neutral FLOAT,
+    analysis_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(comment_id)
 );
 CREATE TABLE cleaned_comments (
@@ -63,6 +75,111 @@ CREATE TABLE cleaned_comments (
     cleaning_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (comment_id) REFERENCES comments(comment_id) ON DELETE CASCADE
 );
+-- post_crawl_state: when each post's comments were last fetched, and what
+-- was seen then, so only posts whose num_comments grew are re-crawled
+CREATE TABLE post_crawl_state (
+    post_id VARCHAR(20) REFERENCES posts(post_id) ON DELETE CASCADE,
+    comments_fetched_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    num_comments_seen INTEGER,
+    newest_comment_utc TIMESTAMP WITH TIME ZONE,
+    -- covering, so the collectors' posts to crawl read it with an index-only scan
+    PRIMARY KEY (post_id) INCLUDE (num_comments_seen, newest_comment_utc)
+);
+-- pending_more_comments: "load more comments" stubs left unexpanded by the
+-- collector's per-submission budget, finished by later runs
+CREATE TABLE pending_more_comments (
+    post_id VARCHAR(20) NOT NULL REFERENCES posts(post_id) ON DELETE CASCADE,
+    parent_id VARCHAR(20) NOT NULL,
+    more_id VARCHAR(20) NOT NULL,
+    child_count INTEGER,
+    depth INTEGER,
+    children TEXT,
+    recorded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (post_id, parent_id, more_id)
+);
+-- subreddit_metric_rollups: running per-subreddit sums behind the Usefulness
+-- Index metrics, maintained by the triggers at the end of this file
+CREATE TABLE subreddit_metric_rollups (
+    subreddit_id INTEGER PRIMARY KEY REFERENCES subreddits(subreddit_id) ON DELETE CASCADE,
+    n BIGINT NOT NULL DEFAULT 0,
+    sum_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sum_weighted_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    positive_count BIGINT NOT NULL DEFAULT 0,
+    negative_count BIGINT NOT NULL DEFAULT 0,
+    sum_neutral_density DOUBLE PRECISION NOT NULL DEFAULT 0,
+    n_cleaned BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+-- subreddit_daily_sentiment / subreddit_weekly_sentiment: per-subreddit
+-- sentiment sums by UTC day and ISO week of the comment, for trend queries
+-- (sentiment_trends.py), maintained by the trigger at the end of this file
+CREATE TABLE subreddit_daily_sentiment (
+    subreddit_id INTEGER NOT NULL REFERENCES subreddits(subreddit_id) ON DELETE CASCADE,
+    bucket DATE NOT NULL,
+    n BIGINT NOT NULL DEFAULT 0,
+    sum_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sum_weighted_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    positive_count BIGINT NOT NULL DEFAULT 0,
+    negative_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subreddit_id, bucket)
+);
+CREATE TABLE subreddit_weekly_sentiment (
+    subreddit_id INTEGER NOT NULL REFERENCES subreddits(subreddit_id) ON DELETE CASCADE,
+    bucket DATE NOT NULL,
+    n BIGINT NOT NULL DEFAULT 0,
+    sum_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sum_weighted_compound DOUBLE PRECISION NOT NULL DEFAULT 0,
+    positive_count BIGINT NOT NULL DEFAULT 0,
+    negative_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subreddit_id, bucket)
+);
+-- enrichment_cache: cleaning/VADER results by body hash, reused across runs
+-- when RESULT_CACHE_PERSIST=1 (cleaning results only under the same stopwords)
+CREATE TABLE enrichment_cache (
+    body_hash CHAR(32) PRIMARY KEY,
+    stop_words_hash CHAR(16),
+    cleaned_body TEXT,
+    word_count INTEGER,
+    vader_compound FLOAT,
+    vader_positive FLOAT,
+    vader_negative FLOAT,
+    vader_neutral FLOAT,
+    cached_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+-- thread_metrics: per-thread reply structure and sentiment, recomputed by
+-- thread_tree.py from the comment tree
+CREATE TABLE thread_metrics (
+    post_id VARCHAR(20) PRIMARY KEY REFERENCES posts(post_id) ON DELETE CASCADE,
+    n_comments INTEGER NOT NULL,
+    top_level_comments INTEGER NOT NULL,
+    max_depth INTEGER NOT NULL,
+    max_subtree_size INTEGER NOT NULL,
+    mean_compound FLOAT,
+    reply_drift FLOAT,
+    negative_reply_compound FLOAT,
+    first_comment_seconds FLOAT,
+    mean_first_reply_seconds FLOAT,
+    computed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+-- author_sketches: per-subreddit, per-ISO-week HyperLogLog of the distinct
+-- comment authors and Count-Min/top-k sketches of comments and negative
+-- comments per author, kept current by author_sketches.py from the rows past
+-- author_sketch_watermarks
+CREATE TABLE author_sketches (
+    subreddit_id INTEGER NOT NULL REFERENCES subreddits(subreddit_id) ON DELETE CASCADE,
+    bucket DATE NOT NULL,
+    distinct_authors BYTEA NOT NULL,
+    activity BYTEA NOT NULL,
+    negativity BYTEA NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subreddit_id, bucket)
+);
+CREATE TABLE author_sketch_watermarks (
+    source VARCHAR(32) PRIMARY KEY,
+    watermark TIMESTAMP WITH TIME ZONE NOT NULL
+);
 CREATE TABLE labeled_comments (
     label_id SERIAL PRIMARY KEY,
     comment_id VARCHAR(20) NOT NULL REFERENCES comments(comment_id) ON DELETE CASCADE,
@@ -70,14 +187,190 @@ CREATE TABLE labeled_comments (
     labeled_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(comment_id)
 );
-CREATE INDEX idx_posts_subreddit_id ON posts(subreddit_id);
+-- covering, so the per-subreddit reads of the collectors are index-only scans
+CREATE INDEX idx_posts_subreddit_id_covering ON posts(subreddit_id) INCLUDE (post_id, num_comments);
 CREATE INDEX idx_posts_author_fullname ON posts(author_fullname);
-CREATE INDEX idx_comments_post_id ON comments(post_id);
+CREATE INDEX idx_comments_post_id_covering ON comments(post_id) INCLUDE (comment_id);
 CREATE INDEX idx_comments_author_fullname ON comments(author_fullname);
-CREATE INDEX idx_sentiment_analysis_comment_id ON sentiment_analysis(comment_id);
-CREATE INDEX idx_cleaned_comments_comment_id ON cleaned_comments(comment_id);
 -- for reconstructing comment threads
 CREATE INDEX idx_comments_parent_id ON comments(parent_id);
 -- for time-series analysis
 CREATE INDEX idx_posts_created_utc ON posts(created_utc);
-CREATE INDEX idx_labeled_comments_comment_id ON labeled_comments(comment_id);
\ No newline at end of file
+-- watermarks for incremental exports
+CREATE INDEX idx_comments_ingested_at ON comments(ingested_at);
+CREATE INDEX idx_sentiment_analysis_analysis_date ON sentiment_analysis(analysis_date);
+CREATE INDEX idx_cleaned_comments_cleaning_date ON cleaned_comments(cleaning_date);
+-- both rollup functions first take one transaction-level advisory lock, so
+-- writers of sentiment_analysis and cleaned_comments take turns: under READ
+-- COMMITTED a score-only and a clean-only writer running at once would each
+-- miss the other's uncommitted row, and the comment's ID term would never be
+-- added. The lock is held until commit, and the statement after it sees what
+-- the previous holder committed.
+-- new sentiment rows add every term; the ID term only for comments already cleaned
+CREATE OR REPLACE FUNCTION rollup_new_sentiment() RETURNS trigger AS $$ BEGIN
+PERFORM pg_advisory_xact_lock(7346203);
+INSERT INTO subreddit_metric_rollups AS r (
+        subreddit_id,
+        n,
+        sum_compound,
+        sum_weighted_compound,
+        positive_count,
+        negative_count,
+        sum_neutral_density,
+        n_cleaned
+    )
+SELECT p.subreddit_id,
+    COUNT(*),
+    SUM(ns.vader_compound),
+    SUM(ns.vader_compound * LN(GREATEST(c.score, 0) + 1)),
+    COUNT(*) FILTER (
+        WHERE ns.vader_compound >= 0.05
+    ),
+    COUNT(*) FILTER (
+        WHERE ns.vader_compound <= -0.05
+    ),
+    COALESCE(SUM(ns.vader_neutral * LN(cc.word_count + 1)), 0),
+    COUNT(cc.word_count)
+FROM new_sentiment ns
+    JOIN comments c ON c.comment_id = ns.comment_id
+    JOIN posts p ON p.post_id = c.post_id
+    LEFT JOIN cleaned_comments cc ON cc.comment_id = ns.comment_id
+GROUP BY p.subreddit_id
+ON CONFLICT (subreddit_id) DO UPDATE
+SET n = r.n + EXCLUDED.n,
+    sum_compound = r.sum_compound + EXCLUDED.sum_compound,
+    sum_weighted_compound = r.sum_weighted_compound + EXCLUDED.sum_weighted_compound,
+    positive_count = r.positive_count + EXCLUDED.positive_count,
+    negative_count = r.negative_count + EXCLUDED.negative_count,
+    sum_neutral_density = r.sum_neutral_density + EXCLUDED.sum_neutral_density,
+    n_cleaned = r.n_cleaned + EXCLUDED.n_cleaned,
+    updated_at = CURRENT_TIMESTAMP;
+RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+-- new cleaned rows add the ID term for comments that were already scored
+CREATE OR REPLACE FUNCTION rollup_new_cleaned() RETURNS trigger AS $$ BEGIN
+PERFORM pg_advisory_xact_lock(7346203);
+INSERT INTO subreddit_metric_rollups AS r (subreddit_id, sum_neutral_density, n_cleaned)
+SELECT p.subreddit_id,
+    SUM(sa.vader_neutral * LN(nc.word_count + 1)),
+    COUNT(nc.word_count)
+FROM new_cleaned nc
+    JOIN sentiment_analysis sa ON sa.comment_id = nc.comment_id
+    JOIN comments c ON c.comment_id = nc.comment_id
+    JOIN posts p ON p.post_id = c.post_id
+WHERE nc.word_count IS NOT NULL
+GROUP BY p.subreddit_id
+ON CONFLICT (subreddit_id) DO UPDATE
+SET sum_neutral_density = r.sum_neutral_density + EXCLUDED.sum_neutral_density,
+    n_cleaned = r.n_cleaned + EXCLUDED.n_cleaned,
+    updated_at = CURRENT_TIMESTAMP;
+RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER sentiment_analysis_rollup
+AFTER
+INSERT ON sentiment_analysis REFERENCING NEW TABLE AS new_sentiment FOR EACH STATEMENT EXECUTE FUNCTION rollup_new_sentiment();
+CREATE TRIGGER cleaned_comments_rollup
+AFTER
+INSERT ON cleaned_comments REFERENCING NEW TABLE AS new_cleaned FOR EACH STATEMENT EXECUTE FUNCTION rollup_new_cleaned();
+-- wakes the enrichment daemon: the new comment_ids, comma separated, in as many
+-- notifications as it takes to keep each payload under 7900 bytes; an empty
+-- payload (daemon does a full sweep) only for an id that fits in none
+CREATE OR REPLACE FUNCTION notify_new_comments() RETURNS trigger AS $$
+DECLARE next_id TEXT;
+chunk TEXT := '';
+BEGIN FOR next_id IN
+SELECT comment_id
+FROM new_comments LOOP -- only an id too long for any payload needs the sweep
+    IF octet_length(next_id) >= 7900 THEN PERFORM pg_notify('comments_inserted', '');
+CONTINUE;
+END IF;
+IF chunk <> ''
+AND octet_length(chunk) + 1 + octet_length(next_id) >= 7900 THEN PERFORM pg_notify('comments_inserted', chunk);
+chunk := '';
+END IF;
+chunk := CASE
+    WHEN chunk = '' THEN next_id
+    ELSE chunk || ',' || next_id
+END;
+END LOOP;
+IF chunk <> '' THEN PERFORM pg_notify('comments_inserted', chunk);
+END IF;
+RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER comments_notify
+AFTER
+INSERT ON comments REFERENCING NEW TABLE AS new_comments FOR EACH STATEMENT EXECUTE FUNCTION notify_new_comments();
+-- weeks are summed from the new rows' days, so the comments are joined once
+CREATE OR REPLACE FUNCTION rollup_sentiment_trends() RETURNS trigger AS $$ BEGIN WITH daily AS (
+    SELECT p.subreddit_id,
+        (c.created_utc AT TIME ZONE 'UTC')::date AS bucket,
+        COUNT(*) AS n,
+        SUM(ns.vader_compound) AS sum_compound,
+        SUM(ns.vader_compound * LN(GREATEST(c.score, 0) + 1)) AS sum_weighted_compound,
+        COUNT(*) FILTER (
+            WHERE ns.vader_compound >= 0.05
+        ) AS positive_count,
+        COUNT(*) FILTER (
+            WHERE ns.vader_compound <= -0.05
+        ) AS negative_count
+    FROM new_sentiment ns
+        JOIN comments c ON c.comment_id = ns.comment_id
+        JOIN posts p ON p.post_id = c.post_id
+    GROUP BY 1,
+        2
+),
+daily_upsert AS (
+    INSERT INTO subreddit_daily_sentiment AS t (
+            subreddit_id,
+            bucket,
+            n,
+            sum_compound,
+            sum_weighted_compound,
+            positive_count,
+            negative_count
+        )
+    SELECT *
+    FROM daily
+    ON CONFLICT (subreddit_id, bucket) DO UPDATE
+    SET n = t.n + EXCLUDED.n,
+        sum_compound = t.sum_compound + EXCLUDED.sum_compound,
+        sum_weighted_compound = t.sum_weighted_compound + EXCLUDED.sum_weighted_compound,
+        positive_count = t.positive_count + EXCLUDED.positive_count,
+        negative_count = t.negative_count + EXCLUDED.negative_count,
+        updated_at = CURRENT_TIMESTAMP
+)
+INSERT INTO subreddit_weekly_sentiment AS t (
+        subreddit_id,
+        bucket,
+        n,
+        sum_compound,
+        sum_weighted_compound,
+        positive_count,
+        negative_count
+    )
+SELECT subreddit_id,
+    date_trunc('week', bucket)::date,
+    SUM(n),
+    SUM(sum_compound),
+    SUM(sum_weighted_compound),
+    SUM(positive_count),
+    SUM(negative_count)
+FROM daily
+GROUP BY 1,
+    2
+ON CONFLICT (subreddit_id, bucket) DO UPDATE
+SET n = t.n + EXCLUDED.n,
+    sum_compound = t.sum_compound + EXCLUDED.sum_compound,
+    sum_weighted_compound = t.sum_weighted_compound + EXCLUDED.sum_weighted_compound,
+    positive_count = t.positive_count + EXCLUDED.positive_count,
+    negative_count = t.negative_count + EXCLUDED.negative_count,
+    updated_at = CURRENT_TIMESTAMP;
+RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER sentiment_analysis_trends
+AFTER
+INSERT ON sentiment_analysis REFERENCING NEW TABLE AS new_sentiment FOR EACH STATEMENT EXECUTE FUNCTION rollup_sentiment_trends();
@@ -0,0 +1,303 @@
+"""Comment trees of a subreddit as flat arrays, and the per-thread metrics
+computed from them.
+
+A ThreadTree holds every comment of one subreddit as a node in NumPy arrays:
+the index of its parent comment, its depth, and CSR-style child offsets (the
+replies to node i are children[child_offsets[i]:child_offsets[i + 1]]). Every
+metric is a pass over those arrays, O(n) in the number of comments, instead of
+a recursive CTE per thread. The results go to thread_metrics.
+
+    python thread_tree.py
+    python thread_tree.py --subreddits SQL datascience
+"""
+
+import argparse
+from datetime import datetime, timezone
+import logging
+import os
+
+import numpy as np
+import pyarrow as pa
+
+from clients import DBClient
+from config import DB_URL, STREAM_CHUNK_SIZE
+from instrumentation import metrics
+from seen_ids import decode_ids
+from usefulness_index import NEGATIVE_THRESHOLD
+
+THREAD_METRICS_SCHEMA = pa.schema(
+    [
+        ("post_id", pa.string()),
+        ("n_comments", pa.int32()),
+        ("top_level_comments", pa.int32()),
+        ("max_depth", pa.int32()),
+        ("max_subtree_size", pa.int32()),
+        ("mean_compound", pa.float64()),
+        ("reply_drift", pa.float64()),
+        ("negative_reply_compound", pa.float64()),
+        ("first_comment_seconds", pa.float64()),
+        ("mean_first_reply_seconds", pa.float64()),
+        ("computed_at", pa.timestamp("us", tz="UTC")),
+    ]
+)
+
+
+def _ranges(starts, counts):
+    """The indices of every range(start, start + count), concatenated."""
+    ends = np.cumsum(counts)
+    return np.repeat(starts - ends + counts, counts) + np.arange(
+        ends[-1] if len(ends) else 0
+    )
+
+
+def _mean(groups, values, n_groups):
+    """Per-group mean of values (NaN values ignored); NaN for empty groups."""
+    scored = ~np.isnan(values)
+    totals = np.bincount(groups[scored], values[scored], minlength=n_groups)
+    counts = np.bincount(groups[scored], minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+
+class ThreadTree:
+    """The comment forest of a set of threads. Nodes are ordered by comment id;
+    a node's parent is -1 for top-level comments and for replies whose parent
+    comment was never collected."""
+
+    def __init__(self, post_ids, thread, comment_ids, parent_ids, created, compound):
+        """post_ids: the threads. Per comment: thread (index into post_ids),
+        comment_ids and parent_ids as the API gives them ("t1_..." for a reply,
+        "t3_..." for a top-level comment), created (epoch seconds) and compound
+        (VADER score, NaN if not scored yet)."""
+        ids = decode_ids(comment_ids)
+        order = np.argsort(ids, kind="stable")
+        n = len(ids)
+
+        self.post_ids = np.asarray(post_ids, dtype=object)
+        self.ids = ids[order]
+        self.thread = np.asarray(thread, dtype=np.int64)[order]
+        self.created = np.asarray(created, dtype=np.float64)[order]
+        self.compound = np.asarray(compound, dtype=np.float64)[order]
+
+        parent_ids = np.asarray(parent_ids, dtype=object)[order]
+        is_reply = np.fromiter(
+            (str(parent_id).startswith("t1_") for parent_id in parent_ids), bool, n
+        )
+        self.is_top_level = ~is_reply
+        replies = np.flatnonzero(is_reply)
+        parent_values = decode_ids([parent_id[3:] for parent_id in parent_ids[replies]])
+        positions = np.searchsorted(self.ids, parent_values)
+        positions[positions == n] = 0
+        found = self.ids[positions] == parent_values
+        self.parent = np.full(n, -1, dtype=np.int64)
+        self.parent[replies[found]] = positions[found]
+
+        # CSR: children sorted by parent, each parent's replies in id order
+        has_parent = self.parent >= 0
+        self.child_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self.parent[has_parent], minlength=n),
+            out=self.child_offsets[1:],
+        )
+        self.children = np.flatnonzero(has_parent)[
+            np.argsort(self.parent[has_parent], kind="stable")
+        ]
+
+        # breadth-first from the roots: levels[d] holds the nodes at depth d
+        self.depth = np.zeros(n, dtype=np.int32)
+        self.levels = []
+        level = np.flatnonzero(~has_parent)
+        while len(level):
+            self.levels.append(level)
+            self.depth[level] = len(self.levels) - 1
+            starts = self.child_offsets[level]
+            level = self.children[
+                _ranges(starts, self.child_offsets[level + 1] - starts)
+            ]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def reply_counts(self):
+        return np.diff(self.child_offsets)
+
+    def subtree_sizes(self):
+        """Comments in each node's subtree, itself included."""
+        sizes = np.ones(len(self), dtype=np.int64)
+        for level in reversed(self.levels[1:]):
+            np.add.at(sizes, self.parent[level], sizes[level])
+        return sizes
+
+    def first_reply_seconds(self):
+        """Seconds from each comment to its first reply; NaN without replies."""
+        seconds = np.full(len(self), np.nan)
+        replied = np.flatnonzero(self.reply_counts)
+        if len(replied):
+            first = np.minimum.reduceat(
+                self.created[self.children], self.child_offsets[replied]
+            )
+            seconds[replied] = first - self.created[replied]
+        return seconds
+
+    def thread_metrics(self, post_created):
+        """One row per thread, as a pyarrow Table shaped like thread_metrics.
+        post_created: epoch seconds of each thread's post."""
+        n_threads = len(self.post_ids)
+        thread = self.thread
+        replies = np.flatnonzero(self.parent >= 0)
+        parents = self.parent[replies]
+
+        n_comments = np.bincount(thread, minlength=n_threads)
+        max_depth = np.zeros(n_threads, dtype=np.int64)
+        np.maximum.at(max_depth, thread, self.depth)
+        sizes = self.subtree_sizes()
+        # the biggest branch, counting replies to uncollected parents as branches
+        roots = self.parent < 0
+        max_subtree = np.zeros(n_threads, dtype=np.int64)
+        np.maximum.at(max_subtree, thread[roots], sizes[roots])
+
+        # how a reply's sentiment moves away from the comment it answers
+        drift = self.compound[replies] - self.compound[parents]
+        negative = self.compound[parents] <= NEGATIVE_THRESHOLD
+        first_comment = np.full(n_threads, np.inf)
+        np.minimum.at(first_comment, thread, self.created)
+
+        columns = {
+            "post_id": self.post_ids,
+            "n_comments": n_comments,
+            "top_level_comments": np.bincount(
+                thread[self.is_top_level], minlength=n_threads
+            ),
+            "max_depth": max_depth,
+            "max_subtree_size": max_subtree,
+            "mean_compound": _mean(thread, self.compound, n_threads),
+            "reply_drift": _mean(thread[replies], drift, n_threads),
+            "negative_reply_compound": _mean(
+                thread[replies[negative]],
+                self.compound[replies[negative]],
+                n_threads,
+            ),
+            "first_comment_seconds": first_comment
+            - np.asarray(post_created, dtype=np.float64),
+            "mean_first_reply_seconds": _mean(
+                thread, self.first_reply_seconds(), n_threads
+            ),
+        }
+        keep = n_comments > 0
+        computed_at = datetime.now(timezone.utc)
+        return pa.table(
+            {
+                **{
+                    name: pa.array(
+                        values[keep],
+                        THREAD_METRICS_SCHEMA.field(name).type,
+                        from_pandas=True,
+                    )
+                    for name, values in columns.items()
+                },
+                "computed_at": pa.array(
+                    [computed_at] * int(keep.sum()),
+                    THREAD_METRICS_SCHEMA.field("computed_at").type,
+                ),
+            },
+            schema=THREAD_METRICS_SCHEMA,
+        )
+
+
+def load_thread_tree(db_client, subreddit_id, chunk_size=STREAM_CHUNK_SIZE):
+    """The comment trees of one subreddit's threads, and the epoch seconds of
+    each thread's post. Threads and their post times come from the comment
+    query itself, so both are read in one snapshot; posts without comments get
+    no metrics row anyway."""
+    query = """
+        SELECT c.comment_id, c.post_id, c.parent_id, c.created_utc,
+            sa.vader_compound, p.created_utc AS post_created_utc
+        FROM comments c
+        JOIN posts p ON p.post_id = c.post_id
+        LEFT JOIN sentiment_analysis sa ON sa.comment_id = c.comment_id
+        WHERE p.subreddit_id = :subreddit_id
+    """
+    post_index, post_created = {}, []
+    thread, comment_ids, parent_ids, created, compound = [], [], [], [], []
+    for chunk in db_client.stream(query, {"subreddit_id": subreddit_id}, chunk_size):
+        for row in chunk:
+            post_id = row["post_id"]
+            if post_id not in post_index:
+                post_index[post_id] = len(post_created)
+                post_created.append(row["post_created_utc"].timestamp())
+            thread.append(post_index[post_id])
+            comment_ids.append(row["comment_id"])
+            parent_ids.append(row["parent_id"])
+            created.append(row["created_utc"].timestamp())
+            score = row["vader_compound"]
+            compound.append(np.nan if score is None else score)
+
+    tree = ThreadTree(
+        list(post_index), thread, comment_ids, parent_ids, created, compound
+    )
+    return tree, post_created
+
+
+def update_thread_metrics(db_client, subreddit_id):
+    """Recompute thread_metrics for one subreddit. Returns the threads written."""
+    with metrics.stage("thread_tree_load") as stage:
+        tree, post_created = load_thread_tree(db_client, subreddit_id)
+        stage.add_rows(len(tree))
+    with metrics.stage("thread_metrics") as stage:
+        table = tree.thread_metrics(post_created)
+        stage.add_rows(len(tree))
+    return db_client.bulk_load(
+        "thread_metrics", table, conflict_key="post_id", on_conflict="update"
+    )
+
+
+def thread_tree_populate(db_client, subreddits=None):
+    query = "SELECT subreddit_id, subreddit FROM subreddits"
+    rows = [
+        row
+        for row in db_client.fetch_all(query)
+        if subreddits is None or row["subreddit"] in subreddits
+    ]
+    for row in rows:
+        try:
+            written = update_thread_metrics(db_client, row["subreddit_id"])
+            logging.info(f"r/{row['subreddit']}: wrote metrics of {written} threads.")
+        except Exception as e:
+            logging.error(
+                f"An error occurred while processing r/{row['subreddit']}: {e}",
+                exc_info=True,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--subreddits", nargs="+", help="default: every subreddit")
+    args = parser.parse_args()
+
+    log_file_name = "thread_tree.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    logging.info("--- STARTING THREAD TREE SCRIPT ---")
+    success = False
+
+    try:
+        thread_tree_populate(DBClient(DB_URL), args.subreddits)
+        success = True
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+    finally:
+        metrics.export("thread_tree", success=success)
+        logging.info("--- THREAD TREE SCRIPT FINISHED ---")
@@ -0,0 +1,142 @@
+import logging
+import os
+import pandas as pd
+
+from clients import DBClient
+from config import DB_URL
+
+# README: "positive" is vader_compound >= 0.05, "negative" is <= -0.05
+POSITIVE_THRESHOLD = 0.05
+NEGATIVE_THRESHOLD = -0.05
+
+METRICS = ("avg_compound", "swe", "cr", "id")
+DEFAULT_WEIGHTS = {metric: 0.25 for metric in METRICS}
+
+# the per-subreddit sums every metric is derived from
+SUM_COLUMNS = (
+    "n",
+    "sum_compound",
+    "sum_weighted_compound",
+    "positive_count",
+    "negative_count",
+    "sum_neutral_density",
+    "n_cleaned",
+)
+
+
+def get_metric_sums(db_client):
+    """Per-subreddit sums and counts behind the four metrics, aggregated in
+    Postgres so only one row per subreddit comes back."""
+    query = """
+        SELECT s.subreddit,
+            COUNT(*) AS n,
+            SUM(sa.vader_compound) AS sum_compound,
+            SUM(sa.vader_compound * LN(GREATEST(c.score, 0) + 1))
+                AS sum_weighted_compound,
+            COUNT(*) FILTER (WHERE sa.vader_compound >= :positive) AS positive_count,
+            COUNT(*) FILTER (WHERE sa.vader_compound <= :negative) AS negative_count,
+            SUM(sa.vader_neutral * LN(cc.word_count + 1)) AS sum_neutral_density,
+            COUNT(cc.word_count) AS n_cleaned
+        FROM sentiment_analysis sa
+        JOIN comments c ON c.comment_id = sa.comment_id
+        JOIN posts p ON p.post_id = c.post_id
+        JOIN subreddits s ON s.subreddit_id = p.subreddit_id
+        LEFT JOIN cleaned_comments cc ON cc.comment_id = sa.comment_id
+        GROUP BY s.subreddit
+    """
+
+    params = {"positive": POSITIVE_THRESHOLD, "negative": NEGATIVE_THRESHOLD}
+    return db_client.fetch_all(query, params)
+
+
+def get_rollup_sums(db_client):
+    """The same sums read from subreddit_metric_rollups, which the insert
+    triggers keep current: no scan of the comment tables."""
+    query = f"""
+        SELECT s.subreddit, {", ".join(f"r.{column}" for column in SUM_COLUMNS)}
+        FROM subreddit_metric_rollups r
+        JOIN subreddits s ON s.subreddit_id = r.subreddit_id
+        WHERE r.n > 0
+    """
+    return db_client.fetch_all(query)
+
+
+def compute_metrics(sums):
+    """C̄, SWE, CR and ID per subreddit from the aggregated sums."""
+    df = pd.DataFrame([dict(row) for row in sums])
+    if df.empty:
+        return pd.DataFrame(columns=["subreddit", *METRICS]).set_index("subreddit")
+
+    df = df.set_index("subreddit").astype(float)
+
+    metrics = pd.DataFrame(index=df.index)
+    metrics["avg_compound"] = df["sum_compound"] / df["n"]
+    metrics["swe"] = df["sum_weighted_compound"] / df["n"]
+    metrics["cr"] = df["positive_count"] / (df["negative_count"] + 1)
+    metrics["id"] = df["sum_neutral_density"] / df["n_cleaned"].where(
+        df["n_cleaned"] > 0
+    )
+    metrics["n"] = df["n"].astype(int)
+    return metrics
+
+
+def min_max_normalize(series):
+    spread = series.max() - series.min()
+    if not spread or pd.isna(spread):
+        return pd.Series(0.0, index=series.index)
+    return (series - series.min()) / spread
+
+
+def usefulness_index(metrics, weights=None):
+    """Weighted sum of the min-max normalized metrics, highest first. weights
+    overrides DEFAULT_WEIGHTS for the metrics it names."""
+    unknown = set(weights or {}) - set(METRICS)
+    if unknown:
+        raise ValueError(
+            f"Unknown metrics in weights: {', '.join(sorted(unknown))} "
+            f"(expected some of {', '.join(METRICS)})"
+        )
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+
+    result = metrics.copy()
+    result["usefulness_index"] = 0.0
+    for metric in METRICS:
+        normalized = min_max_normalize(result[metric])
+        result[f"norm_{metric}"] = normalized
+        result["usefulness_index"] += weights[metric] * normalized.fillna(0.0)
+
+    return result.sort_values("usefulness_index", ascending=False)
+
+
+def compute_usefulness_index(db_client, weights=None, from_rollups=True):
+    """from_rollups reads the trigger-maintained subreddit_metric_rollups table
+    (one row per subreddit); False recomputes the sums from the comment tables."""
+    sums = get_rollup_sums(db_client) if from_rollups else get_metric_sums(db_client)
+    return usefulness_index(compute_metrics(sums), weights)
+
+
+if __name__ == "__main__":
+    log_file_name = "usefulness_index.log"
+    log_dir = os.path.join("logs", "scripts")
+    log_path = os.path.join(log_dir, log_file_name)
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(),
+        ],
+    )
+
+    db_client = DBClient(DB_URL)
+
+    try:
+        index = compute_usefulness_index(db_client)
+        logging.info(f"Usefulness Index:\n{index.to_string()}")
+    except Exception as e:
+        logging.critical(f"A critical error stopped the script: {e}", exc_info=True)
+    finally:
+        logging.info("--- USEFULNESS INDEX SCRIPT FINISHED ---")
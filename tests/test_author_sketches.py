@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from author_sketches import CountMinTopK, HyperLogLog, author_hashes
+
+
+def authors(n, prefix="t2_"):
+    return [f"{prefix}{i}" for i in range(n)]
+
+
+def test_hyperloglog_count_is_close():
+    hll = HyperLogLog(precision=12)
+    hll.add(author_hashes(authors(20_000)))
+    # adding the same authors again changes nothing
+    hll.add(author_hashes(authors(20_000)))
+
+    assert hll.count() == pytest.approx(20_000, rel=0.05)
+    assert HyperLogLog(precision=12).count() == 0
+
+
+def test_hyperloglog_merge_is_a_union_and_round_trips():
+    first = HyperLogLog(precision=10)
+    first.add(author_hashes(authors(500)))
+    second = HyperLogLog(precision=10)
+    second.add(author_hashes(authors(500, prefix="t2_x")))
+
+    merged = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+
+    assert merged.count() == pytest.approx(1000, rel=0.1)
+    with pytest.raises(ValueError):
+        first.merge(HyperLogLog(precision=11))
+
+
+def test_count_min_never_underestimates():
+    sketch = CountMinTopK(width=64, depth=4, k=3)
+    names = authors(200)
+    counts = np.arange(1, 201)
+    sketch.add(names, counts)
+
+    estimates = sketch.estimate(names)
+    assert (estimates >= counts).all()
+    assert (estimates - counts <= sketch.error_bound).mean() > 0.9
+    assert sketch.total == counts.sum()
+
+
+def test_top_k_survives_merges_and_serialization():
+    first = CountMinTopK(width=1024, depth=4, k=2)
+    first.add(["t2_a", "t2_b", "t2_c"], [5, 1, 3])
+    second = CountMinTopK(width=1024, depth=4, k=2)
+    second.add(["t2_b", "t2_d"], [10, 2])
+
+    merged = CountMinTopK.from_bytes(first.to_bytes()).merge(second)
+
+    assert merged.top() == [("t2_b", 11), ("t2_a", 5)]
+    assert merged.top(1) == [("t2_b", 11)]
+    with pytest.raises(ValueError):
+        first.merge(CountMinTopK(width=512, depth=4, k=2))
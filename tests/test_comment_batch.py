@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from comments_table_populate import COMMENT_SCHEMA, CommentBatch
+
+
+def comment(id_, created_utc, author=True):
+    return SimpleNamespace(
+        id=id_,
+        author=SimpleNamespace(name="someone") if author else None,
+        author_fullname="t2_someone",
+        parent_id="t3_post",
+        body="text",
+        created_utc=created_utc,
+        score=3,
+        depth=0,
+        is_submitter=False,
+        stickied=False,
+    )
+
+
+def test_to_arrow():
+    batch = CommentBatch()
+    batch.append(comment("a", 1_700_000_000.25), "post")
+    batch.append(comment("b", 1_700_000_001.0, author=False), "post")
+
+    table = batch.to_arrow()
+
+    assert table.schema == COMMENT_SCHEMA
+    assert table.column("comment_id").to_pylist() == ["a", "b"]
+    # deleted authors load as NULL
+    assert table.column("author_fullname").to_pylist() == ["t2_someone", None]
+    assert table.column("created_utc").to_pylist()[0] == datetime(
+        2023, 11, 14, 22, 13, 20, 250000, tzinfo=timezone.utc
+    )
+
+
+def test_filter_and_extend():
+    batch = CommentBatch()
+    for i, id_ in enumerate("abc"):
+        batch.append(comment(id_, i), "post")
+
+    kept = batch.filter([True, False, True])
+    kept.extend(batch.filter([False, True, False]))
+
+    assert len(kept) == 3
+    assert kept.columns["comment_id"] == ["a", "c", "b"]
+    assert kept.columns["created_utc"] == [0, 2, 1]
@@ -0,0 +1,122 @@
+from praw.models import MoreComments
+
+from comment_expansion import ExpansionPolicy, expand_comments, stub_to_row
+
+
+class FakeComment:
+    def __init__(self, comment_id, replies=(), parent_id="t3_post", created_utc=0):
+        self.id = comment_id
+        self.replies = list(replies)
+        self.parent_id = parent_id
+        self.created_utc = created_utc
+
+
+class FakeMore(MoreComments):
+    """A stub whose expansion returns fixed comments and counts its calls."""
+
+    def __init__(self, more_id, parent_id, count, hidden=(), depth=0):
+        super().__init__(
+            None,
+            _data={
+                "id": more_id,
+                "parent_id": parent_id,
+                "count": count,
+                "depth": depth,
+                "children": [c.id for c in hidden],
+            },
+        )
+        self.hidden = list(hidden)
+        self.expansions = 0
+
+    def comments(self, update=True):
+        self.expansions += 1
+        return self.hidden
+
+
+def unlimited():
+    return ExpansionPolicy(max_calls=None, max_seconds=None)
+
+
+def forest():
+    """c1 -> (c2, stub of c3); a top-level stub of c4 -> (c5, stub of c6)."""
+    nested = FakeMore("m1", "t1_c1", 2, [FakeComment("c3")], depth=1)
+    deeper = FakeMore("m3", "t1_c4", 1, [FakeComment("c6")], depth=1)
+    top = FakeMore("m2", "t3_post", 5, [FakeComment("c4", [FakeComment("c5"), deeper])])
+    c1 = FakeComment("c1", [FakeComment("c2"), nested])
+    return [c1, top], [nested, top, deeper]
+
+
+def test_each_stub_expanded_once_from_a_flattened_list():
+    top_level, stubs = forest()
+    # what CommentForest.list() gives: every comment and stub, nested ones too
+    flattened = [*top_level, top_level[0].replies[0], *stubs]
+
+    comments, unexpanded, calls = expand_comments(object(), flattened, unlimited())
+
+    assert sorted(c.id for c in comments) == ["c1", "c2", "c3", "c4", "c5", "c6"]
+    assert [more.expansions for more in stubs] == [1, 1, 1]
+    assert calls == 3
+    assert unexpanded == []
+
+
+def test_budget_counts_each_stub_once():
+    top_level, stubs = forest()
+    flattened = [*top_level, *stubs]
+
+    comments, unexpanded, calls = expand_comments(
+        object(), flattened, ExpansionPolicy(max_calls=2, max_seconds=None)
+    )
+
+    # largest first: m2 (5 hidden), then m1 (2), leaving m3 (1)
+    assert calls == 2
+    assert [more.expansions for more in stubs] == [1, 1, 0]
+    assert unexpanded == [stubs[2]]
+    assert "c6" not in {c.id for c in comments}
+
+
+def test_continue_this_thread_stubs_are_kept_apart():
+    first = FakeMore("_", "t1_a", 0, [FakeComment("x")])
+    second = FakeMore("_", "t1_b", 0, [FakeComment("y")])
+
+    comments, _, calls = expand_comments(object(), [first, second], unlimited())
+
+    assert calls == 2
+    assert sorted(c.id for c in comments) == ["x", "y"]
+
+
+def test_stub_row_round_trip_fields():
+    more = FakeMore("m1", "t1_c1", 3, [FakeComment("a"), FakeComment("b")], depth=2)
+
+    assert stub_to_row("post", more) == {
+        "post_id": "post",
+        "parent_id": "t1_c1",
+        "more_id": "m1",
+        "child_count": 3,
+        "depth": 2,
+        "children": "a,b",
+    }
+
+
+def test_recrawl_drops_stubs_behind_the_watermark():
+    # sorted by new: the top level reaches c2, older than the watermark, so the
+    # top-level stub can only hide older comments
+    old_level = FakeMore("m1", "t3_post", 9, [FakeComment("old")])
+    fresh = FakeComment("c3", parent_id="t1_c1", created_utc=160)
+    new_level = FakeMore("m2", "t1_c1", 2, [FakeComment("c4", created_utc=170)])
+    unseen = FakeMore("m3", "t1_c2", 1, [FakeComment("c5")])
+    items = [
+        FakeComment("c1", [fresh, new_level], created_utc=150),
+        FakeComment("c2", [unseen], created_utc=90),
+        old_level,
+    ]
+
+    comments, unexpanded, calls = expand_comments(
+        object(), items, ExpansionPolicy(max_calls=1, max_seconds=None), since=100
+    )
+
+    assert old_level.expansions == 0
+    assert new_level.expansions == 1
+    assert calls == 1
+    # c2's replies may still be new, so its stub is kept for later
+    assert unexpanded == [unseen]
+    assert "c4" in {c.id for c in comments}
@@ -0,0 +1,51 @@
+import csv
+import io
+
+import pyarrow as pa
+
+from clients.db_client import _arrow_csv, _CopyBuffer
+
+ROWS = [
+    {"id": "a", "body": "", "score": 1},
+    {"id": "b", "body": None, "score": None},
+    {"id": "c", "body": 'says "hi", then\nleaves', "score": -2},
+]
+
+
+def parse(text):
+    """What COPY ... WITH (FORMAT csv) reads back: unquoted empty fields are
+    NULL, quoted ones are strings."""
+    return list(csv.reader(io.StringIO(text), quoting=csv.QUOTE_NOTNULL))
+
+
+def test_copy_buffer_keeps_empty_strings_apart_from_nulls():
+    text = _CopyBuffer(ROWS, ["id", "body", "score"]).read()
+
+    lines = text.split("\n")
+    assert lines[0] == '"a","","1"'
+    assert lines[1] == '"b",,'
+    assert parse(text)[2] == ["c", 'says "hi", then\nleaves', "-2"]
+
+
+def test_copy_buffer_reads_in_chunks():
+    buffer = _CopyBuffer(ROWS * 50, ["id", "body", "score"])
+    whole = _CopyBuffer(ROWS * 50, ["id", "body", "score"]).read()
+
+    chunks = []
+    while chunk := buffer.read(64):
+        assert len(chunk) <= 64
+        chunks.append(chunk)
+    assert "".join(chunks) == whole
+
+
+def test_arrow_csv_quotes_like_the_copy_buffer():
+    table = pa.table(
+        {
+            "id": [row["id"] for row in ROWS],
+            "body": [row["body"] for row in ROWS],
+        }
+    )
+
+    text = _arrow_csv(table).read().decode()
+
+    assert text == _CopyBuffer(ROWS, ["id", "body"]).read()
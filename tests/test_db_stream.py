@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+
+import pytest
+
+from clients import DBClient
+
+
+class FakeConnection:
+    """Stands in for a SQLAlchemy connection: execute() gives a result whose
+    chunks come from chunks, an exception among them raised in its turn."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def execution_options(self, **options):
+        return self
+
+    def execute(self, statement, params):
+        return self
+
+    def mappings(self):
+        return self
+
+    def partitions(self):
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+def client(chunks):
+    db_client = DBClient.__new__(DBClient)
+
+    @contextmanager
+    def connect():
+        yield FakeConnection(chunks)
+
+    db_client.engine = type("Engine", (), {"connect": staticmethod(connect)})
+    return db_client
+
+
+def test_streams_every_chunk():
+    chunks = [[{"id": 1}, {"id": 2}], [{"id": 3}]]
+
+    assert list(client(chunks).stream("SELECT id FROM t")) == chunks
+
+
+def test_a_failure_mid_stream_reaches_the_caller():
+    chunks = [[{"id": 1}], ConnectionError("server closed the connection")]
+    received = []
+
+    with pytest.raises(ConnectionError):
+        for chunk in client(chunks).stream("SELECT id FROM t"):
+            received.append(chunk)
+
+    assert received == [[{"id": 1}]]
+
+
+def test_a_query_failing_outright_streams_nothing():
+    chunks = [TimeoutError("canceling statement due to statement timeout")]
+
+    assert list(client(chunks).stream("SELECT id FROM t")) == []
@@ -0,0 +1,10 @@
+from enrichment_daemon import notified_comment_ids
+
+
+def test_payloads_of_one_insert_are_unioned():
+    # a bulk_load of many comments notifies its ids in several chunks
+    assert notified_comment_ids(["a,b", "c", "b,d"]) == {"a", "b", "c", "d"}
+
+
+def test_an_empty_payload_asks_for_a_sweep():
+    assert notified_comment_ids(["a,b", ""]) is None
@@ -0,0 +1,147 @@
+"""harvest_comments and RateLimitedRequestor against a local stand-in for the
+Reddit API (http.server on a free port), so no network or credentials are
+needed."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+
+from clients import PrawClient, TokenBucket
+from comment_expansion import ExpansionPolicy
+from comments_table_populate import harvest_comments
+
+MISSING_POST = "gone"
+
+
+def comment(comment_id, post_id, created_utc):
+    return {
+        "kind": "t1",
+        "data": {
+            "id": comment_id,
+            "name": f"t1_{comment_id}",
+            "body": f"comment {comment_id}",
+            "author": "someone",
+            "author_fullname": "t2_someone",
+            "parent_id": f"t3_{post_id}",
+            "link_id": f"t3_{post_id}",
+            "created_utc": created_utc,
+            "score": 1,
+            "depth": 0,
+            "is_submitter": False,
+            "stickied": False,
+            "replies": "",
+        },
+    }
+
+
+def thread(post_id):
+    """The /comments/<id> response: the submission and two comments."""
+    submission = {
+        "kind": "t3",
+        "data": {
+            "id": post_id,
+            "name": f"t3_{post_id}",
+            "title": post_id,
+            "num_comments": 2,
+            "created_utc": 1_700_000_000,
+        },
+    }
+    comments = [comment(f"{post_id}c{i}", post_id, 1_700_000_100 + i) for i in (1, 2)]
+    return [
+        {"kind": "Listing", "data": {"children": [submission]}},
+        {"kind": "Listing", "data": {"children": comments}},
+    ]
+
+
+class StandIn(BaseHTTPRequestHandler):
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send(
+            200,
+            {
+                "access_token": "token",
+                "token_type": "bearer",
+                "expires_in": 3600,
+                "scope": "*",
+            },
+        )
+
+    def do_GET(self):
+        self.server.request_times.append(time.monotonic())
+        post_id = self.path.split("/")[2]
+        if post_id == MISSING_POST:
+            self._send(404, {"message": "Not Found", "error": 404})
+        else:
+            self._send(200, thread(post_id))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.request_times = []
+    worker = threading.Thread(target=server.serve_forever, daemon=True)
+    worker.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def praw_client(stand_in, monkeypatch):
+    monkeypatch.setenv("REDDIT_CLIENT_ID", "client")
+    monkeypatch.setenv("REDDIT_CLIENT_SECRET", "secret")
+    monkeypatch.setenv("REDDIT_USER_AGENT", "harvest tests")
+    url = f"http://127.0.0.1:{stand_in.server_port}"
+    return PrawClient(
+        rate_limiter=TokenBucket(rate=20, capacity=1),
+        oauth_url=url,
+        reddit_url=url,
+        check_for_updates=False,
+    )
+
+
+def test_harvest_isolates_failed_posts(praw_client):
+    tasks = {post_id: {} for post_id in ("a1", MISSING_POST, "b2", "c3")}
+
+    results = dict(harvest_comments(praw_client, tasks, ExpansionPolicy(), workers=3))
+
+    assert results.keys() == tasks.keys()
+    assert results[MISSING_POST] is None
+    for post_id in ("a1", "b2", "c3"):
+        comments, authors, stubs, crawl_state = results[post_id]
+        assert sorted(comments.columns["comment_id"]) == [
+            f"{post_id}c1",
+            f"{post_id}c2",
+        ]
+        assert authors == {"t2_someone": "someone"}
+        assert stubs == []
+        assert crawl_state["num_comments_seen"] == 2
+
+
+def test_requests_stay_within_the_shared_rate(praw_client, stand_in):
+    tasks = {f"p{i}": {} for i in range(10)}
+
+    for _ in harvest_comments(praw_client, tasks, ExpansionPolicy(), workers=4):
+        pass
+
+    times = stand_in.request_times
+    assert len(times) == len(tasks)
+    # 20 requests/second with a burst of 1, shared by every harvester thread;
+    # each thread's token request counts against the bucket too
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert times[-1] - times[0] >= (len(times) - 1) / 20 * 0.9
+    assert min(gaps) >= 0.02
@@ -0,0 +1,51 @@
+from pathlib import Path
+import re
+
+from instrumentation import METRIC_HELP, STAGE_HELP, MetricsRegistry, fingerprint
+
+
+def test_fingerprint_ignores_literals_parameters_and_layout():
+    first = fingerprint("""
+        SELECT * FROM comments  -- the newest first
+        WHERE post_id = :post_id AND body <> 'it''s' LIMIT 10;
+        """)
+    second = fingerprint(
+        "SELECT * FROM comments WHERE post_id = %(post_id)s AND body <> 'x' LIMIT 5"
+    )
+
+    assert first == second
+    assert first == "SELECT * FROM comments WHERE post_id = ? AND body <> ? LIMIT ?"
+
+
+def test_fingerprint_keeps_casts_and_identifiers():
+    assert fingerprint("SELECT now()::date, t1_id FROM x") == (
+        "SELECT now()::date, t1_id FROM x"
+    )
+
+
+SOURCES = [
+    path
+    for path in (Path(__file__).parent.parent / "src").rglob("*.py")
+    if "sql" not in path.parts
+]
+METRIC_CALL = re.compile(
+    r"metrics\.(?:increment|observe|set_gauge|timer)\(\s*\"(\w+)\""
+)
+STAGE_CALL = re.compile(r"metrics\.(?:stage|record_stage)\(\s*\"(\w+)\"")
+
+
+def names(pattern):
+    return {name for path in SOURCES for name in pattern.findall(path.read_text())}
+
+
+def test_every_metric_and_stage_is_described():
+    assert names(METRIC_CALL) - METRIC_HELP.keys() == set()
+    assert names(STAGE_CALL) - STAGE_HELP.keys() == set()
+    assert names(STAGE_CALL)
+
+
+def test_summary_describes_the_stages_that_ran():
+    registry = MetricsRegistry()
+    registry.record_stage("enrich", 10, 1.0)
+
+    assert registry.summary()["stages"] == {"enrich": STAGE_HELP["enrich"]}
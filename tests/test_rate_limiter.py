@@ -0,0 +1,39 @@
+import threading
+import time
+
+import pytest
+
+from clients import TokenBucket
+
+
+def test_burst_is_free_then_waits_for_refill():
+    bucket = TokenBucket(rate=50, capacity=2)
+
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    started = time.monotonic()
+    waited = bucket.acquire()
+    assert waited > 0
+    assert time.monotonic() - started >= 0.015
+
+
+def test_threads_share_one_quota():
+    bucket = TokenBucket(rate=100, capacity=1)
+    started = time.monotonic()
+
+    threads = [
+        threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 20 tokens, the first one free: at least 19 refills at 100/s
+    assert time.monotonic() - started >= 19 / 100 * 0.9
+
+
+def test_acquiring_more_than_capacity_fails():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=1, capacity=2).acquire(3)
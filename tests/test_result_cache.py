@@ -0,0 +1,37 @@
+from result_cache import ResultCache, body_key, stop_words_fingerprint
+
+
+def test_evicts_the_least_recently_used_entry():
+    cache = ResultCache(max_entries=2, max_body_chars=100)
+    cache.put("a", clean={"word_count": 1})
+    cache.put("b", clean={"word_count": 2})
+    cache.get("a")
+    cache.put("c", clean={"word_count": 3})
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == {"clean": {"word_count": 1}}
+
+
+def test_put_merges_clean_and_score_results():
+    cache = ResultCache(max_entries=4, max_body_chars=100)
+    cache.put("a", clean={"word_count": 1})
+    cache.put("a", score={"vader_compound": 0.5})
+
+    assert cache.get("a") == {
+        "clean": {"word_count": 1},
+        "score": {"vader_compound": 0.5},
+    }
+
+
+def test_long_bodies_and_a_zero_size_are_not_cacheable():
+    assert ResultCache(max_entries=4, max_body_chars=5).cacheable("short")
+    assert not ResultCache(max_entries=4, max_body_chars=5).cacheable("longer")
+    assert not ResultCache(max_entries=0, max_body_chars=5).cacheable("short")
+
+
+def test_keys():
+    assert body_key("thanks!") == body_key("thanks!")
+    assert body_key("thanks!") != body_key("thanks")
+    assert stop_words_fingerprint(None) is None
+    assert stop_words_fingerprint(["b", "a"]) == stop_words_fingerprint({"a", "b"})
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import numpy as np
+from sqlalchemy.engine import make_url
+
+from seen_ids import SeenIds, database_directory, decode_ids
+
+
+def mark(ids):
+    return len(ids), max(int(i, 36) for i in ids) if ids else None
+
+
+def test_decode_ids():
+    assert decode_ids(["z", "10", "1abc2d"]).tolist() == [35, 36, int("1abc2d", 36)]
+
+
+def test_reloads_the_saved_index_while_it_matches_the_database(tmp_path):
+    fetches = []
+
+    def fetch_ids():
+        fetches.append(1)
+        return ["abc", "a1"]
+
+    stored = mark(["abc", "a1"])
+    seen = SeenIds.load("comments", "SQL", fetch_ids, stored, directory=tmp_path)
+    assert (tmp_path / "comments" / "SQL.npy").exists()
+    assert seen.mark == stored
+
+    reloaded = SeenIds.load("comments", "SQL", fetch_ids, stored, directory=tmp_path)
+    assert len(fetches) == 1
+    assert len(reloaded) == len(seen) == 2
+    assert "abc" in reloaded and "abd" not in reloaded
+
+
+def test_rebuilds_an_index_the_database_no_longer_matches(tmp_path):
+    stored = ["a", "b", "c"]
+    SeenIds.load("comments", "SQL", lambda: stored, mark(stored), directory=tmp_path)
+
+    # truncated, restored from an older backup, rows deleted by hand
+    for now_stored in ([], ["a", "b"], ["a", "c"]):
+        seen = SeenIds.load(
+            "comments",
+            "SQL",
+            lambda: now_stored,
+            mark(now_stored),
+            directory=tmp_path,
+        )
+        assert seen.contains(stored).tolist() == [i in now_stored for i in stored]
+
+    # an unknown mark trusts nothing
+    seen = SeenIds.load("comments", "SQL", lambda: ["z"], None, directory=tmp_path)
+    assert seen.contains(["a", "z"]).tolist() == [False, True]
+
+
+def test_add_keeps_new_ids_in_memory_until_saved(tmp_path):
+    seen = SeenIds.load("posts", "SQL", lambda: ["b"], mark(["b"]), directory=tmp_path)
+    assert seen.contains(["a", "b"]).tolist() == [False, True]
+
+    seen.add(["c", "a"])
+    seen.add(["a", "zz", "b"])
+
+    assert seen.contains(["a", "b", "c", "zz", "zzz"]).tolist() == [
+        True,
+        True,
+        True,
+        True,
+        False,
+    ]
+    assert seen.mark == mark(["a", "b", "c", "zz"])
+    path = tmp_path / "posts" / "SQL.npy"
+    assert np.load(path).tolist() == decode_ids(["b"]).tolist()
+
+    seen.save()
+
+    assert np.load(path).tolist() == sorted(decode_ids(["a", "b", "c", "zz"]).tolist())
+    assert seen.mark == mark(["a", "b", "c", "zz"])
+    assert "zz" in seen
+
+
+def test_each_database_has_its_own_directory(tmp_path):
+    def client(url):
+        return SimpleNamespace(engine=SimpleNamespace(url=make_url(url)))
+
+    reddit = database_directory(client("postgresql://u:pw@db/reddit"), tmp_path)
+
+    assert reddit == database_directory(
+        client("postgresql://u:other@db/reddit"), tmp_path
+    )
+    assert reddit != database_directory(
+        client("postgresql://u:pw@db/scratch"), tmp_path
+    )
+    assert reddit != database_directory(
+        client("postgresql://u:pw@db2/reddit"), tmp_path
+    )
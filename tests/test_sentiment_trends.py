@@ -0,0 +1,82 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from sentiment_trends import sentiment_trend
+
+
+class FakeDB:
+    def __init__(self, rows):
+        self.rows = rows
+        self.params = None
+
+    def fetch_all(self, query, params=None):
+        self.params = params
+        return [
+            row
+            for row in self.rows
+            if ("start" not in params or row["bucket"] >= params["start"])
+            and ("end" not in params or row["bucket"] < params["end"])
+        ]
+
+
+def row(subreddit, bucket, n, sum_compound, positive=0, negative=0):
+    return {
+        "subreddit": subreddit,
+        "bucket": bucket,
+        "n": n,
+        "sum_compound": sum_compound,
+        "sum_weighted_compound": sum_compound,
+        "positive_count": positive,
+        "negative_count": negative,
+    }
+
+
+ROWS = [
+    row("SQL", date(2024, 1, 1), 2, 1.0, positive=2),
+    row("SQL", date(2024, 1, 2), 1, -1.0, negative=1),
+    row("SQL", date(2024, 1, 4), 1, 0.5, positive=1),
+    row("rstats", date(2024, 1, 3), 4, 2.0, positive=3),
+]
+
+
+def test_daily_buckets_fill_gaps_with_zero_counts():
+    trend = sentiment_trend(FakeDB(ROWS), start=date(2024, 1, 1), end=date(2024, 1, 5))
+
+    sql = trend.loc["SQL"]
+    assert list(sql["n"]) == [2, 1, 0, 1]
+    assert sql["avg_compound"].iloc[0] == 0.5
+    assert sql["avg_compound"].isna().iloc[2]
+    assert list(trend.loc["rstats", "n"]) == [0, 0, 4, 0]
+
+
+def test_rolling_window_sums_before_dividing():
+    db = FakeDB(ROWS)
+
+    trend = sentiment_trend(db, start=date(2024, 1, 2), end=date(2024, 1, 5), window=2)
+
+    # the window of the first bucket reaches back before start
+    assert db.params["start"] == date(2024, 1, 1)
+    sql = trend.loc["SQL"]
+    assert [b.day for b in sql.index] == [2, 3, 4]
+    assert list(sql["n"]) == [3, 1, 1]
+    # (1.0 - 1.0) / 3, not the mean of the daily averages (0.5 and -1.0)
+    assert sql["avg_compound"].iloc[0] == 0.0
+    assert sql["cr"].iloc[0] == pytest.approx(2 / 2)
+
+
+def test_weekly_buckets_start_on_monday():
+    db = FakeDB([row("SQL", date(2024, 1, 1), 3, 0.3)])
+
+    trend = sentiment_trend(db, period="week", start=date(2024, 1, 3))
+
+    assert db.params["start"] == date(2024, 1, 1)
+    assert list(trend.loc["SQL"].index) == [pd.Timestamp(2024, 1, 1)]
+
+
+def test_no_rows():
+    trend = sentiment_trend(FakeDB([]), start=date(2024, 1, 1))
+
+    assert trend.empty
+    assert list(trend.columns) == ["avg_compound", "swe", "cr", "n"]
@@ -0,0 +1,29 @@
+"""The rollup triggers classify comments in SQL with literal thresholds; they
+must match the ones the Python metrics use."""
+
+import glob
+import os
+import re
+
+import pytest
+
+from usefulness_index import NEGATIVE_THRESHOLD, POSITIVE_THRESHOLD
+
+SQL_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "src", "sql")
+SQL_FILES = sorted(glob.glob(os.path.join(SQL_DIR, "**", "*.sql"), recursive=True))
+COMPARISON = re.compile(r"vader_compound\s*(>=|<=)\s*(-?\d+(?:\.\d+)?)")
+
+
+@pytest.mark.parametrize("path", SQL_FILES, ids=os.path.basename)
+def test_sql_thresholds_match_python(path):
+    with open(path, encoding="utf-8") as f:
+        comparisons = COMPARISON.findall(f.read())
+
+    expected = {">=": POSITIVE_THRESHOLD, "<=": NEGATIVE_THRESHOLD}
+    for operator, value in comparisons:
+        assert float(value) == expected[operator], f"{operator} {value}"
+
+
+def test_thresholds_are_found():
+    with open(os.path.join(SQL_DIR, "schema.sql"), encoding="utf-8") as f:
+        assert len(COMPARISON.findall(f.read())) == 4
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from thread_tree import ThreadTree, load_thread_tree, thread_tree_populate
+
+# thread 0:          thread 1:
+#   a                  e
+#   ├── b              (f answers a comment that was never collected)
+#   │   └── d
+#   └── c
+COMMENTS = [
+    # thread, comment id, parent id, created, compound
+    (0, "a", "t3_p0", 100.0, 0.5),
+    (0, "b", "t1_a", 160.0, -0.5),
+    (0, "c", "t1_a", 130.0, 0.1),
+    (0, "d", "t1_b", 200.0, np.nan),
+    (1, "e", "t3_p1", 50.0, 0.0),
+    (1, "f", "t1_zzz", 70.0, 0.2),
+]
+
+
+def tree():
+    thread, ids, parents, created, compound = zip(*COMMENTS)
+    return ThreadTree(["p0", "p1", "p2"], thread, ids, parents, created, compound)
+
+
+def by_id(tree, values):
+    return dict(zip((np.base_repr(i, 36).lower() for i in tree.ids), values))
+
+
+def test_structure():
+    t = tree()
+
+    assert by_id(t, t.depth) == {"a": 0, "b": 1, "c": 1, "d": 2, "e": 0, "f": 0}
+    assert by_id(t, t.reply_counts) == {"a": 2, "b": 1, "c": 0, "d": 0, "e": 0, "f": 0}
+    assert by_id(t, t.subtree_sizes()) == {
+        "a": 4,
+        "b": 2,
+        "c": 1,
+        "d": 1,
+        "e": 1,
+        "f": 1,
+    }
+    first_reply = by_id(t, t.first_reply_seconds())
+    assert first_reply["a"] == 30.0
+    assert first_reply["b"] == 40.0
+    assert np.isnan(first_reply["c"])
+
+
+def test_thread_metrics():
+    rows = tree().thread_metrics([90.0, 40.0, 0.0]).to_pylist()
+
+    # p2 has no comments and gets no row
+    assert [row["post_id"] for row in rows] == ["p0", "p1"]
+    p0, p1 = rows
+    assert p0["n_comments"] == 4
+    assert p0["top_level_comments"] == 1
+    assert p0["max_depth"] == 2
+    assert p0["max_subtree_size"] == 4
+    assert p0["mean_compound"] == np.mean([0.5, -0.5, 0.1])
+    # b - a and c - a; d is not scored yet
+    assert np.isclose(p0["reply_drift"], np.mean([-1.0, -0.4]))
+    # d replies to the negative b but has no score
+    assert p0["negative_reply_compound"] is None
+    assert p0["first_comment_seconds"] == 10.0
+    assert p0["mean_first_reply_seconds"] == 35.0
+
+    assert p1["top_level_comments"] == 1
+    assert p1["max_subtree_size"] == 1
+    assert p1["reply_drift"] is None
+    assert p1["first_comment_seconds"] == 10.0
+
+
+class FakeDB:
+    def __init__(self, rows, failing=()):
+        self.rows = rows
+        self.failing = failing
+        self.loads = []
+
+    def fetch_all(self, query, params=None):
+        return [
+            {"subreddit_id": 1, "subreddit": "a"},
+            {"subreddit_id": 2, "subreddit": "b"},
+        ]
+
+    def stream(self, query, params, chunk_size):
+        if params["subreddit_id"] in self.failing:
+            raise ConnectionError("server closed the connection")
+        yield self.rows[:3]
+        yield self.rows[3:]
+
+    def bulk_load(self, table, rows, conflict_key, on_conflict):
+        self.loads.append(rows)
+        return rows.num_rows
+
+
+def stream_rows():
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "comment_id": comment_id,
+            "post_id": f"p{thread}",
+            "parent_id": parent_id,
+            "created_utc": created + timedelta(seconds=seconds),
+            "vader_compound": None if np.isnan(score) else score,
+            "post_created_utc": created + timedelta(seconds=10 * thread),
+        }
+        for thread, comment_id, parent_id, seconds, score in COMMENTS
+    ]
+
+
+def test_load_takes_threads_and_post_times_from_the_comment_stream():
+    tree, post_created = load_thread_tree(FakeDB(stream_rows()), 1)
+
+    assert list(tree.post_ids) == ["p0", "p1"]
+    assert post_created[1] - post_created[0] == 10.0
+    assert len(tree) == len(COMMENTS)
+
+
+def test_a_failing_subreddit_does_not_stop_the_others():
+    db = FakeDB(stream_rows(), failing={1})
+
+    thread_tree_populate(db)
+
+    assert [table.column("post_id").to_pylist() for table in db.loads] == [["p0", "p1"]]
@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+from usefulness_index import compute_metrics, usefulness_index
+
+
+def sums():
+    return [
+        {
+            "subreddit": "a",
+            "n": 4,
+            "sum_compound": 2.0,
+            "sum_weighted_compound": 3.0,
+            "positive_count": 3,
+            "negative_count": 0,
+            "sum_neutral_density": 4.0,
+            "n_cleaned": 4,
+        },
+        {
+            "subreddit": "b",
+            "n": 2,
+            "sum_compound": -1.0,
+            "sum_weighted_compound": -0.5,
+            "positive_count": 0,
+            "negative_count": 2,
+            "sum_neutral_density": 1.0,
+            "n_cleaned": 0,
+        },
+    ]
+
+
+def test_metrics_from_sums():
+    metrics = compute_metrics(sums())
+
+    assert metrics.loc["a", "avg_compound"] == 0.5
+    assert metrics.loc["a", "swe"] == 0.75
+    assert metrics.loc["a", "cr"] == 3.0
+    assert metrics.loc["b", "cr"] == 0.0
+    # no cleaned comments: no information density rather than a division by 0
+    assert pd.isna(metrics.loc["b", "id"])
+
+
+def test_partial_weights_keep_the_defaults_for_the_rest():
+    metrics = compute_metrics(sums())
+
+    index = usefulness_index(metrics, {"cr": 1.0})
+
+    # a tops C̄ and SWE (0.25 each at the defaults) and CR (weight 1.0); ID has
+    # a single value, so it normalizes to 0
+    assert index.loc["a", "usefulness_index"] == pytest.approx(1.5)
+    assert index.index[0] == "a"
+
+
+def test_unknown_weights_are_rejected():
+    with pytest.raises(ValueError, match="swe_typo"):
+        usefulness_index(compute_metrics(sums()), {"swe_typo": 1.0})